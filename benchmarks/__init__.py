@@ -0,0 +1,4 @@
+"""OwnSearch benchmarks.
+
+Run with ``python -m benchmarks``, see ``python -m benchmarks --help``.
+"""
@@ -0,0 +1,129 @@
+"""Run benchmarks and print results as JSON.
+
+Usage: python -m benchmarks [--pages N] [--output results.json]
+                            [--baseline old.json --threshold 0.1]
+
+With a baseline the run fails when any metric is worse than in the
+baseline by more than the threshold fraction.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import tempfile
+import time
+
+from .bench import (bench_bulk_index, bench_crawl, bench_index, bench_memory,
+                    bench_pruning, bench_query_direct, bench_query_http,
+                    make_queries)
+from .report import compare, load, save
+from .site import SiteServer, generate_documents, generate_site
+
+PARTS = ('crawl', 'index', 'query')
+
+
+def parse_args(argv):
+    """Parse command line."""
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--pages', type=int, default=1000,
+                        help='pages of synthetic site and indexed documents')
+    parser.add_argument('--fanout', type=int, default=10,
+                        help='links per page')
+    parser.add_argument('--page-size', type=int, default=2000,
+                        help='characters of text per page')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1,
+                        help='fraction of pages copying another page')
+    parser.add_argument('--workers', type=int, default=20,
+                        help='crawler workers')
+    parser.add_argument('--bulk-workers', type=int, default=0,
+                        help='processes of the bulk index builder')
+    parser.add_argument('--queries', type=int, default=500,
+                        help='number of queries to time')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8090,
+                        help='site port, /q is served on the next one')
+    parser.add_argument('--only', choices=PARTS, action='append',
+                        help='run only these benchmarks')
+    parser.add_argument('--output', help='save results to JSON file')
+    parser.add_argument('--baseline', help='results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed slowdown against the baseline')
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """Run selected benchmarks, return results."""
+    parts = args.only or PARTS
+    results = {'params': {'pages': args.pages,
+                          'fanout': args.fanout,
+                          'page_size': args.page_size,
+                          'duplicate_rate': args.duplicate_rate,
+                          'workers': args.workers,
+                          'bulk_workers': args.bulk_workers,
+                          'queries': args.queries,
+                          'seed': args.seed,
+                          'python': platform.python_version(),
+                          'time': time.time()}}
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    with tempfile.TemporaryDirectory() as tmp:
+        if 'crawl' in parts:
+            generate_site(tmp + '/site', args.pages, args.fanout,
+                          args.page_size, args.duplicate_rate, args.seed)
+            server = SiteServer(tmp + '/site', args.port)
+            server.start()
+            try:
+                results['crawl'] = bench_crawl(loop, server.url, args.pages,
+                                               args.workers)
+            finally:
+                server.shutdown()
+
+        if 'index' in parts or 'query' in parts:
+            documents = generate_documents(args.pages, args.page_size,
+                                           args.duplicate_rate,
+                                           seed=args.seed)
+            results['index'], text_index = bench_index(tmp + '/index',
+                                                       documents)
+            results['index']['memory'] = bench_memory(documents)
+            results['index']['bulk'] = bench_bulk_index(
+                tmp + '/bulk', documents, args.bulk_workers)
+            if 'index' not in parts:
+                del results['index']
+            if 'query' in parts:
+                queries = make_queries(args.queries, args.seed)
+                results['query'] = {
+                    'direct': bench_query_direct(text_index, queries),
+                    'multi_term': bench_pruning(
+                        text_index, make_queries(args.queries, args.seed,
+                                                 min_words=2, max_words=4)),
+                    'http': bench_query_http(loop, text_index, queries,
+                                             args.port + 1),
+                    'http_cached': bench_query_http(
+                        loop, text_index, queries, args.port + 1,
+                        cache=True)}
+            text_index.close()
+    loop.close()
+    return results
+
+
+def main(argv):
+    """Run benchmarks, compare with baseline."""
+    args = parse_args(argv)
+    results = run(args)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if args.output:
+        save(results, args.output)
+    if args.baseline:
+        regressions = compare(results, load(args.baseline), args.threshold)
+        for name, old, new in regressions:
+            print('Regression in {}: {:.3f} -> {:.3f}'.format(name, old, new),
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
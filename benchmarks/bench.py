@@ -0,0 +1,201 @@
+"""Crawler, indexer and query benchmarks."""
+
+import asyncio
+import random
+import time
+import tracemalloc
+
+import aiohttp
+from aiohttp import web
+
+from crawler.web_crawler import WebCrawler
+from indexer import TextIndex
+from indexer.bulk import build_index
+from indexer.segment import MemorySegment
+from indexer.text_index import document_terms, term_positions
+from own_search.cache import QueryCache
+from own_search.views import query
+
+from .report import latency_summary
+from .site import make_text, make_vocabulary
+
+
+@asyncio.coroutine
+def _crawl(loop, url, pages, workers, timeout):
+    done = asyncio.Event(loop=loop)
+    crawled = []
+
+    def consumer(link, title, text, **kwargs):
+        crawled.append(link)
+        if len(crawled) >= pages:
+            done.set()
+
+    # One local host, let all workers fetch from it
+    crawler = WebCrawler(loop=loop, workers=workers,
+                         politeness={'initial_concurrency': workers,
+                                     'max_concurrency': workers})
+    crawler.register_consumer(consumer)
+    start = time.monotonic()
+    crawler.add_urls([url])
+    crawler.create_workers()
+    try:
+        yield from asyncio.wait_for(done.wait(), timeout, loop=loop)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.monotonic() - start
+    crawler.close()
+    return len(crawled), elapsed
+
+
+def bench_crawl(loop, url, pages, workers=20, timeout=300):
+    """Crawl synthetic site, measure pages per second."""
+    crawled, elapsed = loop.run_until_complete(
+        _crawl(loop, url, pages, workers, timeout))
+    return {'pages_count': crawled,
+            'seconds': elapsed,
+            'pages_per_sec': crawled / elapsed}
+
+
+def bench_index(path, documents):
+    """Index documents into new index at path, flush it to disk.
+
+    Return results and the open index.
+    """
+    text_index = TextIndex(path)
+    start = time.monotonic()
+    for i, (title, text) in enumerate(documents):
+        text_index.index_document('http://127.0.0.1/page/{}.html'.format(i),
+                                  title, text)
+    elapsed = time.monotonic() - start
+    start = time.monotonic()
+    text_index.dump()
+    flush = time.monotonic() - start
+    return {'docs_count': len(documents),
+            'docs_per_sec': len(documents) / elapsed,
+            'flush_ms': flush * 1000}, text_index
+
+
+def bench_bulk_index(path, documents, workers=0):
+    """Build index at path from documents with the bulk builder."""
+    records = [{'url': 'http://127.0.0.1/page/{}.html'.format(i),
+                'title': title, 'text': text}
+               for i, (title, text) in enumerate(documents)]
+    start = time.monotonic()
+    build_index(records, path, workers=workers)
+    elapsed = time.monotonic() - start
+    return {'docs_per_sec': len(documents) / elapsed}
+
+
+def bench_memory(documents):
+    """Measure bytes per document buffered in memory before a flush.
+
+    Allocations are traced while documents are added to a memory
+    segment, including their stored text. text_bytes_per_doc is the
+    size of the UTF-8 text alone.
+    """
+    analyzed = []
+    for i, (title, text) in enumerate(documents):
+        # Encoded, so the stored strings are allocated while tracing
+        fields = [('link', 'http://127.0.0.1/page/{}.html'.format(i)),
+                  ('title', title), ('summary', text)]
+        positions = term_positions(document_terms(title, text))
+        analyzed.append(([(name, value.encode('utf-8'))
+                          for name, value in fields], positions))
+    text_size = sum(len(value) for fields, _ in analyzed
+                    for name, value in fields if name != 'link')
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        segment = MemorySegment()
+        for fields, positions in analyzed:
+            segment.add({name: value.decode('utf-8')
+                         for name, value in fields},
+                        {term: len(p) for term, p in positions.items()},
+                        positions)
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {'bytes_per_doc': size / len(documents),
+            'text_bytes_per_doc': text_size / len(documents)}
+
+
+def make_queries(count, seed=0, min_words=1, max_words=3):
+    """Make queries of min_words to max_words words of site frequencies.
+
+    seed must be the one documents were generated with.
+    """
+    vocabulary = make_vocabulary(5000, random.Random(seed))
+    rng = random.Random(seed + 1)
+    return [make_text(vocabulary, rng.randint(min_words, max_words), rng)
+            for _ in range(count)]
+
+
+def bench_query_direct(text_index, queries):
+    """Latency of TextIndex.query calls."""
+    latencies = []
+    for query_text in queries:
+        start = time.monotonic()
+        text_index.query(query_text, match_count=10)
+        latencies.append(time.monotonic() - start)
+    return latency_summary(latencies)
+
+
+def bench_pruning(text_index, queries):
+    """Latency of queries scoring all matches and pruned ones.
+
+    Pruning starts right away instead of after EXACT_TOTAL matches.
+    Results of both must be the same, AssertionError is raised if not.
+    """
+    latencies = {'exhaustive': [], 'pruned': []}
+    pruning = text_index.pruning
+    try:
+        for query_text in queries:
+            pages = []
+            for name in ('exhaustive', 'pruned'):
+                text_index.pruning = name == 'pruned'
+                start = time.monotonic()
+                pages.append(text_index.query(query_text, match_count=10,
+                                              exact_total=0))
+                latencies[name].append(time.monotonic() - start)
+            assert pages[0]['items'] == pages[1]['items'], query_text
+    finally:
+        text_index.pruning = pruning
+    return {name: latency_summary(values)
+            for name, values in latencies.items()}
+
+
+@asyncio.coroutine
+def _query_http(loop, text_index, queries, port, cache):
+    app = web.Application(loop=loop)
+    app['text_index'] = text_index
+    if cache:
+        app['query_cache'] = QueryCache()
+    app.router.add_post('/q', query)
+    handler = app.make_handler()
+    server = yield from loop.create_server(handler, '127.0.0.1', port)
+    session = aiohttp.ClientSession(loop=loop)
+    url = 'http://127.0.0.1:{}/q'.format(port)
+    latencies = []
+    try:
+        for query_text in queries:
+            start = time.monotonic()
+            resp = yield from session.post(url, data={'query': query_text})
+            yield from resp.read()
+            resp.release()
+            latencies.append(time.monotonic() - start)
+    finally:
+        session.close()
+        server.close()
+        yield from server.wait_closed()
+        yield from app.shutdown()
+        yield from handler.shutdown(1.0)
+        yield from app.cleanup()
+    return latencies
+
+
+def bench_query_http(loop, text_index, queries, port=8091, cache=False):
+    """Latency percentiles of /q requests."""
+    latencies = loop.run_until_complete(
+        _query_http(loop, text_index, queries, port, cache))
+    return latency_summary(latencies)
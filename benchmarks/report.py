@@ -0,0 +1,71 @@
+"""Benchmark results: percentiles and comparison with a baseline."""
+
+import json
+import math
+
+
+def percentile(values, p):
+    """Nearest rank percentile of values, p in 0..100."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, int(math.ceil(p / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds):
+    """p50, p95 and p99 of latencies in milliseconds."""
+    return {'p{}_ms'.format(p): percentile(seconds, p) * 1000
+            for p in (50, 95, 99)}
+
+
+def higher_is_better(metric):
+    """Throughput metrics grow, latencies and sizes shrink."""
+    return metric.endswith('_per_sec')
+
+
+def flatten(results, prefix=''):
+    """Map dotted metric names to numbers."""
+    metrics = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            metrics.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and \
+                not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+
+def compare(results, baseline, threshold=0.1):
+    """List (metric, baseline, current) of metrics worse by threshold.
+
+    Only metrics measured in both runs are compared, run parameters in
+    the params section are skipped.
+    """
+    current = flatten(results)
+    previous = flatten(baseline)
+    regressions = []
+    for name in sorted(set(current) & set(previous)):
+        if name.startswith('params.') or name.endswith('_count'):
+            continue
+        old, new = previous[name], current[name]
+        if higher_is_better(name):
+            worse = new < old * (1 - threshold)
+        else:
+            worse = new > old * (1 + threshold)
+        if worse:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def load(filename):
+    """Load results saved by an earlier run."""
+    with open(filename, 'r') as f:
+        return json.load(f)
+
+
+def save(results, filename):
+    """Save results as JSON."""
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,123 @@
+"""Synthetic website for crawler and index benchmarks."""
+
+import http.server
+import os
+import random
+import socketserver
+from threading import Thread
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<h1>{title}</h1>
+<p>{text}</p>
+<ul>
+{links}
+</ul>
+</body>
+</html>
+'''
+
+
+def make_vocabulary(size, rng):
+    """Random pronounceable words."""
+    consonants = 'bcdfghklmnprstvz'
+    vowels = 'aeiou'
+    words = set()
+    while len(words) < size:
+        length = rng.randint(2, 5)
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels)
+                          for _ in range(length)))
+    return sorted(words)
+
+
+def make_text(vocabulary, words, rng):
+    """Text with skewed word frequencies, few words are very common."""
+    last = len(vocabulary) - 1
+    return ' '.join(vocabulary[int(last * rng.random() ** 3)]
+                    for _ in range(words))
+
+
+def generate_documents(pages, page_size=2000, duplicate_rate=0.0,
+                       vocabulary_size=5000, seed=0):
+    """Generate (title, text) of pages.
+
+    page_size is approximate text size in characters, a duplicate_rate
+    fraction of pages repeats the text of an earlier page.
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    words = max(1, page_size // 8)
+    documents = []
+    for i in range(pages):
+        if documents and rng.random() < duplicate_rate:
+            title, text = rng.choice(documents)
+        else:
+            title = make_text(vocabulary, 4, rng).title()
+            text = make_text(vocabulary, words, rng)
+        documents.append((title, text))
+    return documents
+
+
+def page_path(i):
+    """Site path of page number i."""
+    return '/index.html' if i == 0 else '/page/{}.html'.format(i)
+
+
+def generate_site(path, pages, fanout=10, page_size=2000,
+                  duplicate_rate=0.0, seed=0):
+    """Write static site of linked pages to directory path.
+
+    Every page links to the next one, so the whole site is reachable from
+    /index.html, and to fanout - 1 random pages. Return number of pages.
+    """
+    rng = random.Random(seed)
+    documents = generate_documents(pages, page_size, duplicate_rate,
+                                   seed=seed)
+    os.makedirs(os.path.join(path, 'page'), exist_ok=True)
+    for i, (title, text) in enumerate(documents):
+        targets = [(i + 1) % pages] + [rng.randrange(pages)
+                                       for _ in range(fanout - 1)]
+        links = '\n'.join('<li><a href="{0}">{0}</a></li>'.format(
+            page_path(target)) for target in targets)
+        with open(path + page_path(i), 'w', encoding='utf-8') as f:
+            f.write(PAGE.format(title=title, text=text, links=links))
+    return pages
+
+
+class SiteServer(Thread):
+    """Serve directory over HTTP in a background thread."""
+
+    def __init__(self, path, port=8090):
+        """Init server thread."""
+        super().__init__(daemon=True)
+        self.port = port
+        root = os.path.abspath(path)
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            def translate_path(self, request_path):
+                path = super().translate_path(request_path)
+                return os.path.join(root, os.path.relpath(path))
+
+            def log_message(self, *args):
+                pass
+
+        socketserver.TCPServer.allow_reuse_address = True
+        self.httpd = socketserver.ThreadingTCPServer(('127.0.0.1', port),
+                                                     Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        """Start page URL."""
+        return 'http://127.0.0.1:{}/index.html'.format(self.port)
+
+    def run(self):
+        """Serve until shutdown."""
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """Stop serving."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
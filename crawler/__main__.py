@@ -0,0 +1,103 @@
+"""Crawl pages without serving search, write them to a document stream.
+
+Usage: python -m crawler [--config config/own_search.yaml]
+                         [--output crawl.jsonl.gz] [URL ...]
+
+Crawler settings are taken from the crawler section of the config and
+URLs default to its start_url. Pages are appended to the output stream,
+build an index from it with python -m indexer.bulk. The crawl runs until
+no URL is left or it is interrupted, pages in flight are written first.
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import time
+
+import yaml
+
+from indexer.stream import StreamWriter
+
+from .frontier import DiskFrontier
+from .web_crawler import WebCrawler
+
+log = logging.getLogger(__name__)
+
+
+def parse_args(argv):
+    """Parse command line."""
+    parser = argparse.ArgumentParser(prog='python -m crawler')
+    parser.add_argument('urls', nargs='*', metavar='URL',
+                        help='URLs to start from instead of start_url')
+    parser.add_argument('--config', default='config/own_search.yaml')
+    parser.add_argument('--output', default='crawl.jsonl.gz',
+                        help='document stream, appended to if it exists')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='documents per compressed chunk')
+    return parser.parse_args(argv)
+
+
+def make_consumer(writer):
+    """Crawler consumer appending pages to stream writer."""
+    def consumer(url, title, text, etag=None, last_modified=None,
+                 **kwargs):
+        writer.write(url, title, text, etag=etag,
+                     last_modified=last_modified, crawled=time.time())
+    return consumer
+
+
+def on_signals(loop, callback):
+    """Call callback in loop on SIGINT or SIGTERM.
+
+    Loops without signal handlers, as on Windows, get callback scheduled
+    by a plain signal handler.
+    """
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, callback)
+        except NotImplementedError:
+            signal.signal(signum, lambda *args:
+                          loop.call_soon_threadsafe(callback))
+
+
+def main(argv):
+    """Run crawl."""
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    with open(args.config, 'rt') as f:
+        conf = yaml.load(f)
+
+    loop = asyncio.get_event_loop()
+    crawler_conf = dict(conf.get('crawler', {}))
+    frontier_conf = crawler_conf.pop('frontier', None)
+    if frontier_conf is not None:
+        crawler_conf['frontier'] = DiskFrontier(loop=loop, **frontier_conf)
+    crawler = WebCrawler(loop=loop, **crawler_conf)
+    writer = StreamWriter(args.output, chunk_size=args.chunk_size)
+    crawler.register_consumer(make_consumer(writer))
+    crawler.add_urls(args.urls or [conf['start_url']])
+    crawler.create_workers()
+
+    done = loop.create_task(crawler.join())
+    on_signals(loop, done.cancel)
+    try:
+        loop.run_until_complete(done)
+        log.info('Crawl finished, %d pages queued', crawler.queued_pages)
+        dropped = getattr(crawler.frontier, 'dropped', 0)
+        if dropped:
+            log.warning('%d URLs dropped by full frontier', dropped)
+    except asyncio.CancelledError:
+        log.info('Interrupted, finishing pages in flight')
+    try:
+        loop.run_until_complete(
+            crawler.shutdown(conf.get('shutdown_timeout', 10)))
+    finally:
+        writer.close()
+        loop.close()
+    log.info('Wrote %d pages to %s', writer.count, args.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,306 @@
+"""Crawl frontier: queue of URLs to visit and the set of seen URLs.
+
+Every queued URL keeps its depth, the number of links followed to it
+from the URLs added first, until the URL is processed.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import sqlite3
+import struct
+import time
+from collections import deque
+
+BLOOM_HEADER = struct.Struct('<QQQ')
+
+log = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Probabilistic set of strings without false negatives."""
+
+    def __init__(self, capacity, error_rate=0.001):
+        """Size filter for capacity items at given false positive rate."""
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(
+            self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        """Bit positions of item, double hashing of one digest."""
+        digest = hashlib.sha1(item.encode('utf-8')).digest()
+        h1, h2 = struct.unpack_from('<QQ', digest)
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item):
+        """Add item, return False if it was (probably) already present."""
+        new = False
+        for pos in self._positions(item):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item):
+        """Check item presence."""
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+    def to_bytes(self):
+        """Serialize filter."""
+        return BLOOM_HEADER.pack(self.size, self.hashes,
+                                 self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data, capacity, error_rate):
+        """Restore serialized filter."""
+        bloom = cls(capacity, error_rate)
+        bloom.size, bloom.hashes, bloom.count = \
+            BLOOM_HEADER.unpack_from(data)
+        bloom.bits = bytearray(data[BLOOM_HEADER.size:])
+        return bloom
+
+
+class MemoryFrontier:
+    """In-memory frontier with exact URL deduplication.
+
+    With max_size at most that many URLs are queued, the rest are dropped
+    and not marked as seen, so they may be added again later. Dropped
+    URLs are counted, a warning is logged each time the queue fills up.
+    """
+
+    def __init__(self, loop=None, max_size=None):
+        """Init queue and seen set."""
+        self.seen = set()
+        self.max_size = max_size
+        self.queue = asyncio.Queue(loop=loop)
+        self.in_progress = {}
+        self.dropped = 0
+        self._dropping = False
+
+    def _full(self):
+        """Check if URL can not be queued, count it as dropped if so."""
+        if self.max_size is None or self.queue.qsize() < self.max_size:
+            self._dropping = False
+            return False
+        if not self._dropping:
+            log.warning('Frontier is full at %d URLs, dropping new ones',
+                        self.max_size)
+            self._dropping = True
+        self.dropped += 1
+        return True
+
+    def add(self, urls, depth=0):
+        """Queue not yet seen URLs at depth, return the new ones."""
+        new = []
+        for url in urls:
+            if url not in self.seen and not self._full():
+                self.seen.add(url)
+                self.queue.put_nowait((url, depth))
+                new.append(url)
+        return new
+
+    def requeue(self, urls):
+        """Queue URLs even if they were seen before, at depth zero."""
+        for url in urls:
+            if not self._full():
+                self.seen.add(url)
+                self.queue.put_nowait((url, 0))
+
+    @asyncio.coroutine
+    def get(self):
+        """Get next URL to crawl."""
+        url, depth = yield from self.queue.get()
+        self.in_progress[url] = depth
+        return url
+
+    def depth(self, url):
+        """Depth of URL got from the frontier and not processed yet."""
+        return self.in_progress.get(url, 0)
+
+    def task_done(self, url):
+        """Mark URL got from the frontier as processed."""
+        self.in_progress.pop(url, None)
+        self.queue.task_done()
+
+    @asyncio.coroutine
+    def join(self):
+        """Wait until every queued URL is processed."""
+        yield from self.queue.join()
+
+    def qsize(self):
+        """Count queued URLs."""
+        return self.queue.qsize()
+
+    def checkpoint(self):
+        """Nothing to persist."""
+
+    def close(self):
+        """Nothing to release."""
+
+
+class DiskFrontier:
+    """Frontier that spills to SQLite and survives restarts.
+
+    Seen URLs are kept in a Bloom filter, so memory use does not depend on
+    URL length and a small fraction of new URLs (error_rate) is skipped as
+    already seen. Up to memory_size queued URLs are held in memory, the
+    rest go to the database in FIFO order, with their depths.
+
+    Every checkpoint_interval seconds the in-memory queue, URLs being
+    crawled and the Bloom filter are committed in one transaction, a
+    restarted crawler continues from the last checkpoint.
+    """
+
+    def __init__(self, path, capacity=10 ** 7, error_rate=0.001,
+                 memory_size=10000, checkpoint_interval=30, loop=None):
+        """Open or create frontier database."""
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.memory_size = memory_size
+        self.checkpoint_interval = checkpoint_interval
+        self.memory = deque()
+        self.in_progress = {}
+        self.spilled = 0
+        self._ready = asyncio.Event(loop=loop)
+        self._finished = asyncio.Event(loop=loop)
+        self._last_checkpoint = time.monotonic()
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT,
+                depth INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS pending (
+                url TEXT, depth INTEGER NOT NULL DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY, value BLOB);
+        ''')
+        self._add_depth_columns()
+        self._restore()
+
+    def _add_depth_columns(self):
+        """Upgrade database created before depths were stored."""
+        for table in ('queue', 'pending'):
+            columns = [row[1] for row in self.db.execute(
+                'PRAGMA table_info({})'.format(table))]
+            if 'depth' not in columns:
+                self.db.execute(
+                    'ALTER TABLE {} ADD COLUMN '
+                    'depth INTEGER NOT NULL DEFAULT 0'.format(table))
+
+    def _restore(self):
+        """Load state saved by the last checkpoint."""
+        row = self.db.execute(
+            "SELECT value FROM state WHERE key = 'bloom'").fetchone()
+        if row is None:
+            self.bloom = BloomFilter(self.capacity, self.error_rate)
+        else:
+            self.bloom = BloomFilter.from_bytes(row[0], self.capacity,
+                                                self.error_rate)
+        self.memory.extend(self.db.execute(
+            'SELECT url, depth FROM pending'))
+        self.spilled = self.db.execute(
+            'SELECT COUNT(*) FROM queue').fetchone()[0]
+        if self.qsize():
+            self._ready.set()
+        else:
+            self._finished.set()
+
+    def add(self, urls, depth=0):
+        """Queue not yet seen URLs at depth, return the new ones."""
+        new = [url for url in urls if self.bloom.add(url)]
+        self._queue(new, depth)
+        return new
+
+    def requeue(self, urls):
+        """Queue URLs even if they were seen before, at depth zero."""
+        for url in urls:
+            self.bloom.add(url)
+        self._queue(urls, 0)
+
+    def _queue(self, urls, depth):
+        for url in urls:
+            if self.spilled or len(self.memory) >= self.memory_size:
+                self.db.execute(
+                    'INSERT INTO queue (url, depth) VALUES (?, ?)',
+                    (url, depth))
+                self.spilled += 1
+            else:
+                self.memory.append((url, depth))
+        if urls:
+            self._ready.set()
+            self._finished.clear()
+
+    def _refill(self):
+        """Move oldest spilled URLs back to memory."""
+        rows = self.db.execute(
+            'SELECT id, url, depth FROM queue ORDER BY id LIMIT ?',
+            (self.memory_size,)).fetchall()
+        if rows:
+            self.db.execute('DELETE FROM queue WHERE id <= ?',
+                            (rows[-1][0],))
+            self.memory.extend((url, depth) for _, url, depth in rows)
+        self.spilled -= len(rows)
+
+    @asyncio.coroutine
+    def get(self):
+        """Get next URL to crawl."""
+        while True:
+            if not self.memory and self.spilled:
+                self._refill()
+            if self.memory:
+                url, depth = self.memory.popleft()
+                self.in_progress[url] = depth
+                return url
+            self._ready.clear()
+            yield from self._ready.wait()
+
+    def depth(self, url):
+        """Depth of URL got from the frontier and not processed yet."""
+        return self.in_progress.get(url, 0)
+
+    def task_done(self, url):
+        """Mark URL as processed, checkpoint when it is time."""
+        self.in_progress.pop(url, None)
+        if not self.in_progress and not self.qsize():
+            self._finished.set()
+        if time.monotonic() - self._last_checkpoint >= \
+                self.checkpoint_interval:
+            self.checkpoint()
+
+    @asyncio.coroutine
+    def join(self):
+        """Wait until every queued URL is processed."""
+        yield from self._finished.wait()
+
+    def qsize(self):
+        """Count queued URLs."""
+        return len(self.memory) + self.spilled
+
+    def checkpoint(self):
+        """Commit queue state and seen URLs atomically."""
+        with self.db:
+            self.db.execute('DELETE FROM pending')
+            self.db.executemany(
+                'INSERT INTO pending (url, depth) VALUES (?, ?)',
+                list(self.in_progress.items()) + list(self.memory))
+            self.db.execute(
+                "INSERT OR REPLACE INTO state (key, value) "
+                "VALUES ('bloom', ?)", (self.bloom.to_bytes(),))
+        self._last_checkpoint = time.monotonic()
+
+    def close(self):
+        """Checkpoint and close database."""
+        self.checkpoint()
+        self.db.close()
@@ -0,0 +1,246 @@
+"""Per host crawl scheduling."""
+
+import asyncio
+import time
+from collections import deque
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+
+def origin(url):
+    """Scheme and host part of URL."""
+    parsed = urlparse(url)
+    return '{}://{}'.format(parsed.scheme, parsed.netloc)
+
+
+def parse_crawl_delay(content, user_agent):
+    """Get Crawl-delay for user agent from robots.txt content.
+
+    RobotFileParser accepts integer delays only and has no crawl_delay
+    before Python 3.6.
+    """
+    delays = {}
+    agents = []
+    in_rules = False
+    for line in content.splitlines():
+        line = line.split('#', 1)[0]
+        if ':' not in line:
+            continue
+        field, value = (part.strip() for part in line.split(':', 1))
+        field = field.lower()
+        if field == 'user-agent':
+            if in_rules:
+                agents = []
+                in_rules = False
+            agents.append(value.lower())
+        else:
+            in_rules = True
+            if field == 'crawl-delay':
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for agent in agents:
+                    delays[agent] = delay
+
+    user_agent = user_agent.lower()
+    for agent, delay in delays.items():
+        if agent != '*' and agent in user_agent:
+            return delay
+    return delays.get('*')
+
+
+class HostState:
+    """Queue, robots rules and concurrency limit of one host."""
+
+    def __init__(self, concurrency, crawl_delay):
+        """Init host state."""
+        self.queue = deque()
+        self.concurrency = concurrency
+        self.crawl_delay = crawl_delay
+        self.active = 0
+        self.next_fetch = 0
+        self.robots = None
+        self.robots_ready = False
+        self.latency = None
+        self.errors = 0
+
+    def ready(self, now):
+        """Check if a URL of this host may be fetched now."""
+        return (self.robots_ready and self.queue and
+                self.active < int(self.concurrency) and
+                now >= self.next_fetch)
+
+
+class HostScheduler:
+    """Hand out frontier URLs to workers host by host.
+
+    URLs taken from the frontier are spread over per host queues, at most
+    max_buffered of them at a time. Workers rotate over hosts which are
+    ready: robots.txt is loaded, crawl delay passed and the number of
+    active fetches is below the host concurrency limit.
+
+    The limit follows AIMD: every fast successful fetch adds
+    increase / limit to it (about +increase per round of requests), a
+    failed or slower than target_latency fetch multiplies it by decrease.
+
+    fetch_robots(origin) is a coroutine returning robots.txt content or
+    None when it is not available. Without it every URL is allowed.
+    """
+
+    def __init__(self, frontier, loop=None, fetch_robots=None,
+                 user_agent='OwnSearch', max_buffered=1000,
+                 initial_concurrency=2, max_concurrency=8, crawl_delay=0,
+                 target_latency=2.0, increase=1.0, decrease=0.5):
+        """Init scheduler."""
+        if loop is None:
+            self.loop = asyncio.get_event_loop()
+        else:
+            self.loop = loop
+
+        self.frontier = frontier
+        self.fetch_robots = fetch_robots
+        self.user_agent = user_agent
+        self.max_buffered = max_buffered
+        self.initial_concurrency = initial_concurrency
+        self.max_concurrency = max_concurrency
+        self.crawl_delay = crawl_delay
+        self.target_latency = target_latency
+        self.increase = increase
+        self.decrease = decrease
+
+        self.hosts = {}
+        self.rotation = deque()
+        self.buffered = 0
+        self._changed = asyncio.Event(loop=self.loop)
+        self._space = asyncio.Event(loop=self.loop)
+        self._space.set()
+        self._feeder = None
+
+    def start(self):
+        """Start moving URLs from frontier to host queues."""
+        if self._feeder is None:
+            self._feeder = self.loop.create_task(self._feed())
+
+    def stop(self):
+        """Stop taking URLs from frontier."""
+        if self._feeder is not None:
+            self._feeder.cancel()
+            self._feeder = None
+
+    @asyncio.coroutine
+    def _feed(self):
+        while True:
+            while self.buffered >= self.max_buffered:
+                self._space.clear()
+                yield from self._space.wait()
+            url = yield from self.frontier.get()
+            self.put(url)
+
+    def put(self, url):
+        """Queue URL taken from frontier to its host."""
+        key = origin(url)
+        host = self.hosts.get(key)
+        if host is None:
+            host = HostState(self.initial_concurrency, self.crawl_delay)
+            self.hosts[key] = host
+            self.rotation.append(key)
+            if self.fetch_robots is None:
+                host.robots_ready = True
+            else:
+                self.loop.create_task(self._load_robots(key, host))
+        host.queue.append(url)
+        self.buffered += 1
+        self._changed.set()
+
+    @asyncio.coroutine
+    def _load_robots(self, key, host):
+        """Fetch and apply robots.txt rules of host."""
+        content = None
+        try:
+            content = yield from self.fetch_robots(key)
+        finally:
+            if content is not None:
+                self._apply_robots(host, content)
+            host.robots_ready = True
+            self._changed.set()
+
+    def _apply_robots(self, host, content):
+        robots = RobotFileParser()
+        robots.parse(content.splitlines())
+        host.robots = robots
+        crawl_delay = parse_crawl_delay(content, self.user_agent)
+        if crawl_delay is not None:
+            host.crawl_delay = max(host.crawl_delay, float(crawl_delay))
+
+    def _allowed(self, host, url):
+        return host.robots is None or \
+            host.robots.can_fetch(self.user_agent, url)
+
+    def _take(self, now):
+        """Take URL from the next ready host, None if no host is ready."""
+        for _ in range(len(self.rotation)):
+            key = self.rotation[0]
+            self.rotation.rotate(-1)
+            host = self.hosts[key]
+            while host.ready(now):
+                url = host.queue.popleft()
+                self._release_buffer()
+                if not self._allowed(host, url):
+                    self.frontier.task_done(url)
+                    continue
+                host.active += 1
+                host.next_fetch = now + host.crawl_delay
+                return url
+        return None
+
+    def _release_buffer(self):
+        self.buffered -= 1
+        self._space.set()
+
+    def _wait_time(self, now):
+        """Return seconds until a delayed host is ready, None if unknown."""
+        delays = [host.next_fetch - now for host in self.hosts.values()
+                  if host.queue and host.robots_ready and
+                  host.active < int(host.concurrency)]
+        return max(0, min(delays)) if delays else None
+
+    @asyncio.coroutine
+    def get(self):
+        """Get next URL to crawl."""
+        while True:
+            now = time.monotonic()
+            url = self._take(now)
+            if url is not None:
+                return url
+            self._changed.clear()
+            try:
+                yield from asyncio.wait_for(self._changed.wait(),
+                                            self._wait_time(now),
+                                            loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+
+    def task_done(self, url, latency=None, ok=True):
+        """Record fetch result of URL and adjust its host limit."""
+        host = self.hosts[origin(url)]
+        host.active -= 1
+        if latency is not None:
+            if host.latency is None:
+                host.latency = latency
+            else:
+                host.latency = 0.8 * host.latency + 0.2 * latency
+        if not ok:
+            host.errors += 1
+        if ok and (latency is None or latency <= self.target_latency):
+            host.concurrency = min(
+                self.max_concurrency,
+                host.concurrency + self.increase / host.concurrency)
+        else:
+            host.concurrency = max(1, host.concurrency * self.decrease)
+        self.frontier.task_done(url)
+        self._changed.set()
+
+    def qsize(self):
+        """Count URLs waiting in host queues."""
+        return self.buffered
@@ -1,28 +1,83 @@
 """Recursive web crawler."""
 
 import asyncio
+import codecs
+import time
+from concurrent.futures import ProcessPoolExecutor
 from html.parser import HTMLParser
 from urllib.parse import urljoin, urlparse
 
 import aiohttp
 import async_timeout
 
+from metrics import counter, gauge, histogram
+
+from .frontier import MemoryFrontier
+from .politeness import HostScheduler
+
 ALLOWED_STATUS_CODES = (200,)
 ALLOWED_MIME_TYPES = ('text/plain',
                       'text/html',
                       )
+USER_AGENT = 'OwnSearch'
+
+PAGES = counter('crawler_pages_total', 'Pages passed to consumer.')
+ERRORS = counter('crawler_errors_total', 'Pages not crawled by reason.',
+                 ['reason'])
+FETCH_SECONDS = histogram('crawler_fetch_seconds',
+                          'Time to download and decode page body.')
+PARSE_SECONDS = histogram('crawler_parse_seconds',
+                          'Time to finish parsing downloaded page.')
+CRAWL_SECONDS = histogram('crawler_crawl_seconds',
+                          'Time worker spent on one URL.')
+QUEUE_SIZE = gauge('crawler_queue_size', 'URLs or pages waiting.',
+                   ['queue'])
 
 
 class InvalidURL(RuntimeError):
-    """Invalid error exception."""
+    """Invalid error exception.
+
+    The first argument is a short reason counted in crawler metrics.
+    """
+
+    @property
+    def reason(self):
+        """Why page was not crawled."""
+        return self.args[0] if self.args else 'other'
+
+
+class HostError(InvalidURL):
+    """Host failed to serve the page: network error, timeout or overload."""
+
+
+class NotModified(InvalidURL):
+    """Page did not change since it was indexed."""
+
+
+def recrawl_priority(fields, now=None):
+    """Estimate how often document changes, in changes per day.
+
+    Pages which changed more often since they were first seen are
+    re-crawled first.
+    """
+    if now is None:
+        now = time.time()
+    age = max(0, now - fields.get('first_seen', now))
+    return (fields.get('changes', 0) + 1) / (age / 86400 + 1)
 
 
 class DataLinksHTMLParser(HTMLParser):
     """Handle html, store links, texts."""
 
-    def __init__(self, base_url=None):
-        """Init variables."""
+    def __init__(self, base_url=None, max_text=None):
+        """Init variables.
+
+        When max_text is set, text beyond that many characters is dropped
+        while links are still collected.
+        """
         self.base_url = base_url
+        self.max_text = max_text
+        self.text_size = 0
         self.ignore_data = []
         self.capture_title = False
         self.data = []
@@ -86,125 +141,440 @@ class DataLinksHTMLParser(HTMLParser):
             if data:
                 if self.capture_title:
                     self.title = data
-                else:
+                elif self.max_text is None:
+                    self.data.append(data)
+                elif self.text_size < self.max_text:
+                    data = data[:self.max_text - self.text_size]
+                    self.text_size += len(data) + 1
                     self.data.append(data)
 
 
+class PageParser:
+    """Decode page chunk by chunk and feed it to the HTML parser."""
+
+    def __init__(self, base_url, charset=None, max_text=None):
+        """Init decoder and parser."""
+        try:
+            self.decoder = codecs.getincrementaldecoder(charset or 'utf-8')()
+        except LookupError:
+            # Unknown charset
+            raise InvalidURL('charset')
+        self.parser = DataLinksHTMLParser(base_url=base_url,
+                                          max_text=max_text)
+
+    def feed(self, chunk, final=False):
+        """Decode and parse next chunk of page body."""
+        try:
+            self.parser.feed(self.decoder.decode(chunk, final))
+        except UnicodeDecodeError:
+            raise InvalidURL('decode')
+
+    def close(self, complete=True):
+        """Finish parsing, return title, text, internal & external links.
+
+        Incomplete multibyte sequence at the end of a truncated body is
+        dropped.
+        """
+        if complete:
+            self.feed(b'', final=True)
+        parser = self.parser
+        title = parser.title
+        text = ' '.join(parser.data)
+        internal = parser.internal_links
+        external = parser.external_links
+
+        parser.close()
+        return title, text, internal, external
+
+
+def parse_page(body, base_url, charset=None, max_text=None, tokenizer=None,
+               complete=True):
+    """Parse whole page body, run in parser worker processes.
+
+    Return title, text, internal & external links and document terms
+    produced by tokenizer(title, text) if it is given.
+    """
+    page = PageParser(base_url, charset, max_text)
+    page.feed(body)
+    title, text, internal, external = page.close(complete)
+    terms = None if tokenizer is None else tokenizer(title, text)
+    return title, text, internal, external, terms
+
+
 class WebCrawler:
     """Asynchronous web crawler."""
 
-    def __init__(self, workers=20, ignore_external=True, loop=None):
-        """Init crawler."""
+    def __init__(self, workers=20, ignore_external=True, loop=None,
+                 connections=100, connections_per_host=8, dns_cache_ttl=300,
+                 keepalive_timeout=30, chunk_size=64 * 1024,
+                 max_body_size=2 * 2 ** 20, truncate_body=True,
+                 max_text=256 * 1024, parse_workers=0, tokenizer=None,
+                 frontier=None, respect_robots=True, politeness=None,
+                 validators=None, max_pending_pages=100, max_queued_urls=None,
+                 max_pages=None, max_depth=None):
+        """Init crawler.
+
+        All workers share one HTTP session, so keep-alive connections and
+        resolved addresses are reused between pages.
+
+        Page bodies are streamed to the parser by chunk_size bytes. Bodies
+        larger than max_body_size bytes are truncated or, when
+        truncate_body is false, rejected. At most max_text characters of
+        page text are kept.
+
+        With parse_workers > 0 pages are read into memory and parsed in
+        a pool of that many processes, which also call
+        tokenizer(title, text) to pre-tokenize documents for the
+        consumer. By default pages are parsed on the event loop.
+
+        URLs to crawl are kept in frontier, in memory by default, and
+        handed out to workers by a per host scheduler which honors
+        robots.txt when respect_robots is set. politeness holds extra
+        HostScheduler arguments.
+
+        validators(url) returns stored fields of an already indexed page
+        or None. Their etag and last_modified make fetches conditional,
+        unchanged pages are skipped.
+
+        At most max_pending_pages crawled pages wait for the consumer,
+        workers block when it falls behind. The default in-memory
+        frontier holds at most max_queued_urls URLs. No more than
+        max_pages URLs are queued in total and links are followed to
+        max_depth clicks from the URLs added first.
+        """
         if loop is None:
             self.loop = asyncio.get_event_loop()
         else:
             self.loop = loop
 
+        connector = aiohttp.TCPConnector(
+            loop=self.loop,
+            limit=connections,
+            limit_per_host=connections_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+            keepalive_timeout=keepalive_timeout)
+        self.session = aiohttp.ClientSession(
+            connector=connector, loop=self.loop,
+            headers={'User-Agent': USER_AGENT})
+
+        self.chunk_size = chunk_size
+        self.max_body_size = max_body_size
+        self.truncate_body = truncate_body
+        self.max_text = max_text
+        self.tokenizer = tokenizer
+        if parse_workers:
+            self.executor = ProcessPoolExecutor(parse_workers)
+        else:
+            self.executor = None
+
         self.workers = workers
         self.ignore_external = ignore_external
-        self.handled_urls = set()
-        self.url_queue = asyncio.Queue()
-        self.text_queue = asyncio.Queue()
+        if frontier is None:
+            self.frontier = MemoryFrontier(loop=self.loop,
+                                           max_size=max_queued_urls)
+        else:
+            self.frontier = frontier
+        self.scheduler = HostScheduler(
+            self.frontier, loop=self.loop, user_agent=USER_AGENT,
+            fetch_robots=self._fetch_robots if respect_robots else None,
+            **(politeness or {}))
+        self.validators = validators
+        self.text_queue = asyncio.Queue(maxsize=max_pending_pages,
+                                        loop=self.loop)
         self.consumer = None
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.queued_pages = 0
+        self.stopping = False
+        self._worker_tasks = []
+        self._busy = set()
+        self._consumer_task = None
+        QUEUE_SIZE.set_function(self.frontier.qsize, queue='frontier')
+        QUEUE_SIZE.set_function(self.scheduler.qsize, queue='hosts')
+        QUEUE_SIZE.set_function(self.text_queue.qsize, queue='text')
+
+    def _budget(self, urls):
+        """Cut URLs to what is left of max_pages."""
+        if self.max_pages is None:
+            return list(urls)
+        return list(urls)[:max(0, self.max_pages - self.queued_pages)]
+
+    def add_urls(self, urls, depth=0):
+        """Queue URLs which were not seen before at depth."""
+        if self.max_pages is None:
+            new = self.frontier.add(urls, depth)
+        else:
+            new = []
+            for url in urls:
+                if self.queued_pages + len(new) >= self.max_pages:
+                    break
+                new.extend(self.frontier.add([url], depth))
+        self.queued_pages += len(new)
+        return new
+
+    def recrawl(self, documents):
+        """Queue indexed documents again, frequently changing first."""
+        now = time.time()
+        ordered = sorted(documents, reverse=True,
+                         key=lambda fields: recrawl_priority(fields, now))
+        links = self._budget(fields['link'] for fields in ordered)
+        self.queued_pages += len(links)
+        self.frontier.requeue(links)
 
     @asyncio.coroutine
     def worker(self):
         """Crawl worker."""
-        while True:
-            url = yield from self.url_queue.get()
+        task = asyncio.Task.current_task(loop=self.loop)
+        while not self.stopping:
+            url = yield from self.scheduler.get()
+            self._busy.add(task)
+            start = time.monotonic()
+            ok = False
             try:
-                title, text, internal, external = \
-                    yield from self._parse_url(url)
-            except InvalidURL:
-                continue
+                ok = yield from self._crawl(url)
+            finally:
+                self._busy.discard(task)
+                latency = time.monotonic() - start
+                CRAWL_SECONDS.observe(latency)
+                self.scheduler.task_done(url, latency, ok)
 
-            new_internal = internal.difference(self.handled_urls)
-            self.handled_urls.update(new_internal)
-            for ni in new_internal:
-                yield from self.url_queue.put(ni)
+    @asyncio.coroutine
+    def _crawl(self, url):
+        """Crawl single URL and queue its links.
 
+        Return False if the host failed to serve it.
+        """
+        depth = self.frontier.depth(url)
+        try:
+            title, text, internal, external, extra = \
+                yield from self._fetch(url)
+        except HostError as e:
+            ERRORS.inc(reason=e.reason)
+            return False
+        except InvalidURL as e:
+            ERRORS.inc(reason=e.reason)
+            return True
+
+        if self.max_depth is None or depth < self.max_depth:
+            self.add_urls(internal, depth + 1)
             if not self.ignore_external:
-                new_external = external.difference(self.handled_urls)
-                self.handled_urls.update(new_external)
-                for ne in new_external:
-                    yield from self.url_queue.put(ne)
+                self.add_urls(external, depth + 1)
 
-            # print(url)
-            yield from self.text_queue.put((url, title, text))
+        # print(url)
+        PAGES.inc()
+        yield from self.text_queue.put((url, title, text, extra))
+        return True
+
+    @asyncio.coroutine
+    def _fetch_robots(self, origin):
+        """Get robots.txt of host, None if it is not available."""
+        resp = None
+        try:
+            with async_timeout.timeout(10):
+                resp = yield from self.session.get(origin + '/robots.txt')
+                if resp.status != 200:
+                    return None
+                return (yield from resp.text())
+        except (asyncio.TimeoutError,
+                ValueError,
+                UnicodeDecodeError,
+                aiohttp.ClientError):
+            return None
+        finally:
+            if resp is not None:
+                resp.release()
+
+    @asyncio.coroutine
+    def _read_body(self, resp, feed):
+        """Stream response body to feed by chunks.
+
+        Return True when the whole body was read.
+        """
+        size = 0
+        while True:
+            chunk = yield from resp.content.read(self.chunk_size)
+            if not chunk:
+                return True
+
+            size += len(chunk)
+            if size > self.max_body_size:
+                if not self.truncate_body:
+                    raise InvalidURL('body_size')
+                feed(chunk[:len(chunk) - (size - self.max_body_size)])
+                return False
+
+            feed(chunk)
 
     @asyncio.coroutine
     def _parse_url(self, url, base_url=None):
         """Parse web page content for external & internal links."""
+        title, text, internal, external, _ = \
+            yield from self._fetch(url, base_url)
+        return title, text, internal, external
+
+    def _conditional_headers(self, url):
+        """Request headers to skip fetching unchanged indexed page."""
+        headers = {}
+        fields = None if self.validators is None else self.validators(url)
+        if fields is not None:
+            if fields.get('etag'):
+                headers['If-None-Match'] = fields['etag']
+            if fields.get('last_modified'):
+                headers['If-Modified-Since'] = fields['last_modified']
+        return headers
+
+    @asyncio.coroutine
+    def _fetch(self, url, base_url=None):
+        """Fetch and parse web page, pre-tokenize it in parser pool.
+
+        Return title, text, internal & external links and extra consumer
+        arguments: response validators and pre-tokenized terms.
+        """
         if base_url is None:
             base_url = url
-        parser = DataLinksHTMLParser(base_url=base_url)
+        extra = {}
+        start = time.monotonic()
 
         # TODO: add retry count
         try:
             with async_timeout.timeout(10):
-                with aiohttp.ClientSession() as session:
-                    resp = None
-                    try:
-                        resp = yield from session.get(url)
-
-                    except (ValueError,
-                            aiohttp.errors.ClientResponseError,
-                            aiohttp.errors.ClientRequestError,
-                            aiohttp.errors.ClientOSError,
-                            aiohttp.errors.ContentEncodingError):
-                        # ValueError: Host could not be detected.
-                        # aiohttp.errors.ClientResponseError
-                        # Can not write request body for
-                        # [Errno 10060] Cannot connect to host
-                        # 400, message='deflate
-                        raise InvalidURL()
-                    else:
-
-                        # Verify status code
-                        if resp is None \
-                                or resp.status not in ALLOWED_STATUS_CODES:
-                            raise InvalidURL()
-
-                        # Verify content type
-                        if resp.content_type not in ALLOWED_MIME_TYPES:
-                            raise InvalidURL()
-
-                        try:
-                            resp_text = yield from resp.text()
-
-                        except UnicodeDecodeError:
-                            raise InvalidURL()
+                resp = None
+                complete = False
+                try:
+                    resp = yield from self.session.get(
+                        url, headers=self._conditional_headers(url))
+
+                except ValueError:
+                    # ValueError: Host could not be detected.
+                    raise InvalidURL('url')
+
+                except aiohttp.ClientError:
+                    # Can not write request body for
+                    # [Errno 10060] Cannot connect to host
+                    # 400, message='deflate
+                    raise HostError('client_error')
+                else:
 
-                    finally:
-                        if resp is not None:
+                    # Verify status code
+                    if resp is not None and resp.status == 304:
+                        raise NotModified('not_modified')
+                    if resp is None or resp.status == 429 \
+                            or resp.status >= 500:
+                        raise HostError('server_status')
+                    if resp.status not in ALLOWED_STATUS_CODES:
+                        raise InvalidURL('status')
+
+                    # Verify content type
+                    if resp.content_type not in ALLOWED_MIME_TYPES:
+                        raise InvalidURL('mime_type')
+
+                    for header, name in (('ETag', 'etag'),
+                                         ('Last-Modified', 'last_modified')):
+                        if resp.headers.get(header):
+                            extra[name] = resp.headers[header]
+
+                    charset = resp.charset
+                    if self.executor is None:
+                        page = PageParser(base_url, charset, self.max_text)
+                        feed = page.feed
+                    else:
+                        body = bytearray()
+                        feed = body.extend
+                    complete = yield from self._read_body(resp, feed)
+
+                finally:
+                    if resp is not None:
+                        if complete:
+                            resp.release()
+                        else:
+                            # Unread body, the connection can't be reused
                             resp.close()
 
         except asyncio.TimeoutError:
             # print('Timeout', url)
-            raise InvalidURL()
-
-        parser.feed(resp_text)
-        title = parser.title
-        text = ' '.join(parser.data)
-        internal = parser.internal_links
-        external = parser.external_links
-
-        parser.close()
-        return title, text, internal, external
+            raise HostError('timeout')
+
+        parse_start = time.monotonic()
+        FETCH_SECONDS.observe(parse_start - start)
+        if self.executor is None:
+            result = page.close(complete) + (extra,)
+            PARSE_SECONDS.observe(time.monotonic() - parse_start)
+            return result
+
+        title, text, internal, external, terms = \
+            yield from self.loop.run_in_executor(
+                self.executor, parse_page, bytes(body), base_url, charset,
+                self.max_text, self.tokenizer, complete)
+        PARSE_SECONDS.observe(time.monotonic() - parse_start)
+        if terms is not None:
+            extra['terms'] = terms
+        return title, text, internal, external, extra
 
     @asyncio.coroutine
     def _feed_consumer(self):
-        """Feed consumer."""
+        """Feed consumer, waiting for it if it returns a coroutine."""
         while self.consumer is not None:
-            url, title, text = yield from self.text_queue.get()
-            self.consumer(url, title, text)
+            url, title, text, extra = yield from self.text_queue.get()
+            try:
+                result = self.consumer(url, title, text, **extra)
+                if asyncio.iscoroutine(result):
+                    yield from result
+            finally:
+                self.text_queue.task_done()
 
     def create_workers(self):
         """Create crawler workers."""
-        for _ in range(self.workers):
-            self.loop.create_task(self.worker())
-        self.loop.create_task(self._feed_consumer())
+        self.scheduler.start()
+        self._worker_tasks = [self.loop.create_task(self.worker())
+                              for _ in range(self.workers)]
+        self._consumer_task = self.loop.create_task(self._feed_consumer())
+
+    @asyncio.coroutine
+    def join(self):
+        """Wait until all queued URLs are crawled and consumed."""
+        yield from self.frontier.join()
+        yield from self.text_queue.join()
+
+    @asyncio.coroutine
+    def shutdown(self, timeout=10):
+        """Stop crawling gracefully and close crawler.
+
+        No new URLs are handed out, pages being fetched are finished and
+        crawled pages are passed to the consumer, waiting at most timeout
+        seconds for each step. Unfinished URLs stay in the frontier.
+        """
+        self.stopping = True
+        self.scheduler.stop()
+        for task in self._worker_tasks:
+            if task not in self._busy:
+                task.cancel()
+        if self._busy:
+            yield from asyncio.wait(list(self._busy), timeout=timeout,
+                                    loop=self.loop)
+        for task in self._worker_tasks:
+            task.cancel()
+        if self._consumer_task is not None:
+            try:
+                yield from asyncio.wait_for(self.text_queue.join(), timeout,
+                                            loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+            self._consumer_task.cancel()
+        self.close()
 
     def register_consumer(self, consumer):
-        """Register consumer."""
+        """Register consumer called with every crawled page.
+
+        A consumer returning a coroutine is waited for before the next
+        page is passed.
+        """
         self.consumer = consumer
+
+    def close(self):
+        """Close HTTP session, parser processes and frontier."""
+        self.scheduler.stop()
+        self.session.close()
+        self.frontier.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
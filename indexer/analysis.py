@@ -0,0 +1,138 @@
+"""Text analysis: turning text into index terms.
+
+The same analyzer must process indexed documents and queries, otherwise
+query terms do not match indexed ones.
+"""
+
+import re
+import string
+import sys
+import timeit
+
+PUNCTUATION = str.maketrans({c: ' ' for c in string.punctuation})
+ASCII_PUNCTUATION = bytes.maketrans(string.punctuation.encode('ascii'),
+                                    b' ' * len(string.punctuation))
+TOKEN = re.compile(r'[^\W_]+')
+
+ENGLISH_STOPWORDS = frozenset('''
+a an and are as at be but by for from has have he her his i if in into is
+it its me my no not of on or our she so than that the their them then
+there these they this to was we were what when which who will with you
+your
+'''.split())
+
+
+def tokenize(text):
+    """Split text into case folded words.
+
+    ASCII text is handled by str.translate and str.split, which run in C
+    without a Python level loop. Other text has ASCII punctuation
+    replaced on its UTF-8 bytes, only the few tokens with non-ASCII
+    punctuation go through the regex.
+    """
+    try:
+        text.encode('ascii')
+    except UnicodeEncodeError:
+        text = text.encode('utf-8').translate(ASCII_PUNCTUATION)
+        tokens = []
+        for token in text.decode('utf-8').casefold().split():
+            if token.isalnum():
+                tokens.append(token)
+            else:
+                tokens.extend(TOKEN.findall(token))
+        return tokens
+    return text.translate(PUNCTUATION).lower().split()
+
+
+def light_stem(token):
+    """Strip common English inflections, plural and -ing/-ed forms."""
+    if len(token) <= 3:
+        return token
+    if token.endswith('ies') and len(token) > 4:
+        return token[:-3] + 'y'
+    if token.endswith('sses'):
+        return token[:-2]
+    if token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    if token.endswith('ing') and len(token) > 5:
+        return token[:-3]
+    if token.endswith('ed') and len(token) > 4:
+        return token[:-2]
+    return token
+
+
+class Analyzer:
+    """Tokenizer with case folding, stopwords and stemming.
+
+    Instances are picklable, so documents can be analyzed in worker
+    processes.
+    """
+
+    max_cached_stems = 100000
+
+    def __init__(self, stopwords=(), stemmer=None):
+        """Init analyzer."""
+        self.stopwords = frozenset(stopwords)
+        self.stemmer = stemmer
+        self._stems = {}
+
+    def _stem(self, token):
+        """Stem token and remember the result."""
+        if len(self._stems) >= self.max_cached_stems:
+            self._stems.clear()
+        stem = self._stems[token] = self.stemmer(token)
+        return stem
+
+    def __call__(self, text):
+        """Split text into terms."""
+        tokens = tokenize(text)
+        if self.stopwords:
+            stopwords = self.stopwords
+            tokens = [t for t in tokens if t not in stopwords]
+        if self.stemmer is not None:
+            stems = self._stems
+            tokens = [stems[t] if t in stems else self._stem(t)
+                      for t in tokens]
+        return tokens
+
+
+def make_analyzer(stopwords=None, stem=False):
+    """Build analyzer from config values.
+
+    stopwords is 'english' or a list of words.
+    """
+    if stopwords == 'english':
+        stopwords = ENGLISH_STOPWORDS
+    return Analyzer(stopwords or (), light_stem if stem else None)
+
+
+DEFAULT_ANALYZER = Analyzer()
+
+
+def _legacy_vectorize(text):
+    """Tokenizer used before analyzers, kept for comparison."""
+    cleared_text = ''.join((c for c in text
+                            if c not in string.punctuation))
+    return cleared_text.split(' ')
+
+
+def benchmark(filename, number=20):
+    """Time legacy and default tokenizers on text file, in seconds."""
+    with open(filename, encoding='utf-8') as f:
+        text = f.read()
+    analyzers = [('legacy', _legacy_vectorize),
+                 ('default', DEFAULT_ANALYZER),
+                 ('english', make_analyzer('english', stem=True))]
+    return [(name, min(timeit.repeat(lambda: analyze(text), number=number,
+                                     repeat=3)) / number)
+            for name, analyze in analyzers]
+
+
+if __name__ == '__main__':
+    # python -m indexer.analysis tests/example.html
+    results = benchmark(sys.argv[1] if len(sys.argv) > 1
+                        else 'tests/example.html')
+    legacy = results[0][1]
+    for name, seconds in results:
+        print('{:8} {:8.3f} ms  x{:.1f}'.format(
+            name, seconds * 1000, legacy / seconds))
@@ -0,0 +1,205 @@
+"""Build a new index from a crawled document stream.
+
+Usage: python -m indexer.bulk [--config config/own_search.yaml]
+                              [--workers N] [--batch-size N] crawl.jsonl.gz
+
+The stream is read twice. The first pass finds the last version of
+every link, earlier ones are skipped by the second pass as if they were
+replaced in the index. Documents are then cut into batches of batch_size
+and every batch is analyzed and written out as a run, a temporary
+segment with sorted terms, in worker processes if asked. At the end the
+runs of every index are concatenated term by term into its only segment
+copying their encoded postings, a merge of sorted runs which never holds
+more than a batch per worker in memory.
+
+Unlike index_document, nothing is looked up in the index, hashed twice
+or appended to the write-ahead log.
+"""
+
+import argparse
+import collections
+import logging
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import yaml
+
+from .analysis import make_analyzer
+from .segment import (MemorySegment, SegmentReader, concat_segments,
+                      remove_segment, write_segment)
+from .sharding import ShardedIndex, shard_of
+from .stream import StreamReader
+from .text_index import (TextIndex, document_fields, document_terms,
+                         term_positions)
+
+log = logging.getLogger(__name__)
+
+
+def analyze_record(record, analyzer=None):
+    """Get stored fields, term counts and positions of stream record."""
+    vector = document_terms(record['title'], record['text'], analyzer)
+    positions = term_positions(vector)
+    fields = document_fields(record['url'], record['title'], record['text'],
+                             record.get('etag'), record.get('last_modified'),
+                             now=record.get('crawled'))
+    return fields, {term: len(p) for term, p in positions.items()}, positions
+
+
+def write_run(path, name, records, analyzer=None):
+    """Analyze records and write them as a segment.
+
+    Module level function, so runs can be written by worker processes.
+    Return segment name, document count and total length.
+    """
+    segment = MemorySegment()
+    for record in records:
+        segment.add(*analyze_record(record, analyzer))
+    write_segment(path, name, segment)
+    return name, segment.doc_count, segment.total_length
+
+
+class _InProcess:
+    """Executor running submitted functions right away."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class IndexBuilder:
+    """Batch documents of one empty index into runs and merge them."""
+
+    def __init__(self, text_index, executor, pending, batch_size=10000,
+                 analyzer=None, max_pending=2):
+        """Init builder of text_index writing runs with executor.
+
+        pending is a deque of runs being written shared by builders, at
+        most max_pending batches wait in it.
+        """
+        self.text_index = text_index
+        self.executor = executor
+        self.pending = pending
+        self.batch_size = batch_size
+        self.analyzer = analyzer
+        self.max_pending = max_pending
+        self.batch = []
+        self.runs = []
+
+    def add(self, record):
+        """Add stream record, write a run once the batch is full."""
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Start writing batched records as a run."""
+        if not self.batch:
+            return
+        name = 'run_{:06d}'.format(len(self.runs))
+        future = self.executor.submit(write_run, self.text_index.path,
+                                      name, self.batch, self.analyzer)
+        self.runs.append(future)
+        self.batch = []
+        self.pending.append(future)
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft().result()
+
+    def finish(self):
+        """Merge runs into an index segment, return its document count."""
+        self.flush()
+        path = self.text_index.path
+        runs = [SegmentReader(path, *future.result())
+                for future in self.runs]
+        runs = [run for run in runs if run.doc_count]
+        doc_count = sum(run.doc_count for run in runs)
+        if runs:
+            name = self.text_index.new_segment_name()
+            concat_segments(path, name, runs)
+            self.text_index.publish_segment(
+                name, doc_count, sum(run.total_length for run in runs))
+        for run in runs:
+            run.close()
+        for future in self.runs:
+            remove_segment(path, future.result()[0])
+        self.runs = []
+        return doc_count
+
+
+def latest_records(stream):
+    """Iterate records of stream not replaced by a later one."""
+    latest = {}
+    for number, record in enumerate(stream):
+        latest[record['url']] = number
+    for number, record in enumerate(stream):
+        if latest[record['url']] == number:
+            yield record
+
+
+def build_index(stream, path, analyzer=None, shards=1, batch_size=10000,
+                workers=0):
+    """Build index at path from stream records, return document count.
+
+    stream is iterated twice, like a list or a StreamReader. The index
+    directory must not exist or be empty. With shards > 1 a sharded
+    index is built, documents are routed as by ShardedIndex.
+    """
+    if os.path.isdir(path) and os.listdir(path):
+        raise ValueError('{} is not empty'.format(path))
+    if shards > 1:
+        indexes = ShardedIndex(path, shards, analyzer=analyzer).shards
+    else:
+        indexes = [TextIndex(path, analyzer=analyzer)]
+    executor = ProcessPoolExecutor(workers) if workers else _InProcess()
+    pending = collections.deque()
+    builders = [IndexBuilder(text_index, executor, pending, batch_size,
+                             analyzer, max_pending=2 * max(workers, 1))
+                for text_index in indexes]
+    try:
+        for record in latest_records(stream):
+            builders[shard_of(record['url'], shards)].add(record)
+        return sum(builder.finish() for builder in builders)
+    finally:
+        executor.shutdown()
+        for text_index in indexes:
+            text_index.close()
+
+
+def parse_args(argv):
+    """Parse command line."""
+    parser = argparse.ArgumentParser(prog='python -m indexer.bulk')
+    parser.add_argument('stream', help='document stream of python -m crawler')
+    parser.add_argument('--config', default='config/own_search.yaml',
+                        help='index path, analyzer and shards are taken '
+                             'from its index section')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='processes writing runs, 0 writes them in '
+                             'this one')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='documents per run')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Build index configured for the search server."""
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    with open(args.config, 'rt') as f:
+        index_conf = yaml.load(f).get('index', {})
+    path = index_conf.get('path', 'text_index')
+    start = time.monotonic()
+    count = build_index(StreamReader(args.stream), path,
+                        make_analyzer(**index_conf.get('analyzer', {})),
+                        shards=index_conf.get('shards', 1),
+                        batch_size=args.batch_size, workers=args.workers)
+    log.info('Indexed %d documents from %s to %s in %.1f s', count,
+             args.stream, path, time.monotonic() - start)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,70 @@
+"""Convert legacy JSON index file to binary segment format.
+
+Usage: python -m indexer.convert [--config config/own_search.yaml]
+                                 [text_index.json] [text_index]
+
+Documents are analyzed with the analyzer of the config's index section,
+the one the search server queries the index with.
+"""
+
+import argparse
+import json
+import sys
+from collections import Counter
+
+import yaml
+
+from .analysis import make_analyzer
+from .text_index import (TextIndex, content_hash, document_terms,
+                         term_positions)
+
+
+def convert(datafile, path, analyzer=None):
+    """Load JSON index file and store its documents as a new segment.
+
+    Legacy vectors were not case folded, documents are analyzed again
+    with analyzer, the default one if not given. Of documents with the
+    same link the last one is kept.
+    """
+    with open(datafile, 'r') as f:
+        data = json.load(f)
+
+    text_index = TextIndex(path, analyzer=analyzer)
+    for item in data['items']:
+        fields = {'summary': item['summary'],
+                  'title': item['title'],
+                  'link': item['link'],
+                  'hash': content_hash(item['title'], item['summary'])}
+        terms = document_terms(item['title'], item['summary'],
+                               text_index.analyzer)
+        text_index._add(fields, Counter(terms), term_positions(terms))
+    text_index.dump()
+    text_index.close()
+    return len(data['items'])
+
+
+def parse_args(argv):
+    """Parse command line."""
+    parser = argparse.ArgumentParser(prog='python -m indexer.convert')
+    parser.add_argument('datafile', nargs='?', default='text_index.json',
+                        help='legacy JSON index file')
+    parser.add_argument('path', nargs='?', default='text_index',
+                        help='directory of the new index')
+    parser.add_argument('--config', default='config/own_search.yaml',
+                        help='analyzer is taken from its index section')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    """Run converter."""
+    args = parse_args(argv)
+    with open(args.config, 'rt') as f:
+        index_conf = yaml.load(f).get('index', {})
+    count = convert(args.datafile, args.path,
+                    make_analyzer(**index_conf.get('analyzer', {})))
+    print('Converted {} documents from {} to {}'.format(
+        count, args.datafile, args.path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,165 @@
+"""Near-duplicate detection with SimHash fingerprints.
+
+A fingerprint is a 64 bit SimHash of document terms weighted by term
+frequency, similar documents get fingerprints differing in few bits.
+
+Fingerprints are split into max_distance + 1 bands and every band value
+is kept in its own hash table. Two fingerprints within max_distance bits
+agree on at least one whole band, so looking up every band of a new
+fingerprint finds all near-duplicate candidates without a linear scan.
+"""
+
+import hashlib
+import struct
+from collections import Counter, OrderedDict
+
+from .text_index import document_terms
+
+BITS = 64
+HASH = struct.Struct('<Q')
+
+
+def term_hash(term):
+    """64 bit hash of term."""
+    return HASH.unpack_from(
+        hashlib.md5(term.encode('utf-8')).digest())[0]
+
+
+def simhash(terms):
+    """Compute SimHash fingerprint of terms."""
+    weights = [0] * BITS
+    for term, tf in Counter(terms).items():
+        if not term:
+            continue
+        h = term_hash(term)
+        for bit in range(BITS):
+            if h >> bit & 1:
+                weights[bit] += tf
+            else:
+                weights[bit] -= tf
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    """Count differing bits."""
+    return bin(a ^ b).count('1')
+
+
+class SimHashIndex:
+    """Fingerprints of documents searchable by Hamming distance."""
+
+    def __init__(self, max_distance=3):
+        """Init empty band tables."""
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        bounds = [BITS * i // bands for i in range(bands + 1)]
+        self.bands = [(start, (1 << (end - start)) - 1)
+                      for start, end in zip(bounds, bounds[1:])]
+        self.tables = [{} for _ in self.bands]
+        self.fingerprints = {}
+
+    def __len__(self):
+        """Count fingerprinted documents."""
+        return len(self.fingerprints)
+
+    def _keys(self, fingerprint):
+        for shift, mask in self.bands:
+            yield fingerprint >> shift & mask
+
+    def add(self, key, fingerprint):
+        """Add or replace fingerprint of document key."""
+        self.remove(key)
+        self.fingerprints[key] = fingerprint
+        for table, band in zip(self.tables, self._keys(fingerprint)):
+            table.setdefault(band, set()).add(key)
+
+    def remove(self, key):
+        """Forget document key."""
+        fingerprint = self.fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for table, band in zip(self.tables, self._keys(fingerprint)):
+            keys = table[band]
+            keys.discard(key)
+            if not keys:
+                del table[band]
+
+    def find(self, fingerprint, exclude=None):
+        """Get key of the closest document within max_distance or None."""
+        best = None
+        best_distance = self.max_distance + 1
+        for table, band in zip(self.tables, self._keys(fingerprint)):
+            for key in table.get(band, ()):
+                if key == exclude:
+                    continue
+                distance = hamming_distance(fingerprint,
+                                            self.fingerprints[key])
+                if distance < best_distance:
+                    best, best_distance = key, distance
+        return best
+
+
+class DuplicateFilter:
+    """Consumer wrapper dropping near-duplicate pages.
+
+    Pages within max_distance bits of an already accepted page with
+    another link are not passed to the consumer, the link of the page
+    they duplicate is recorded in duplicates for the last max_duplicates
+    of them, all are counted in dropped. Fingerprints of passed pages are
+    given to the consumer to be stored with them.
+    """
+
+    def __init__(self, consumer, max_distance=3, tokenizer=None,
+                 max_duplicates=10000):
+        """Wrap consumer(link, title, summary, terms, simhash, **kwargs)."""
+        self.consumer = consumer
+        self.tokenizer = document_terms if tokenizer is None else tokenizer
+        self.index = SimHashIndex(max_distance)
+        self.max_duplicates = max_duplicates
+        self.duplicates = OrderedDict()
+        self.dropped = 0
+
+    def load(self, documents):
+        """Add fingerprints of already indexed documents.
+
+        Fingerprints stored by the index are read, documents indexed
+        without one are fingerprinted again.
+        """
+        for fields in documents:
+            if fields.get('simhash') is not None:
+                fingerprint = int(fields['simhash'], 16)
+            else:
+                fingerprint = simhash(self.tokenizer(fields['title'],
+                                                     fields['summary']))
+            self.index.add(fields['link'], fingerprint)
+
+    def __call__(self, link, title, summary, terms=None, **kwargs):
+        """Pass page to consumer unless it is a near-duplicate."""
+        if terms is None:
+            terms = self.tokenizer(title, summary)
+        fingerprint = simhash(terms)
+        original = self.index.find(fingerprint, exclude=link)
+        if original is not None:
+            self.dropped += 1
+            self.duplicates.pop(link, None)
+            self.duplicates[link] = original
+            if len(self.duplicates) > self.max_duplicates:
+                self.duplicates.popitem(last=False)
+            return False
+        self.duplicates.pop(link, None)
+        self.index.add(link, fingerprint)
+        return self.consumer(link, title, summary, terms=terms,
+                             simhash=fingerprint, **kwargs)
+
+    def stats(self):
+        """Count unique and dropped pages."""
+        total = len(self.index) + self.dropped
+        return {
+            'unique': len(self.index),
+            'duplicates': self.dropped,
+            'dedup_ratio': self.dropped / total if total else 0.0,
+        }
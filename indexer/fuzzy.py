@@ -0,0 +1,116 @@
+"""Lookup of vocabulary terms within a small edit distance.
+
+Terms are split into character trigrams of the term padded with two
+marks on both sides, and every trigram lists the terms containing it. An
+insertion, deletion or substitution changes at most three trigrams, so a
+term within k edits of a query term shares all but 3 * k of its distinct
+trigrams. Only terms counted often enough in trigram lists of the query
+term are compared with it by edit distance, never the whole vocabulary.
+Terms sharing no trigram at all are not found, neither are terms beyond
+the MAX_CANDIDATES sharing the most trigrams.
+"""
+
+from array import array
+from collections import Counter
+
+GRAM_SIZE = 3
+PAD = '\0' * (GRAM_SIZE - 1)
+# Terms compared by edit distance at most
+MAX_CANDIDATES = 1000
+
+
+def trigrams(term):
+    """Distinct trigrams of padded term."""
+    padded = PAD + term + PAD
+    return {padded[i:i + GRAM_SIZE]
+            for i in range(len(padded) - GRAM_SIZE + 1)}
+
+
+def max_edits(term):
+    """Return edits allowed for term by its length, none for short ones."""
+    if len(term) < 3:
+        return 0
+    if len(term) <= 5:
+        return 1
+    return 2
+
+
+def edit_distance(first, second, limit):
+    """Levenshtein distance, limit + 1 once it is known to exceed limit."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for i, a in enumerate(first, 1):
+        current = [i]
+        for j, b in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (a != b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[-1], limit + 1)
+
+
+class FuzzyIndex:
+    """Terms searchable by edit distance through trigram lists."""
+
+    def __init__(self):
+        """Init empty index."""
+        self.clear()
+
+    def __len__(self):
+        """Count terms."""
+        return len(self.terms)
+
+    def clear(self):
+        """Remove all terms."""
+        self.terms = []
+        self.ids = {}
+        self.grams = {}
+
+    def add(self, term, count=1):
+        """Add term, count is accepted for the TermDictionary interface."""
+        if not term or term in self.ids:
+            return
+        term_id = self.ids[term] = len(self.terms)
+        self.terms.append(term)
+        for gram in trigrams(term):
+            ids = self.grams.get(gram)
+            if ids is None:
+                ids = self.grams[gram] = array('I')
+            ids.append(term_id)
+
+    def update(self, counts):
+        """Add terms of (term, count) pairs."""
+        for term, _ in counts:
+            self.add(term)
+
+    def similar(self, term, max_distance=None):
+        """List (term, distance) pairs of other terms close to term.
+
+        max_distance defaults to max_edits of term.
+        """
+        if max_distance is None:
+            max_distance = max_edits(term)
+        if max_distance <= 0:
+            return []
+        grams = trigrams(term)
+        # Short terms and repeated letters leave few distinct trigrams,
+        # one shared trigram is still required
+        needed = max(1, len(grams) - GRAM_SIZE * max_distance)
+        counts = Counter()
+        for gram in grams:
+            ids = self.grams.get(gram)
+            if ids is not None:
+                counts.update(ids)
+        candidates = [self.terms[term_id]
+                      for term_id, count in counts.most_common(MAX_CANDIDATES)
+                      if count >= needed]
+        found = []
+        for other in candidates:
+            if other == term:
+                continue
+            distance = edit_distance(term, other, max_distance)
+            if distance <= max_distance:
+                found.append((other, distance))
+        return found
@@ -0,0 +1,241 @@
+"""Top-k retrieval with block-max MaxScore dynamic pruning.
+
+Every block of term postings records its last doc id and impacts, the
+(term frequency, document length) pairs not outdone by another posting
+with both higher frequency and shorter document. As the score of a term
+grows with term frequency and falls with document length, the best
+scoring impact gives the highest term score in the block, and the
+largest block bound bounds the term in the whole segment.
+
+Once k documents are collected, the k-th best score is a threshold the
+other documents must beat. Terms are ordered by their bounds and the
+least important ones whose bounds together do not reach the threshold
+are non-essential: a document containing only them cannot enter the
+top k, so candidates are taken from postings of essential terms only and
+non-essential postings are only probed at these candidates. Before a
+candidate is scored, bounds of the blocks holding it are summed, whole
+runs of documents are skipped when the sum does not reach the threshold.
+
+Skipping never drops a document which exhaustive scoring would return:
+scores are compared with bounds inflated by SLACK against float rounding
+and term scores of returned documents are summed in query term order,
+the same as in exhaustive scoring.
+"""
+
+import bisect
+import heapq
+
+END = float('inf')
+# Relative error allowed in float sums of term scores
+SLACK = 1e-9
+
+
+class Cursor:
+    """Position in postings of one query term in one segment."""
+
+    def __init__(self, order, blocks, load, score):
+        """Init cursor at the first posting.
+
+        order is the position of the term in the query, blocks and load
+        are returned by postings_blocks of the segment, score(tf, length)
+        is the term score in a document of length.
+        """
+        self.order = order
+        self.score = score
+        self.load = load
+        self.lasts = [last for last, _ in blocks]
+        self.bounds = [max(score(tf, length) for tf, length in front)
+                       for _, front in blocks]
+        self.max_score = max(self.bounds)
+        self.shallow_block = 0
+        self._read(0)
+
+    def _read(self, block):
+        """Decode block and move to its first posting."""
+        self.block = block
+        if block >= len(self.lasts):
+            self.doc = END
+            return
+        self.docs, self.tfs = self.load(block)
+        self.i = 0
+        self.doc = self.docs[0]
+
+    @property
+    def tf(self):
+        """Term frequency in the current document."""
+        return self.tfs[self.i]
+
+    def next(self):
+        """Move to the next posting."""
+        self.i += 1
+        if self.i < len(self.docs):
+            self.doc = self.docs[self.i]
+        else:
+            self._read(self.block + 1)
+
+    def advance(self, target):
+        """Move to the first posting with doc id target or above."""
+        if self.doc >= target:
+            return
+        if self.lasts[self.block] < target:
+            self._read(bisect.bisect_left(self.lasts, target,
+                                          self.block + 1))
+            if self.doc >= target:
+                return
+        self.i = bisect.bisect_left(self.docs, target, self.i)
+        self.doc = self.docs[self.i]
+
+    def shallow(self, target):
+        """Bound and last doc id of the block which may hold target.
+
+        Postings are not decoded, past the last block the bound is zero.
+        Targets must not decrease.
+        """
+        block = self.shallow_block
+        if block < len(self.lasts) and self.lasts[block] < target:
+            block = self.shallow_block = bisect.bisect_left(
+                self.lasts, target, block + 1)
+        if block >= len(self.lasts):
+            return 0.0, END
+        return self.bounds[block], self.lasts[block]
+
+
+class TopK:
+    """Best k documents by score, ties going to lower keys.
+
+    Pruning starts once exact_total documents were counted, so totals of
+    queries matching fewer documents are exact.
+    """
+
+    def __init__(self, k, exact_total=0):
+        """Init empty collector."""
+        self.k = k
+        self.exact_total = exact_total
+        self.heap = []
+        self.count = 0
+        self.exact = True
+
+    @property
+    def threshold(self):
+        """Score a document must exceed to be collected."""
+        if len(self.heap) < self.k or self.count < self.exact_total:
+            return -END
+        return self.heap[0][0]
+
+    def push(self, score, key):
+        """Offer document, return True if it was collected."""
+        item = (score, -key)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+            return True
+        if item > self.heap[0]:
+            heapq.heapreplace(self.heap, item)
+            return True
+        return False
+
+    def items(self):
+        """(key, score) pairs of collected documents."""
+        return [(-key, score) for score, key in self.heap]
+
+
+def _limit(threshold):
+    """Return limit bounds must exceed to reach threshold despite rounding."""
+    return threshold / (1 + SLACK) if threshold > 0 else threshold
+
+
+def search_segment(top, base, cursors, deleted, doc_length):
+    """Collect documents of one segment into top.
+
+    base is added to local doc ids to get collected keys.
+    """
+    if top.k <= 0 or not cursors:
+        return
+    cursors = sorted(cursors, key=lambda c: c.max_score)
+    count = len(cursors)
+    bounds = []
+    total = 0.0
+    for cursor in cursors:
+        total += cursor.max_score
+        bounds.append(total)
+
+    threshold = top.threshold
+    limit = _limit(threshold)
+    essential = 0
+    # Documents up to window_end are in the same blocks of every term
+    window_end = -1
+    while True:
+        while essential < count and bounds[essential] <= limit:
+            essential += 1
+            top.exact = False
+        if essential == count:
+            return
+        if essential == count - 1:
+            doc = cursors[essential].doc
+        else:
+            doc = min(c.doc for c in cursors[essential:])
+        if doc == END:
+            return
+
+        if doc in deleted:
+            for cursor in cursors[essential:]:
+                if cursor.doc == doc:
+                    cursor.next()
+            continue
+
+        if threshold > -END:
+            if doc > window_end:
+                shallow = [c.shallow(doc) for c in cursors]
+                window_end = min(last for _, last in shallow)
+                window_bound = sum(bound for bound, _ in shallow)
+            if window_bound <= limit:
+                # No document of these blocks can make it
+                top.exact = False
+                if window_end == END:
+                    return
+                for cursor in cursors[essential:]:
+                    cursor.advance(window_end + 1)
+                continue
+
+        top.count += 1
+        length = doc_length(doc)
+        scores = []
+        partial = 0.0
+        for cursor in cursors[essential:]:
+            if cursor.doc == doc:
+                score = cursor.score(cursor.tfs[cursor.i], length)
+                scores.append((cursor.order, score))
+                partial += score
+                cursor.next()
+
+        if essential and not _probe(cursors[:essential], shallow, doc,
+                                    length, scores, partial, limit):
+            continue
+
+        if len(scores) > 1:
+            scores.sort()
+        score = 0
+        for _, term_score in scores:
+            score += term_score
+        if top.push(score, base + doc) or top.count == top.exact_total:
+            threshold = top.threshold
+            limit = _limit(threshold)
+
+
+def _probe(cursors, shallow, doc, length, scores, partial, limit):
+    """Add scores of non-essential terms in doc to scores.
+
+    Terms are probed from the most important, return False as soon as
+    the document can not make it.
+    """
+    remaining = sum(bound for bound, _ in shallow[:len(cursors)])
+    for i in range(len(cursors) - 1, -1, -1):
+        if partial + remaining <= limit:
+            return False
+        cursor = cursors[i]
+        remaining -= shallow[i][0]
+        cursor.advance(doc)
+        if cursor.doc == doc:
+            score = cursor.score(cursor.tfs[cursor.i], length)
+            scores.append((cursor.order, score))
+            partial += score
+    return True
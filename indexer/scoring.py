@@ -0,0 +1,21 @@
+"""Relevance scoring functions."""
+
+import math
+
+
+class BM25:
+    """Okapi BM25 scorer with document length normalization."""
+
+    def __init__(self, k1=1.2, b=0.75):
+        """Init scorer parameters."""
+        self.k1 = k1
+        self.b = b
+
+    def idf(self, df, doc_count):
+        """Inverse document frequency of a term found in df documents."""
+        return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+    def score(self, tf, doc_length, avg_length, idf):
+        """Score single term occurring tf times in the document."""
+        norm = self.k1 * (1 - self.b + self.b * doc_length / avg_length)
+        return idf * tf * (self.k1 + 1) / (tf + norm)
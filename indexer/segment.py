@@ -0,0 +1,1054 @@
+"""Binary index segments.
+
+A segment is an immutable set of files sharing one name prefix:
+
+- ``.tix`` term index: little endian uint64 offsets of ``.tdc`` entries,
+  ordered by term, so a term is found by binary search.
+- ``.tdc`` term dictionary: varint term length, UTF-8 term, varint
+  document frequency, varint postings offset and varint postings size.
+- ``.pst`` postings: varint doc id deltas each followed by varint term
+  frequency.
+- ``.len`` document lengths as little endian uint32.
+- ``.fdx`` stored fields index: uint64 offsets into ``.fdt``, one per
+  document plus the end offset.
+- ``.fdt`` stored fields: JSON encoded document fields.
+- ``.ldx`` link index: uint64 offsets of ``.ldc`` entries ordered by link.
+- ``.ldc`` link dictionary: varint link length, UTF-8 link and varint
+  doc id.
+- ``.pix`` positions index: uint64 offsets of every term's block in
+  ``.pos`` in term order, plus the end offset.
+- ``.pos`` positions: for every posting of the term, varint number of
+  positions followed by varint position deltas. Zero positions mean the
+  document was indexed without positions.
+- ``.bix`` blocks index: uint64 offsets of every term's entries in
+  ``.blk`` in term order, plus the end offset.
+- ``.blk`` postings blocks: for every BLOCK_SIZE postings of the term
+  varint last doc id, varint end offsets of the block in the term's
+  postings and positions, varint number of impacts and impacts as
+  varint term
+  frequency and varint document length pairs. Impacts are the postings
+  not outdone by another one with both higher frequency and shorter
+  document, the best score in the block is the score of one of them.
+  Queries skip blocks by doc id and bound scores of their documents
+  without decoding them, positions are decoded only for blocks holding
+  wanted documents.
+
+Deleted documents are listed in separate ``.del`` files of varint doc id
+deltas, so deleting never rewrites a segment.
+
+Readers map the files with ``mmap``, so opening a segment costs the same
+regardless of its size and only pages touched by queries are loaded.
+"""
+
+import bisect
+import copy
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import weakref
+from array import array
+
+OFFSET = struct.Struct('<Q')
+LENGTH = struct.Struct('<I')
+BLOCK_SIZE = 128
+EXTENSIONS = ('.tix', '.tdc', '.pst', '.len', '.fdx', '.fdt',
+              '.ldx', '.ldc', '.pix', '.pos', '.bix', '.blk')
+
+
+def encode_varint(value, out):
+    """Append unsigned LEB128 encoded value to bytearray."""
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(buf, pos):
+    """Decode unsigned LEB128 value, return it with the next position."""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_postings(postings):
+    """Encode sorted (doc id, tf) pairs with delta coded doc ids."""
+    out = bytearray()
+    prev = 0
+    for doc_id, tf in postings:
+        encode_varint(doc_id - prev, out)
+        encode_varint(tf, out)
+        prev = doc_id
+    return out
+
+
+def encode_positions(positions, out):
+    """Append count and delta coded ascending positions to bytearray."""
+    encode_varint(len(positions), out)
+    prev = 0
+    for position in positions:
+        encode_varint(position - prev, out)
+        prev = position
+
+
+def decode_positions(buf, pos):
+    """Decode positions list, return it with the next position in buf."""
+    count, pos = decode_varint(buf, pos)
+    positions = []
+    position = 0
+    for _ in range(count):
+        delta = buf[pos]
+        if delta < 0x80:
+            pos += 1
+        else:
+            delta, pos = decode_varint(buf, pos)
+        position += delta
+        positions.append(position)
+    return positions, pos
+
+
+def skip_positions(buf, pos):
+    """Position in buf after the positions list starting at pos."""
+    count, pos = decode_varint(buf, pos)
+    while count:
+        if buf[pos] < 0x80:
+            count -= 1
+        pos += 1
+    return pos
+
+
+def decode_postings(buf, pos, end, doc_id=0):
+    """Decode (doc id, tf) pairs from buf[pos:end].
+
+    doc_id is the one preceding the first delta, the last doc id of the
+    previous block when decoding starts at a block.
+    """
+    docs, tfs = decode_block(buf, pos, end, doc_id)
+    return zip(docs, tfs)
+
+
+def decode_block(buf, pos, end, doc_id=0):
+    """Decode postings in buf[pos:end] into lists of doc ids and tfs.
+
+    Single byte values, most of deltas and term frequencies, are
+    decoded inline.
+    """
+    data = buf[pos:end]
+    docs = []
+    tfs = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        b = data[pos]
+        if b < 0x80:
+            pos += 1
+        else:
+            b, pos = decode_varint(data, pos)
+        doc_id += b
+        docs.append(doc_id)
+        b = data[pos]
+        if b < 0x80:
+            pos += 1
+        else:
+            b, pos = decode_varint(data, pos)
+        tfs.append(b)
+    return docs, tfs
+
+
+def impacts(postings):
+    """Pareto front of (tf, doc length) pairs, by descending tf.
+
+    Every pair has a higher tf than the following ones and a longer
+    document than them.
+    """
+    front = []
+    for tf, length in sorted(postings, key=lambda p: (-p[0], p[1])):
+        if not front or length < front[-1][1]:
+            front.append((tf, length))
+    return front
+
+
+class TermPostings:
+    """Postings of one term in a memory segment.
+
+    Doc ids, term frequencies and positions of all postings are appended
+    to flat arrays, ends holds the end offset in positions of every
+    posting. The maximal term frequency and the minimal length of
+    documents bound the term scores.
+    """
+
+    __slots__ = ('docs', 'freqs', 'positions', 'ends', 'max_tf',
+                 'min_length')
+
+    def __init__(self):
+        """Init empty postings."""
+        self.docs = array('I')
+        self.freqs = array('I')
+        self.positions = array('I')
+        self.ends = array('I')
+        self.max_tf = 0
+        self.min_length = None
+
+    def add(self, doc_id, tf, length, positions=()):
+        """Append posting, doc ids must be added in ascending order."""
+        self.docs.append(doc_id)
+        self.freqs.append(tf)
+        self.positions.extend(positions)
+        self.ends.append(len(self.positions))
+        self.max_tf = max(self.max_tf, tf)
+        if self.min_length is None or length < self.min_length:
+            self.min_length = length
+
+
+class DocumentStore:
+    """Stored fields of memory segment documents kept by column.
+
+    Text fields are lists sharing the field strings, numeric fields are
+    arrays. A field missing in a document or holding a value of another
+    type is recorded in the extra dict of that document only.
+    """
+
+    columns = (('link', None), ('title', None), ('summary', None),
+               ('hash', None), ('etag', None), ('last_modified', None),
+               ('simhash', None), ('indexed', 'd'), ('first_seen', 'd'),
+               ('changes', 'q'))
+
+    def __init__(self):
+        """Init empty columns."""
+        self.values = {name: [] if typecode is None else array(typecode)
+                       for name, typecode in self.columns}
+        self.extra = {}
+        self.count = 0
+
+    def append(self, fields):
+        """Add document fields, return its id."""
+        doc_id = self.count
+        extra = {}
+        missing = []
+        for name, typecode in self.columns:
+            value = fields.get(name, _MISSING)
+            if value is _MISSING:
+                missing.append(name)
+            elif not _fits(value, typecode):
+                extra[name] = value
+            else:
+                self.values[name].append(value)
+                continue
+            self.values[name].append(None if typecode is None else 0)
+        for name, value in fields.items():
+            if name not in self.values:
+                extra[name] = value
+        if extra or missing:
+            self.extra[doc_id] = (extra, missing)
+        self.count += 1
+        return doc_id
+
+    def get(self, doc_id):
+        """Get fields of document as a new dict."""
+        fields = {name: column[doc_id]
+                  for name, column in self.values.items()}
+        if doc_id in self.extra:
+            extra, missing = self.extra[doc_id]
+            for name in missing:
+                del fields[name]
+            fields.update(extra)
+        return fields
+
+
+_MISSING = object()
+
+
+def _fits(value, typecode):
+    """Check value can be stored in column of typecode."""
+    if typecode is None:
+        return value is None or isinstance(value, str)
+    if typecode == 'd':
+        return type(value) is float
+    return type(value) is int and -2 ** 63 <= value < 2 ** 63
+
+
+class MemorySegment:
+    """Mutable in-memory segment for recently indexed documents.
+
+    Terms are interned and their postings kept in arrays, stored fields
+    in a DocumentStore, so buffered documents take a fraction of the
+    memory of dicts of Python ints.
+    """
+
+    def __init__(self):
+        """Init empty segment."""
+        self.postings_map = {}
+        self.lengths = array('I')
+        self.documents = DocumentStore()
+        self.links = {}
+        self.deleted = set()
+        self.total_length = 0
+
+    @property
+    def doc_count(self):
+        """Number of documents in segment."""
+        return self.documents.count
+
+    def add(self, fields, terms, positions=None):
+        """Add document fields and its term counts, return local doc id.
+
+        positions maps terms to ascending lists of their positions.
+        """
+        doc_id = self.documents.append(fields)
+        if positions is None:
+            positions = {}
+        length = sum(terms.values())
+        for term, tf in terms.items():
+            postings = self.postings_map.get(term)
+            if postings is None:
+                postings = self.postings_map[sys.intern(term)] = \
+                    TermPostings()
+            postings.add(doc_id, tf, length, positions.get(term, ()))
+        self.lengths.append(length)
+        self.links[fields['link']] = doc_id
+        self.total_length += length
+        return doc_id
+
+    def find(self, link):
+        """Get id of live document with link, None if there is no such."""
+        doc_id = self.links.get(link)
+        if doc_id is None or doc_id in self.deleted:
+            return None
+        return doc_id
+
+    def terms(self):
+        """Iterate segment terms in dictionary order."""
+        return iter(sorted(self.postings_map,
+                           key=lambda t: t.encode('utf-8')))
+
+    def term_freqs(self):
+        """Iterate (term, document frequency) pairs in no order."""
+        return ((term, len(postings.docs))
+                for term, postings in self.postings_map.items())
+
+    def doc_freq(self, term):
+        """Count documents containing term."""
+        postings = self.postings_map.get(term)
+        return 0 if postings is None else len(postings.docs)
+
+    def postings(self, term):
+        """Iterate (doc id, tf) pairs of term ordered by doc id."""
+        postings = self.postings_map.get(term)
+        if postings is None:
+            return iter(())
+        return zip(postings.docs, postings.freqs)
+
+    def postings_blocks(self, term):
+        """Get blocks of term postings, None if there is no such term.
+
+        Return list of last doc id and impacts, (tf, document length)
+        pairs bounding term scores, of every block and function loading
+        doc ids and tfs of block number i. Memory segment postings are a
+        single block bounded by the highest tf and the shortest document.
+        """
+        postings = self.postings_map.get(term)
+        if postings is None:
+            return None
+        blocks = [(postings.docs[-1],
+                   [(postings.max_tf, postings.min_length)])]
+        return blocks, lambda i: (postings.docs, postings.freqs)
+
+    def positions(self, term, docs=None):
+        """Iterate (doc id, positions) pairs of term ordered by doc id.
+
+        Only documents in docs set are returned if it is given. Positions
+        are empty for documents added without them.
+        """
+        postings = self.postings_map.get(term)
+        if postings is None:
+            return
+        start = 0
+        for doc_id, end in zip(postings.docs, postings.ends):
+            if docs is None or doc_id in docs:
+                yield doc_id, postings.positions[start:end].tolist()
+            start = end
+
+    def doc_length(self, doc_id):
+        """Get number of terms in document."""
+        return self.lengths[doc_id]
+
+    def document(self, doc_id):
+        """Get stored fields of document."""
+        return self.documents.get(doc_id)
+
+    def view(self):
+        """Read only view of the documents added so far."""
+        return MemoryView(self)
+
+    def close(self):
+        """Nothing to release."""
+
+
+class MemoryView:
+    """Memory segment as it was when the view was taken.
+
+    Documents are only ever appended to a memory segment, so the view
+    reads the first doc_count of them and stays consistent while another
+    thread keeps adding documents. Deletions are copied.
+    """
+
+    def __init__(self, segment):
+        """Init view of segment documents added so far."""
+        self.segment = segment
+        self.doc_count = segment.doc_count
+        self.total_length = segment.total_length
+        self.deleted = frozenset(segment.deleted)
+
+    def _postings(self, term):
+        """Get postings of term and count of them in view."""
+        postings = self.segment.postings_map.get(term)
+        if postings is None:
+            return None, 0
+        docs = postings.docs
+        count = len(docs)
+        if count and docs[count - 1] >= self.doc_count:
+            count = bisect.bisect_left(docs, self.doc_count, 0, count)
+        return postings, count
+
+    def find(self, link):
+        """Get id of live document with link, None if there is no such."""
+        doc_id = self.segment.links.get(link)
+        if doc_id is not None and doc_id >= self.doc_count:
+            # Added again after the view was taken, find the version
+            # before
+            links = self.segment.documents.values['link']
+            doc_id = next((i for i in range(self.doc_count - 1, -1, -1)
+                           if links[i] == link), None)
+        if doc_id is None or doc_id in self.deleted:
+            return None
+        return doc_id
+
+    def doc_freq(self, term):
+        """Count documents containing term."""
+        return self._postings(term)[1]
+
+    def postings(self, term):
+        """Iterate (doc id, tf) pairs of term ordered by doc id."""
+        postings, count = self._postings(term)
+        if not count:
+            return iter(())
+        return zip(postings.docs[:count], postings.freqs[:count])
+
+    def postings_blocks(self, term):
+        """Get postings of term as a single block, see MemorySegment.
+
+        Bounds of the block may come from documents added later, they
+        stay valid upper bounds.
+        """
+        postings, count = self._postings(term)
+        if not count:
+            return None
+        docs = postings.docs[:count]
+        freqs = postings.freqs[:count]
+        blocks = [(docs[-1], [(postings.max_tf, postings.min_length)])]
+        return blocks, lambda i: (docs, freqs)
+
+    def positions(self, term, docs=None):
+        """Iterate (doc id, positions) pairs of term ordered by doc id."""
+        postings, count = self._postings(term)
+        if not count:
+            return
+        start = 0
+        for doc_id, end in zip(postings.docs[:count],
+                               postings.ends[:count]):
+            if docs is None or doc_id in docs:
+                yield doc_id, postings.positions[start:end].tolist()
+            start = end
+
+    def doc_length(self, doc_id):
+        """Get number of terms in document."""
+        return self.segment.lengths[doc_id]
+
+    def document(self, doc_id):
+        """Get stored fields of document."""
+        return self.segment.documents.get(doc_id)
+
+
+def _segment_file(path, name, ext):
+    return os.path.join(path, name + ext)
+
+
+def write_segment(path, name, segment):
+    """Write segment files, the segment is not visible until renamed.
+
+    Every file is written under a temporary name and renamed at the end,
+    so a crash never leaves a partially written segment under its final
+    name.
+    """
+    tix = bytearray()
+    tdc = bytearray()
+    pst = bytearray()
+    pix = bytearray()
+    pos = bytearray()
+    bix = bytearray()
+    blk = bytearray()
+    for term in segment.terms():
+        term_postings = list(segment.postings(term))
+        if not term_postings:
+            # All documents of a merged term were deleted
+            continue
+        encoded = term.encode('utf-8')
+        postings = bytearray()
+        bix += OFFSET.pack(len(blk))
+        term_positions = [p for _, p in segment.positions(term)]
+        pix += OFFSET.pack(len(pos))
+        positions_start = len(pos)
+        prev = 0
+        for i in range(0, len(term_postings), BLOCK_SIZE):
+            block = term_postings[i:i + BLOCK_SIZE]
+            for doc_id, tf in block:
+                encode_varint(doc_id - prev, postings)
+                encode_varint(tf, postings)
+                prev = doc_id
+            for positions in term_positions[i:i + BLOCK_SIZE]:
+                encode_positions(positions, pos)
+            front = impacts((tf, segment.doc_length(doc_id))
+                            for doc_id, tf in block)
+            encode_varint(prev, blk)
+            encode_varint(len(postings), blk)
+            encode_varint(len(pos) - positions_start, blk)
+            encode_varint(len(front), blk)
+            for tf, length in front:
+                encode_varint(tf, blk)
+                encode_varint(length, blk)
+        tix += OFFSET.pack(len(tdc))
+        encode_varint(len(encoded), tdc)
+        tdc += encoded
+        encode_varint(len(term_postings), tdc)
+        encode_varint(len(pst), tdc)
+        encode_varint(len(postings), tdc)
+        pst += postings
+    pix += OFFSET.pack(len(pos))
+    bix += OFFSET.pack(len(blk))
+
+    lengths = bytearray()
+    fdx = bytearray()
+    fdt = bytearray()
+    for doc_id in range(segment.doc_count):
+        lengths += LENGTH.pack(segment.doc_length(doc_id))
+        fdx += OFFSET.pack(len(fdt))
+        fdt += json.dumps(segment.document(doc_id)).encode('utf-8')
+    fdx += OFFSET.pack(len(fdt))
+
+    ldx = bytearray()
+    ldc = bytearray()
+    links = sorted((segment.document(doc_id)['link'].encode('utf-8'), doc_id)
+                   for doc_id in range(segment.doc_count))
+    for link, doc_id in links:
+        ldx += OFFSET.pack(len(ldc))
+        encode_varint(len(link), ldc)
+        ldc += link
+        encode_varint(doc_id, ldc)
+
+    _write_files(path, name, (tix, tdc, pst, lengths, fdx, fdt,
+                              ldx, ldc, pix, pos, bix, blk))
+
+
+def _write_files(path, name, contents):
+    """Write segment files in EXTENSIONS order and rename them."""
+    for ext, data in zip(EXTENSIONS, contents):
+        with open(_segment_file(path, name, ext) + '.tmp', 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+    for ext in EXTENSIONS:
+        filename = _segment_file(path, name, ext)
+        os.replace(filename + '.tmp', filename)
+
+
+def concat_segments(path, name, segments):
+    """Write segment readers as one segment, documents in their order.
+
+    Segments must have no deleted documents and hold blocks. Encoded
+    postings, positions and stored fields are copied as they are, only
+    the first doc id delta of every segment's postings is encoded again
+    and block entries are shifted, so this is much faster than writing
+    the documents anew.
+    """
+    bases = []
+    base = 0
+    for segment in segments:
+        bases.append(base)
+        base += segment.doc_count
+
+    tix = bytearray()
+    tdc = bytearray()
+    pst = bytearray()
+    pix = bytearray()
+    pos = bytearray()
+    bix = bytearray()
+    blk = bytearray()
+    entries = heapq.merge(*[_term_entries(segment, number)
+                            for number, segment in enumerate(segments)])
+    group = []
+    for entry in entries:
+        if group and entry[0] != group[0][0]:
+            _concat_term(segments, bases, group, tix, tdc, pst, pix, pos,
+                         bix, blk)
+            group = []
+        group.append(entry)
+    if group:
+        _concat_term(segments, bases, group, tix, tdc, pst, pix, pos,
+                     bix, blk)
+    pix += OFFSET.pack(len(pos))
+    bix += OFFSET.pack(len(blk))
+
+    lengths = bytearray()
+    fdx = bytearray()
+    fdt = bytearray()
+    for segment in segments:
+        lengths += segment._len[:segment.doc_count * LENGTH.size]
+        offsets = struct.unpack_from('<{}Q'.format(segment.doc_count),
+                                     segment._fdx)
+        fdx += struct.pack('<{}Q'.format(len(offsets)),
+                           *[offset + len(fdt) for offset in offsets])
+        end = OFFSET.unpack_from(segment._fdx,
+                                 segment.doc_count * OFFSET.size)[0]
+        fdt += segment._fdt[:end]
+    fdx += OFFSET.pack(len(fdt))
+
+    ldx = bytearray()
+    ldc = bytearray()
+    links = heapq.merge(*[_link_entries(segment, base)
+                          for segment, base in zip(segments, bases)])
+    for link, doc_id in links:
+        ldx += OFFSET.pack(len(ldc))
+        encode_varint(len(link), ldc)
+        ldc += link
+        encode_varint(doc_id, ldc)
+
+    _write_files(path, name, (tix, tdc, pst, lengths, fdx, fdt,
+                              ldx, ldc, pix, pos, bix, blk))
+
+
+def _term_entries(segment, number):
+    """Iterate (term, segment number, entry number) of segment terms."""
+    for i in range(segment.term_count):
+        yield segment._entry(i)[0], number, i
+
+
+def _link_entries(segment, base):
+    """Iterate (link, doc id + base) of segment links in order."""
+    for i in range(segment.link_count):
+        link, doc_id = segment._link_entry(i)
+        yield link, base + doc_id
+
+
+def _concat_term(segments, bases, group, tix, tdc, pst, pix, pos, bix,
+                 blk):
+    """Append entries of one term found in segments of group."""
+    term = group[0][0]
+    postings = bytearray()
+    pix += OFFSET.pack(len(pos))
+    bix += OFFSET.pack(len(blk))
+    positions_start = len(pos)
+    df = 0
+    previous = 0
+    for _, number, i in group:
+        segment = segments[number]
+        base = bases[number]
+        _, term_df, offset, length = segment._entry(i)
+        df += term_df
+        data = segment._pst[offset:offset + length]
+        first, skipped = decode_varint(data, 0)
+        postings_start = len(postings)
+        encode_varint(base + first - previous, postings)
+        shift = len(postings) - postings_start - skipped
+        postings += data[skipped:]
+        start, end = struct.unpack_from('<QQ', segment._pix,
+                                        i * OFFSET.size)
+        positions_offset = len(pos) - positions_start
+        pos += segment._pos[start:end]
+        for last, postings_end, positions_end, front in segment._blocks(i):
+            encode_varint(base + last, blk)
+            encode_varint(postings_start + postings_end + shift, blk)
+            encode_varint(positions_offset + positions_end, blk)
+            encode_varint(len(front), blk)
+            for tf, doc_length in front:
+                encode_varint(tf, blk)
+                encode_varint(doc_length, blk)
+        previous = base + last
+    tix += OFFSET.pack(len(tdc))
+    encode_varint(len(term), tdc)
+    tdc += term
+    encode_varint(df, tdc)
+    encode_varint(len(pst), tdc)
+    encode_varint(len(postings), tdc)
+    pst += postings
+
+
+class MergedSegment:
+    """Segments read as one without their deleted documents.
+
+    Live documents keep their order and are numbered anew. Written out
+    by write_segment.
+    """
+
+    def __init__(self, segments):
+        """Init merge of segments, their deleted sets must not change."""
+        self.segments = segments
+        self.ids = []
+        # Segment number and old id of every live document
+        self.numbers = array('I')
+        self.local_ids = array('I')
+        self.total_length = 0
+        for number, segment in enumerate(segments):
+            ids = array('l')
+            for doc_id in range(segment.doc_count):
+                if doc_id in segment.deleted:
+                    ids.append(-1)
+                    continue
+                ids.append(len(self.local_ids))
+                self.numbers.append(number)
+                self.local_ids.append(doc_id)
+                self.total_length += segment.doc_length(doc_id)
+            self.ids.append(ids)
+
+    @property
+    def doc_count(self):
+        """Number of live documents in merged segments."""
+        return len(self.local_ids)
+
+    def terms(self):
+        """Iterate terms of all segments in dictionary order, once each."""
+        previous = None
+        # Code point order of str is the byte order of UTF-8 keys, no
+        # key function is needed, which heapq.merge lacks before 3.5
+        for term in heapq.merge(*[segment.terms()
+                                  for segment in self.segments]):
+            if term != previous:
+                yield term
+                previous = term
+
+    def doc_freq(self, term):
+        """Count live documents containing term."""
+        return sum(1 for _ in self.postings(term))
+
+    def postings(self, term):
+        """Iterate (doc id, tf) pairs of term ordered by new doc id."""
+        for number, segment in enumerate(self.segments):
+            ids = self.ids[number]
+            for doc_id, tf in segment.postings(term):
+                if ids[doc_id] >= 0:
+                    yield ids[doc_id], tf
+
+    def positions(self, term, docs=None):
+        """Iterate (doc id, positions) pairs of term by new doc id."""
+        for number, segment in enumerate(self.segments):
+            ids = self.ids[number]
+            for doc_id, positions in segment.positions(term):
+                new_id = ids[doc_id]
+                if new_id >= 0 and (docs is None or new_id in docs):
+                    yield new_id, positions
+
+    def doc_length(self, doc_id):
+        """Get number of terms in document."""
+        return self.segments[self.numbers[doc_id]].doc_length(
+            self.local_ids[doc_id])
+
+    def document(self, doc_id):
+        """Load stored fields of document."""
+        return self.segments[self.numbers[doc_id]].document(
+            self.local_ids[doc_id])
+
+
+def merge_segments(path, name, segments):
+    """Write segment readers as one segment without deleted documents.
+
+    Segments without deletions holding blocks are concatenated, others
+    are written anew.
+    """
+    if any(segment.deleted or not segment._bix for segment in segments):
+        write_segment(path, name, MergedSegment(segments))
+    else:
+        concat_segments(path, name, segments)
+
+
+def write_deletions(path, filename, deleted):
+    """Write set of deleted doc ids atomically."""
+    data = encode_postings((doc_id, 0) for doc_id in sorted(deleted))
+    filename = os.path.join(path, filename)
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + '.tmp', filename)
+
+
+def read_deletions(path, filename):
+    """Read set of deleted doc ids."""
+    with open(os.path.join(path, filename), 'rb') as f:
+        data = f.read()
+    return {doc_id for doc_id, _ in decode_postings(data, 0, len(data))}
+
+
+def remove_segment(path, name):
+    """Delete segment files."""
+    for ext in EXTENSIONS:
+        try:
+            os.remove(_segment_file(path, name, ext))
+        except FileNotFoundError:
+            pass
+
+
+class SegmentReader:
+    """Read only memory mapped segment."""
+
+    def __init__(self, path, name, doc_count, total_length, deleted=None):
+        """Map segment files."""
+        self.name = name
+        self.doc_count = doc_count
+        self.total_length = total_length
+        self.deleted = set() if deleted is None else deleted
+        self._files = []
+        self._maps = []
+        self._views = weakref.WeakSet()
+        (self._tix, self._tdc, self._pst,
+         self._len, self._fdx, self._fdt,
+         self._ldx, self._ldc, self._pix, self._pos,
+         self._bix, self._blk) = [
+            self._map(_segment_file(path, name, ext)) for ext in EXTENSIONS]
+        self.term_count = len(self._tix) // OFFSET.size
+        self.link_count = len(self._ldx) // OFFSET.size
+
+    def _map(self, filename):
+        try:
+            f = open(filename, 'rb')
+        except FileNotFoundError:
+            # Segments written before links, positions or blocks were
+            # added
+            return b''
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(m)
+        return m
+
+    def _entry(self, i):
+        """Decode term dictionary entry number i."""
+        pos = OFFSET.unpack_from(self._tix, i * OFFSET.size)[0]
+        size, pos = decode_varint(self._tdc, pos)
+        term = self._tdc[pos:pos + size]
+        pos += size
+        df, pos = decode_varint(self._tdc, pos)
+        offset, pos = decode_varint(self._tdc, pos)
+        length, pos = decode_varint(self._tdc, pos)
+        return term, df, offset, length
+
+    def _find(self, term):
+        """Binary search term dictionary, return entry number and entry."""
+        key = term.encode('utf-8')
+        lo, hi = 0, self.term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self._entry(mid)
+            if entry[0] < key:
+                lo = mid + 1
+            elif entry[0] > key:
+                hi = mid
+            else:
+                return mid, entry
+        return None, None
+
+    def _lookup(self, term):
+        """Binary search term dictionary entry."""
+        return self._find(term)[1]
+
+    def _link_entry(self, i):
+        """Decode link dictionary entry number i."""
+        pos = OFFSET.unpack_from(self._ldx, i * OFFSET.size)[0]
+        size, pos = decode_varint(self._ldc, pos)
+        link = self._ldc[pos:pos + size]
+        doc_id, _ = decode_varint(self._ldc, pos + size)
+        return link, doc_id
+
+    def find(self, link):
+        """Get id of live document with link, None if there is no such."""
+        key = link.encode('utf-8')
+        lo, hi = 0, self.link_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._link_entry(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        while lo < self.link_count:
+            entry_link, doc_id = self._link_entry(lo)
+            if entry_link != key:
+                break
+            if doc_id not in self.deleted:
+                return doc_id
+            lo += 1
+        return None
+
+    def terms(self):
+        """Iterate segment terms in dictionary order."""
+        for i in range(self.term_count):
+            yield self._entry(i)[0].decode('utf-8')
+
+    def term_freqs(self):
+        """Iterate (term, document frequency) pairs in dictionary order."""
+        for i in range(self.term_count):
+            term, df, _, _ = self._entry(i)
+            yield term.decode('utf-8'), df
+
+    def doc_freq(self, term):
+        """Count documents containing term."""
+        entry = self._lookup(term)
+        return 0 if entry is None else entry[1]
+
+    def postings(self, term):
+        """Iterate (doc id, tf) pairs of term ordered by doc id."""
+        entry = self._lookup(term)
+        if entry is None:
+            return iter(())
+        _, _, offset, length = entry
+        return decode_postings(self._pst, offset, offset + length)
+
+    def postings_blocks(self, term):
+        """Get blocks of term postings, None if there is no such term.
+
+        Return list of last doc id and impacts, (tf, document length)
+        pairs bounding term scores, of every block and function loading
+        doc ids and tfs of block number i. Segments written without
+        blocks are loaded as a single block.
+        """
+        i, entry = self._find(term)
+        if entry is None:
+            return None
+        _, _, offset, length = entry
+        if not self._bix:
+            docs, tfs = decode_block(self._pst, offset, offset + length)
+            front = impacts((tf, self.doc_length(doc_id))
+                            for doc_id, tf in zip(docs, tfs))
+            return [(docs[-1], front)], lambda b: (docs, tfs)
+
+        blocks = self._blocks(i)
+        ends = [0] + [postings_end for _, postings_end, _, _ in blocks]
+
+        def load(b):
+            base = blocks[b - 1][0] if b else 0
+            return decode_block(self._pst, offset + ends[b],
+                                offset + ends[b + 1], base)
+
+        return [(last, front) for last, _, _, front in blocks], load
+
+    def _blocks(self, i):
+        """Decode blocks of term number i.
+
+        Return (last doc id, postings end, positions end, impacts) of
+        every block.
+        """
+        start, end = struct.unpack_from('<QQ', self._bix, i * OFFSET.size)
+        blocks = []
+        pos = start
+        while pos < end:
+            last, pos = decode_varint(self._blk, pos)
+            postings_end, pos = decode_varint(self._blk, pos)
+            positions_end, pos = decode_varint(self._blk, pos)
+            count, pos = decode_varint(self._blk, pos)
+            front = []
+            for _ in range(count):
+                tf, pos = decode_varint(self._blk, pos)
+                doc_length, pos = decode_varint(self._blk, pos)
+                front.append((tf, doc_length))
+            blocks.append((last, postings_end, positions_end, front))
+        return blocks
+
+    def positions(self, term, docs=None):
+        """Iterate (doc id, positions) pairs of term ordered by doc id.
+
+        Only documents in docs set are returned if it is given. Positions
+        are empty for documents added without them and in segments
+        written before positions were stored.
+        """
+        i, entry = self._find(term)
+        if entry is None:
+            return
+        _, _, offset, length = entry
+        if not self._pix:
+            for doc_id, _ in decode_postings(self._pst, offset,
+                                             offset + length):
+                if docs is None or doc_id in docs:
+                    yield doc_id, []
+            return
+        pos = OFFSET.unpack_from(self._pix, i * OFFSET.size)[0]
+        if docs is None or not self._bix:
+            for doc_id, _ in decode_postings(self._pst, offset,
+                                             offset + length):
+                positions, pos = decode_positions(self._pos, pos)
+                if docs is None or doc_id in docs:
+                    yield doc_id, positions
+            return
+
+        wanted = sorted(docs)
+        base = postings_start = positions_start = 0
+        for last, postings_end, positions_end, _ in self._blocks(i):
+            first = bisect.bisect_left(wanted,
+                                       base + 1 if postings_start else 0)
+            if first < len(wanted) and wanted[first] <= last:
+                stop = wanted[bisect.bisect_right(wanted, last) - 1]
+                block_docs, _ = decode_block(
+                    self._pst, offset + postings_start,
+                    offset + postings_end, base)
+                block_pos = pos + positions_start
+                for doc_id in block_docs:
+                    if doc_id in docs:
+                        positions, block_pos = decode_positions(
+                            self._pos, block_pos)
+                        yield doc_id, positions
+                    elif doc_id < stop:
+                        block_pos = skip_positions(self._pos, block_pos)
+                    if doc_id >= stop:
+                        break
+            base = last
+            postings_start = postings_end
+            positions_start = positions_end
+
+    def doc_length(self, doc_id):
+        """Get number of terms in document."""
+        return LENGTH.unpack_from(self._len, doc_id * LENGTH.size)[0]
+
+    def document(self, doc_id):
+        """Load stored fields of document."""
+        start, end = struct.unpack_from('<QQ', self._fdx,
+                                        doc_id * OFFSET.size)
+        return json.loads(self._fdt[start:end].decode('utf-8'))
+
+    def view(self):
+        """Copy sharing the mapped files, with deletions made so far.
+
+        Views are not closed, closing the reader unmaps them too.
+        """
+        view = copy.copy(self)
+        view.deleted = frozenset(self.deleted)
+        self._views.add(view)
+        return view
+
+    @property
+    def in_use(self):
+        """Whether a view of the segment is still referenced."""
+        return len(self._views) > 0
+
+    def close(self):
+        """Unmap segment files."""
+        for m in self._maps:
+            m.close()
+        for f in self._files:
+            f.close()
+        self._maps = []
+        self._files = []
@@ -0,0 +1,164 @@
+"""Index split into shards by document link.
+
+Every document lives in exactly one shard chosen by a hash of its link,
+so updates and deletions of a link always go to the same shard. A query
+is answered in two rounds: collection statistics of all shards are
+summed first, then every shard scores its documents with these global
+statistics. Scores computed by different shards are thus comparable and
+merged results score the same as the ones a single index would return.
+Documents with equal scores may come in another order and, at the end of
+a page, be other ones: shards order them by link, a single index by the
+order they were indexed in.
+"""
+
+import heapq
+import os
+import zlib
+
+from .text_index import TextIndex
+
+
+def shard_of(link, count):
+    """Return number of the shard holding document with link."""
+    return zlib.crc32(link.encode('utf-8')) % count
+
+
+def shard_path(path, shard):
+    """Directory of shard files in sharded index directory."""
+    return os.path.join(path, 'shard_{}'.format(shard))
+
+
+def merge_stats(stats):
+    """Sum collection statistics of several shards."""
+    merged = {'doc_count': 0, 'total_length': 0, 'df': {}, 'expansions': {}}
+    for shard_stats in stats:
+        merged['doc_count'] += shard_stats['doc_count']
+        merged['total_length'] += shard_stats['total_length']
+        for term, df in shard_stats['df'].items():
+            merged['df'][term] = merged['df'].get(term, 0) + df
+        for term, similar in shard_stats.get('expansions', {}).items():
+            merged['expansions'].setdefault(term, {}).update(similar)
+    return merged
+
+
+def merge_pages(pages, match_count, offset):
+    """Merge result pages of shards queried with global statistics.
+
+    Every page must hold best offset + match_count results of its shard
+    with their scores, scores are not returned. Equal scores are ordered
+    by link.
+    """
+    items = heapq.nsmallest(
+        offset + match_count,
+        (item for page in pages for item in page['items']),
+        key=lambda item: (-item['score'], item['link']))
+    for item in items:
+        del item['score']
+    return {'items': items[offset:],
+            'total': sum(page['total'] for page in pages),
+            'total_exact': all(page.get('total_exact', True)
+                               for page in pages),
+            'offset': offset,
+            'limit': match_count}
+
+
+class ShardedIndex:
+    """Writer of TextIndex shards kept in one directory.
+
+    Has the document interface of TextIndex, documents are routed to
+    shards by link. query() searches all shards in this process, a
+    search server queries shard processes with ShardClient instead.
+    """
+
+    def __init__(self, path, shards, **kwargs):
+        """Init shards, keyword arguments are passed to every TextIndex."""
+        self.path = path
+        self.shards = [TextIndex(shard_path(path, i), **kwargs)
+                       for i in range(shards)]
+
+    def shard(self, link):
+        """Index of shard holding document with link."""
+        return self.shards[shard_of(link, len(self.shards))]
+
+    @property
+    def analyzer(self):
+        """Return analyzer shared by all shards."""
+        return self.shards[0].analyzer
+
+    @property
+    def generation(self):
+        """Return generation changing whenever any shard changes."""
+        return sum(shard.generation for shard in self.shards)
+
+    @property
+    def log_size(self):
+        """Return bytes in write-ahead logs of all shards."""
+        return sum(shard.log_size for shard in self.shards)
+
+    def load(self):
+        """Load all shards."""
+        for shard in self.shards:
+            shard.load()
+
+    def dump(self):
+        """Flush buffered documents of all shards."""
+        for shard in self.shards:
+            shard.dump()
+
+    def close(self):
+        """Close all shards."""
+        for shard in self.shards:
+            shard.close()
+
+    def index_document(self, link, title, summary, **kwargs):
+        """Add or update document in its shard."""
+        return self.shard(link).index_document(link, title, summary,
+                                               **kwargs)
+
+    def index_documents(self, documents):
+        """Add or update documents, each shard publishes its part at once."""
+        batches = {}
+        for document in documents:
+            batches.setdefault(self.shard(document['link']), []).append(
+                document)
+        return sum(shard.index_documents(batch)
+                   for shard, batch in batches.items())
+
+    def delete_document(self, link):
+        """Delete document from its shard."""
+        return self.shard(link).delete_document(link)
+
+    def find_document(self, link):
+        """Get stored fields of document with link, None if not indexed."""
+        return self.shard(link).find_document(link)
+
+    def iter_documents(self):
+        """Iterate stored fields of live documents of all shards."""
+        for shard in self.shards:
+            yield from shard.iter_documents()
+
+    def suggest(self, prefix, limit=10):
+        """Complete prefix in all shards, return counts summed.
+
+        Every shard offers its best completions only, so a term missing
+        from all of them is not found even if its total count is higher.
+        """
+        counts = {}
+        for shard in self.shards:
+            for term, count in shard.suggest(prefix, limit):
+                counts[term] = counts.get(term, 0) + count
+        return heapq.nsmallest(limit, counts.items(),
+                               key=lambda item: (-item[1], item[0]))
+
+    def collection_stats(self, query_text):
+        """Sum statistics of all shards."""
+        return merge_stats(shard.collection_stats(query_text)
+                           for shard in self.shards)
+
+    def query(self, query_text, match_count=3, offset=0, **kwargs):
+        """Query all shards with global statistics and merge results."""
+        stats = self.collection_stats(query_text)
+        pages = [shard.query(query_text, match_count=offset + match_count,
+                             stats=stats, scores=True, **kwargs)
+                 for shard in self.shards]
+        return merge_pages(pages, match_count, offset)
@@ -0,0 +1,77 @@
+"""Short fragments of document text around matched query terms."""
+
+import re
+
+WORD = re.compile(r'[^\W_]+')
+ELLIPSIS = '…'
+# Characters of text in a snippet
+SNIPPET_SIZE = 200
+# Matches are looked for in this many leading characters of a document
+SNIPPET_SCAN = 65536
+
+
+def find_matches(text, terms, analyzer, end=SNIPPET_SCAN):
+    """List (start, end, term) of words in text analyzed to query terms."""
+    analyzed = {}
+    matches = []
+    for match in WORD.finditer(text, 0, end):
+        word = match.group()
+        term = analyzed.get(word)
+        if term is None:
+            word_terms = analyzer(word)
+            term = analyzed[word] = word_terms[0] if word_terms else ''
+        if term in terms:
+            matches.append((match.start(), match.end(), term))
+    return matches
+
+
+def best_window(matches, size):
+    """Start offset of window holding most distinct matched terms."""
+    best = None
+    best_start = 0
+    counts = {}
+    j = 0
+    for i, (start, _, term) in enumerate(matches):
+        if j <= i:
+            # Match longer than the window counts on its own
+            counts[term] = counts.get(term, 0) + 1
+            j = i + 1
+        while j < len(matches) and matches[j][1] - start <= size:
+            counts[matches[j][2]] = counts.get(matches[j][2], 0) + 1
+            j += 1
+        rank = (len(counts), j - i)
+        if best is None or rank > best:
+            best, best_start = rank, start
+        counts[term] -= 1
+        if not counts[term]:
+            del counts[term]
+    return best_start
+
+
+def make_snippet(text, terms, analyzer, size=SNIPPET_SIZE):
+    """Cut snippet of about size characters around query terms.
+
+    Return dict with snippet text and highlights, a list of [start, end]
+    offsets of matched words in it.
+    """
+    terms = set(terms)
+    matches = find_matches(text, terms, analyzer) if terms else []
+    start = 0
+    if matches:
+        start = best_window(matches, size)
+        # Some context before the first highlighted word
+        start = max(0, start - size // 4)
+        space = text.rfind(' ', 0, start)
+        start = 0 if space < 0 else space + 1
+    end = min(len(text), start + size)
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        if space > start:
+            end = space
+
+    prefix = ELLIPSIS + ' ' if start else ''
+    suffix = ' ' + ELLIPSIS if end < len(text) else ''
+    shift = len(prefix) - start
+    return {'text': prefix + text[start:end] + suffix,
+            'highlights': [[s + shift, e + shift] for s, e, _ in matches
+                           if s >= start and e <= end]}
@@ -0,0 +1,121 @@
+"""Compressed stream of crawled documents.
+
+A stream file is a sequence of gzip members, each holding up to
+chunk_size JSON lines with url, title and text of a crawled page and its
+HTTP validators. A chunk is compressed and appended as a whole, so
+readers skip a member truncated by a crash and a crawl killed in the
+middle of a write loses only the documents of the unfinished chunk. The
+file is plain gzip and can be inspected with zcat.
+"""
+
+import gzip
+import json
+import os
+import zlib
+
+# Decompress a gzip member, not raw deflate data
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+READ_SIZE = 2 ** 16
+
+
+def _members(f):
+    """Iterate (decompressed data, end offset) of complete members."""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    parts = []
+    offset = 0
+    data = b''
+    while True:
+        if not data:
+            data = f.read(READ_SIZE)
+            if not data:
+                return
+            offset += len(data)
+        try:
+            parts.append(decompressor.decompress(data))
+        except zlib.error:
+            # Garbage after a truncated member
+            return
+        if not decompressor.eof:
+            data = b''
+            continue
+        data = decompressor.unused_data
+        yield b''.join(parts), offset - len(data)
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        parts = []
+
+
+def read_stream(filename):
+    """Iterate document records of stream file in written order."""
+    with open(filename, 'rb') as f:
+        for payload, _ in _members(f):
+            for line in payload.splitlines():
+                yield json.loads(line.decode('utf-8'))
+
+
+class StreamReader:
+    """Records of stream file, iterable any number of times."""
+
+    def __init__(self, filename):
+        """Init reader of stream file."""
+        self.filename = filename
+
+    def __iter__(self):
+        """Iterate records from the start of the file."""
+        return read_stream(self.filename)
+
+
+def stream_end(filename):
+    """Size of the complete chunks of stream file, 0 if there is none."""
+    end = 0
+    try:
+        with open(filename, 'rb') as f:
+            for _, end in _members(f):
+                pass
+    except FileNotFoundError:
+        pass
+    return end
+
+
+class StreamWriter:
+    """Append documents to stream file by compressed chunks.
+
+    Writing continues after the last complete chunk of an existing file,
+    a chunk truncated by a crash is dropped.
+    """
+
+    def __init__(self, filename, chunk_size=1000, level=6):
+        """Open stream file for appending."""
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.level = level
+        self.count = 0
+        self._lines = []
+        end = stream_end(filename)
+        self._file = open(filename, 'ab')
+        if self._file.tell() > end:
+            self._file.truncate(end)
+            self._file.seek(end)
+
+    def write(self, url, title, text, **fields):
+        """Buffer document, write the chunk once it is full."""
+        record = {'url': url, 'title': title, 'text': text}
+        record.update(fields)
+        self._lines.append(json.dumps(record).encode('utf-8'))
+        self.count += 1
+        if len(self._lines) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write buffered documents as a new chunk."""
+        if not self._lines:
+            return
+        self._lines.append(b'')
+        self._file.write(gzip.compress(b'\n'.join(self._lines), self.level))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._lines = []
+
+    def close(self):
+        """Write buffered documents and close file."""
+        self.flush()
+        self._file.close()
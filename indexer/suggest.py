@@ -0,0 +1,121 @@
+"""Prefix completion of index terms for as-you-type suggestions.
+
+Terms are kept in a sorted list and weighted by the number of documents
+containing them. Short prefixes match too many terms to rank them on
+every keystroke, so the best completions of every prefix up to
+cache_depth characters are kept up to date as terms are added. Longer
+prefixes are completed by scanning at most max_scan terms following the
+prefix in the sorted list, which bounds the time of every lookup.
+
+Counts only grow: documents deleted from the index keep counting, the
+same as in document frequencies of index segments.
+"""
+
+import bisect
+import heapq
+
+from .analysis import tokenize
+from .snippets import WORD
+
+
+def complete_query(text, suggest, analyzer, limit=10):
+    """Complete the last word of partially typed query text.
+
+    The word is analyzed as index terms are, suggest(prefix, limit)
+    lists (term, count) completions of the term. Return (text, count)
+    pairs of text with the word replaced, none if text does not end in
+    a word.
+    """
+    words = list(WORD.finditer(text))
+    if not words or words[-1].end() != len(text):
+        return []
+    word = words[-1]
+    # Stopwords still complete to longer words
+    terms = analyzer(word.group()) or tokenize(word.group())
+    if not terms:
+        return []
+    head = text[:word.start()]
+    return [(head + term, count) for term, count in suggest(terms[-1], limit)]
+
+
+class TermDictionary:
+    """Terms with document counts searchable by prefix."""
+
+    def __init__(self, cache_depth=3, cache_size=10, max_scan=1000):
+        """Init empty dictionary."""
+        self.cache_depth = cache_depth
+        self.cache_size = cache_size
+        self.max_scan = max_scan
+        self.counts = {}
+        self.terms = []
+        self.cache = {}
+
+    def __len__(self):
+        """Count terms."""
+        return len(self.terms)
+
+    def clear(self):
+        """Remove all terms."""
+        self.counts = {}
+        self.terms = []
+        self.cache = {}
+
+    def add(self, term, count=1):
+        """Add count documents containing term."""
+        if not term:
+            return
+        total = self.counts.get(term)
+        if total is None:
+            bisect.insort(self.terms, term)
+            total = 0
+        total = self.counts[term] = total + count
+        for depth in range(1, min(len(term), self.cache_depth) + 1):
+            self._cache_add(term[:depth], term, total)
+
+    def _cache_add(self, prefix, term, count):
+        """Update best completions of prefix with new count of term."""
+        best = self.cache.setdefault(prefix, [])
+        for i, (_, cached) in enumerate(best):
+            if cached == term:
+                del best[i]
+                break
+        else:
+            if len(best) >= self.cache_size and \
+                    (-count, term) > best[-1]:
+                return
+        bisect.insort(best, (-count, term))
+        del best[self.cache_size:]
+
+    def update(self, counts):
+        """Add (term, count) pairs, faster than add for many terms."""
+        for term, count in counts:
+            if term:
+                self.counts[term] = self.counts.get(term, 0) + count
+        self.terms = sorted(self.counts)
+        groups = {}
+        for term, count in self.counts.items():
+            for depth in range(1, min(len(term), self.cache_depth) + 1):
+                groups.setdefault(term[:depth], []).append((-count, term))
+        self.cache = {prefix: heapq.nsmallest(self.cache_size, group)
+                      for prefix, group in groups.items()}
+
+    def complete(self, prefix, limit=10):
+        """List up to limit (term, count) completions of prefix.
+
+        Terms in more documents go first. Prefixes longer than
+        cache_depth with more than max_scan completions are completed
+        from the first max_scan terms in dictionary order.
+        """
+        if not prefix or limit <= 0:
+            return []
+        if len(prefix) <= self.cache_depth and limit <= self.cache_size:
+            best = self.cache.get(prefix, ())
+        else:
+            start = bisect.bisect_left(self.terms, prefix)
+            matches = []
+            for term in self.terms[start:start + self.max_scan]:
+                if not term.startswith(prefix):
+                    break
+                matches.append((-self.counts[term], term))
+            best = heapq.nsmallest(limit, matches)
+        return [(term, -count) for count, term in best[:limit]]
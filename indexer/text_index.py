@@ -1,73 +1,1009 @@
 """Full text search index."""
 
+import bisect
+import glob
+import hashlib
+import heapq
 import json
-import string
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+
+from metrics import counter, gauge, histogram
+
+from .analysis import DEFAULT_ANALYZER
+from .fuzzy import FuzzyIndex
+from .pruning import Cursor, TopK, search_segment
+from .scoring import BM25
+from .snippets import SNIPPET_SIZE, make_snippet
+from .suggest import TermDictionary
+from .segment import (MemorySegment, SegmentReader, merge_segments,
+                      read_deletions, remove_segment, write_deletions,
+                      write_segment)
+from .wal import WriteAheadLog, replay
+
+MANIFEST = 'segments.json'
+FORMAT_VERSION = 1
+RESULT_FIELDS = ('link', 'title')
+DOCUMENT_FIELDS = ('link', 'title', 'summary')
+# Best documents by term scores which get proximity boost
+PROXIMITY_CANDIDATES = 100
+# Matching documents counted before pruning may make totals inexact
+EXACT_TOTAL = 1000
+# Score factor of fuzzy matches for every edit
+FUZZY_WEIGHT = 0.5
+
+DOCUMENTS = counter('index_documents_total',
+                    'Indexed documents by result.', ['result'])
+INDEX_SECONDS = histogram('index_document_seconds',
+                          'Time to add document to index.')
+QUERY_SECONDS = histogram('index_query_seconds', 'Time to answer query.')
+INDEX_SIZE = gauge('index_size', 'Documents and segments in index.',
+                   ['item'])
+
+PendingFlush = namedtuple('PendingFlush', 'name segment generation')
+PendingMerge = namedtuple('PendingMerge', 'name segments views')
+# Segments and generation seen by queries, segments are (doc id base,
+# segment view) pairs
+Snapshot = namedtuple('Snapshot', 'segments generation')
+
+
+def document_terms(title, summary, analyzer=None):
+    """Convert document to vector for indexing.
+
+    Module level function, so documents can be tokenized in other
+    processes before they are passed to index_document. The analyzer
+    must be the one the index was created with.
+    """
+    if analyzer is None:
+        analyzer = DEFAULT_ANALYZER
+    return analyzer(title + '. ' + summary)
+
+
+def term_positions(vector):
+    """Map terms of vector to ascending lists of their positions."""
+    positions = {}
+    for position, term in enumerate(vector):
+        positions.setdefault(term, []).append(position)
+    return positions
+
+
+def parse_query(query_text, analyzer):
+    """Split query into free terms and list of quoted phrases terms."""
+    terms = []
+    phrases = []
+    for i, part in enumerate(query_text.split('"')):
+        vector = analyzer(part)
+        if i % 2 and vector:
+            phrases.append(vector)
+        else:
+            terms.extend(vector)
+    return terms, phrases
+
+
+def min_distance(first, second):
+    """Smallest distance between positions of two ascending lists."""
+    i = j = 0
+    best = None
+    while i < len(first) and j < len(second):
+        distance = abs(first[i] - second[j])
+        if best is None or distance < best:
+            best = distance
+        if first[i] < second[j]:
+            i += 1
+        else:
+            j += 1
+    return best
+
+
+def document_fields(link, title, summary, etag=None, last_modified=None,
+                    now=None, previous=None, digest=None, simhash=None):
+    """Make stored fields of document indexed at time now.
+
+    previous holds the stored fields of the version it replaces. SimHash
+    fingerprint is stored as 16 hex digits, see DuplicateFilter.load.
+    """
+    if now is None:
+        now = time.time()
+    if digest is None:
+        digest = content_hash(title, summary)
+    fields = {'summary': summary,
+              'title': title,
+              'link': link,
+              'hash': digest,
+              'etag': etag,
+              'last_modified': last_modified,
+              'simhash': None if simhash is None else
+              '{:016x}'.format(simhash),
+              'indexed': now}
+    if previous is None:
+        fields['first_seen'] = now
+        fields['changes'] = 0
+    else:
+        fields['first_seen'] = previous.get('first_seen', now)
+        fields['changes'] = previous.get('changes', 0) + 1
+    return fields
+
+
+def content_hash(title, summary):
+    """Hash of document content used to detect changed pages."""
+    content = title + '\n' + summary
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def measure_size(indexes):
+    """Report segments and buffered documents summed over indexes.
+
+    Registered once by the application for all of its shards.
+    """
+    INDEX_SIZE.set_function(
+        lambda: sum(len(index.segments) for index in indexes),
+        item='segments')
+    INDEX_SIZE.set_function(
+        lambda: sum(index.buffer.doc_count for index in indexes),
+        item='buffered')
 
 
 class TextIndex:
-    """Full text search index."""
+    """Full text search index.
+
+    The index lives in a directory of immutable binary segments listed in
+    a manifest file. Newly indexed documents are appended to a write-ahead
+    log and kept in a memory segment until a flush writes them out as a
+    new segment. Logs not yet flushed are replayed on load.
+
+    A link identifies a document: indexing it again replaces the previous
+    version, which is only marked as deleted in its segment. Small
+    segments are merged into larger ones, dropping deleted documents.
+
+    Reads see a snapshot of segment views with their deleted documents
+    as of the last change, replaced as a whole once a change is done.
+    Changes hold a lock, so documents may be indexed, flushed and merged
+    by other threads while queries run without waiting for them.
+
+    generation grows with every added, deleted or reloaded document, so
+    results cached for one generation are known to be stale in another.
+
+    A read_only index only opens flushed segments, refresh() picks up
+    segments flushed since by the process writing the index.
+    """
+
+    def __init__(self, path=None, scorer=None, analyzer=None,
+                 proximity=1.0, read_only=False, pruning=True,
+                 suggestions=False, fuzzy=0, merge_factor=10):
+        """Init index.
 
-    def __init__(self, datafile=None):
-        """Init index."""
-        if datafile is None:
-            self.datafile = 'text_index.json'
+        The analyzer splits both documents and queries into terms.
+        proximity is the score added to a document for every pair of
+        adjacent query terms found next to each other, pairs further
+        apart add proportionally less. The scorer must score more
+        occurrences of a term higher and longer documents lower for
+        pruning to be exact, without pruning every match is scored.
+        With suggestions, a dictionary of index terms is kept for
+        suggest(). Query terms missing from the index match up to fuzzy
+        index terms within a few edits, scored FUZZY_WEIGHT times lower
+        for every edit, 0 disables fuzzy matching. merge_factor
+        segments in a row are merged once none of them holds more live
+        documents than the others together, see start_merge.
+        """
+        if path is None:
+            self.path = 'text_index'
         else:
-            self.datafile = datafile
+            self.path = path
 
-        self.data = None
+        if scorer is None:
+            self.scorer = BM25()
+        else:
+            self.scorer = scorer
+
+        if analyzer is None:
+            self.analyzer = DEFAULT_ANALYZER
+        else:
+            self.analyzer = analyzer
+        self.proximity = proximity
+        self.pruning = pruning
+        self.read_only = read_only
+        self.manifest_version = None
+        self.dictionary = TermDictionary() if suggestions else None
+        self.fuzzy = fuzzy
+        self.fuzzy_index = FuzzyIndex() if fuzzy else None
+        self.merge_factor = merge_factor
+
+        self.lock = threading.RLock()
+        self.snapshot = Snapshot((), 0)
+        self.segments = []
+        self.flushing = []
+        self.buffer = MemorySegment()
+        self.changed_deletions = set()
+        self.retired = []
+        self.views = {}
+        self.changes = 0
+        self.next_segment = 1
+        self.wal = None
+        self.wal_generation = 0
+        self.wal_checkpoint = 0
         self.load()
 
+    @property
+    def generation(self):
+        """Generation of the snapshot read by queries."""
+        return self.snapshot.generation
+
+    @property
+    def manifest_file(self):
+        """Path of the segments manifest."""
+        return os.path.join(self.path, MANIFEST)
+
+    @property
+    def log_size(self):
+        """Return bytes written to the log since the last flush."""
+        return self.wal.size if self.wal is not None else 0
+
+    def _wal_file(self, generation):
+        return os.path.join(self.path, 'wal_{:06d}.log'.format(generation))
+
+    def _wal_generations(self):
+        """List generations of log files present in index directory."""
+        names = glob.glob(os.path.join(self.path, 'wal_*.log'))
+        return sorted(int(os.path.basename(n)[4:-4]) for n in names)
+
+    def _open_wal(self, generation):
+        if self.wal is not None:
+            self.wal.close()
+        self.wal_generation = generation
+        self.wal = WriteAheadLog(self._wal_file(generation))
+
+    def _replay_wal(self):
+        """Load documents from logs newer than the last flush."""
+        generation = self.wal_checkpoint
+        for generation in self._wal_generations():
+            if generation <= self.wal_checkpoint:
+                os.remove(self._wal_file(generation))
+                continue
+            for record in replay(self._wal_file(generation)):
+                if 'delete' in record:
+                    self._delete(record['delete'])
+                else:
+                    self._add(record['fields'], record.get('terms'),
+                              record.get('positions'))
+        self._open_wal(generation + 1)
+
     def _load(self):
-        with open(self.datafile, 'r') as f:
-            self.data = json.load(f)
+        with open(self.manifest_file, 'r') as f:
+            manifest = json.load(f)
+        if manifest['version'] != FORMAT_VERSION:
+            raise ValueError('Unsupported index format version {}'.format(
+                manifest['version']))
+        self.next_segment = manifest['next_segment']
+        self.wal_checkpoint = manifest['wal_checkpoint']
+        segments = []
+        try:
+            for s in manifest['segments']:
+                deleted = None
+                if s.get('deletions'):
+                    deleted = read_deletions(self.path, s['deletions'])
+                segment = SegmentReader(self.path, s['name'],
+                                        s['doc_count'], s['total_length'],
+                                        deleted)
+                segment.deletions = s.get('deletions')
+                segments.append(segment)
+        except Exception:
+            for segment in segments:
+                segment.close()
+            raise
+        self.segments = segments
 
-    def load(self):
-        """Load index from file."""
+    def _manifest_version(self):
+        """Identity of the current manifest file, None if there is none."""
+        try:
+            stat = os.stat(self.manifest_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def refresh(self):
+        """Reopen segments of read only index if the manifest changed.
+
+        Return True when new segments were loaded.
+        """
+        version = self._manifest_version()
+        if version is None or version == self.manifest_version:
+            return False
+        previous = self.segments
         try:
             self._load()
         except FileNotFoundError:
-            self.data = {'items': []}
-            self._dump()
+            # Writer replaced the manifest meanwhile, retry next time
+            return False
+        self.manifest_version = version
+        self._load_vocabulary()
+        self.changes += 1
+        self._publish()
+        for segment in previous:
+            segment.close()
+        return True
+
+    def load(self):
+        """Open index segments and replay write-ahead logs."""
+        if self.read_only:
+            self.refresh()
+            return
+        with self.lock:
+            self.close()
+            self.flushing = []
+            self.buffer = MemorySegment()
+            self.changed_deletions = set()
+            self.retired = []
+            self.changes += 1
+            try:
+                self._load()
+            except FileNotFoundError:
+                os.makedirs(self.path, exist_ok=True)
+                self._write_manifest()
+            self._remove_unused()
+            self._load_vocabulary()
+            self._replay_wal()
+            self._publish()
+
+    def _remove_unused(self):
+        """Remove segment files not in the manifest.
+
+        Merged segments are left behind by a process stopped before the
+        next manifest change, see _write_manifest.
+        """
+        used = {s.name for s in self.segments}
+        used.update(s.deletions for s in self.segments if s.deletions)
+        for filename in os.listdir(self.path):
+            if filename.startswith('seg_') and filename not in used and \
+                    filename.split('.')[0] not in used:
+                try:
+                    os.remove(os.path.join(self.path, filename))
+                except PermissionError:
+                    # Still mapped by a read only index on Windows
+                    pass
+
+    def _vocabularies(self):
+        """Term dictionaries kept up to date with indexed terms."""
+        return [v for v in (self.dictionary, self.fuzzy_index)
+                if v is not None]
+
+    def _load_vocabulary(self):
+        """Fill term dictionaries with terms of flushed segments."""
+        vocabularies = self._vocabularies()
+        if not vocabularies:
+            return
+        counts = [pair for segment in self.segments
+                  for pair in segment.term_freqs()]
+        for vocabulary in vocabularies:
+            vocabulary.clear()
+            vocabulary.update(counts)
+
+    def _write_manifest(self, retired=()):
+        """Atomically replace manifest with the current segment list.
+
+        Changed deletion sets are written to new files first, files they
+        replace are removed once the manifest no longer refers to them.
+        Files of retired segments, merged into another one, are kept
+        until the next change, so read only indexes loading the previous
+        manifest can still open them, see _remove_retired.
+        """
+        obsolete = []
+        for segment in self.segments:
+            if segment in self.changed_deletions:
+                filename = '{}_{:06d}.del'.format(segment.name,
+                                                  self.wal_generation)
+                if segment.deletions and segment.deletions != filename:
+                    obsolete.append(segment.deletions)
+                segment.deletions = filename
+                write_deletions(self.path, segment.deletions,
+                                segment.deleted)
+        self.changed_deletions.clear()
+
+        manifest = {'version': FORMAT_VERSION,
+                    'next_segment': self.next_segment,
+                    'wal_checkpoint': self.wal_checkpoint,
+                    'segments': [{'name': s.name,
+                                  'doc_count': s.doc_count,
+                                  'total_length': s.total_length,
+                                  'deletions': s.deletions}
+                                 for s in self.segments]}
+        tmp = self.manifest_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_file)
+        for filename in obsolete:
+            os.remove(os.path.join(self.path, filename))
+        self._remove_retired()
+        self.retired.extend(retired)
+
+    def _remove_retired(self):
+        """Close segments retired by merges and remove their files.
+
+        Segments read by queries through a view of an older snapshot are
+        kept, so are files which can not be removed while another process
+        maps them on Windows. Both are tried again with the next change.
+        """
+        retired = []
+        for segment in self.retired:
+            if segment.in_use:
+                retired.append(segment)
+                continue
+            segment.close()
+            try:
+                remove_segment(self.path, segment.name)
+                if segment.deletions:
+                    os.remove(os.path.join(self.path, segment.deletions))
+            except PermissionError:
+                retired.append(segment)
+        self.retired = retired
+
+    def start_flush(self):
+        """Freeze buffered documents and switch to a new log.
+
+        Returns pending flush to be passed to write_flush and finish_flush
+        or None if there is nothing to flush. Frozen documents stay
+        searchable until the flush is finished.
+        """
+        with self.lock:
+            if not self.buffer.doc_count:
+                return None
+            pending = PendingFlush(self.new_segment_name(), self.buffer,
+                                   self.wal_generation)
+            self.flushing.append(pending)
+            self.buffer = MemorySegment()
+            self._open_wal(self.wal_generation + 1)
+            # Documents may have been added without publishing them
+            self.views.pop(pending.segment, None)
+            self._publish()
+            return pending
+
+    def write_flush(self, pending):
+        """Write frozen documents to disk, safe to run in another thread."""
+        write_segment(self.path, pending.name, pending.segment)
+
+    def finish_flush(self, pending):
+        """Publish written segment and drop logs it covers."""
+        with self.lock:
+            segment = SegmentReader(
+                self.path, pending.name, pending.segment.doc_count,
+                pending.segment.total_length, pending.segment.deleted)
+            segment.deletions = None
+            if segment.deleted:
+                self.changed_deletions.add(segment)
+            self.segments.append(segment)
+            self.flushing.remove(pending)
+            self.wal_checkpoint = pending.generation
+            self._write_manifest()
+            self._publish()
+            for generation in self._wal_generations():
+                if generation <= self.wal_checkpoint:
+                    os.remove(self._wal_file(generation))
+
+    def new_segment_name(self):
+        """Reserve name for a segment to be written into the index."""
+        name = 'seg_{:06d}'.format(self.next_segment)
+        self.next_segment += 1
+        return name
+
+    def publish_segment(self, name, doc_count, total_length):
+        """Add segment written under new_segment_name to the index.
+
+        Its documents must not be in the index yet, they bypass the
+        write-ahead log.
+        """
+        with self.lock:
+            reader = SegmentReader(self.path, name, doc_count, total_length)
+            reader.deletions = None
+            self.segments.append(reader)
+            self._write_manifest()
+            for vocabulary in self._vocabularies():
+                vocabulary.update(reader.term_freqs())
+            self.changes += 1
+            self._publish()
+            return reader
+
+    def start_merge(self):
+        """Pick segments to merge, return pending merge or None.
+
+        Of the runs of merge_factor segments where none holds more live
+        documents than the others together, the one with the fewest of
+        them is merged, so every document is copied a logarithmic number
+        of times. The pending merge is passed to write_merge and
+        finish_merge, its segments stay searchable until it is finished.
+        Only one merge may be pending at a time.
+        """
+        with self.lock:
+            if self.merge_factor < 2:
+                return None
+            sizes = [s.doc_count - len(s.deleted) for s in self.segments]
+            best = None
+            for start in range(len(sizes) - self.merge_factor + 1):
+                run = sizes[start:start + self.merge_factor]
+                if 2 * max(run) <= sum(run) and \
+                        (best is None or sum(run) < best[0]):
+                    best = sum(run), start
+            if best is None:
+                return None
+            segments = self.segments[best[1]:best[1] + self.merge_factor]
+            return PendingMerge(self.new_segment_name(), segments,
+                                [s.view() for s in segments])
+
+    def write_merge(self, pending):
+        """Write merged segment, safe to run in another thread.
+
+        Documents deleted when the merge was started are dropped.
+        """
+        if any(view.doc_count > len(view.deleted) for view in pending.views):
+            merge_segments(self.path, pending.name, pending.views)
+
+    def finish_merge(self, pending):
+        """Replace merged segments with the written one.
+
+        Documents deleted since the merge was started are deleted in the
+        new segment.
+        """
+        with self.lock:
+            deleted = set()
+            doc_count = total_length = 0
+            for segment, view in zip(pending.segments, pending.views):
+                dropped = sorted(view.deleted)
+                for doc_id in segment.deleted - view.deleted:
+                    deleted.add(doc_count + doc_id -
+                                bisect.bisect_left(dropped, doc_id))
+                doc_count += view.doc_count - len(dropped)
+                total_length += view.total_length - sum(
+                    view.doc_length(doc_id) for doc_id in dropped)
+                self.changed_deletions.discard(segment)
+            merged = []
+            if doc_count:
+                reader = SegmentReader(self.path, pending.name, doc_count,
+                                       total_length, deleted)
+                reader.deletions = None
+                if deleted:
+                    self.changed_deletions.add(reader)
+                merged.append(reader)
+            start = self.segments.index(pending.segments[0])
+            self.segments[start:start + len(pending.segments)] = merged
+            self._write_manifest(retired=pending.segments)
+            self._publish()
+            return merged[0] if merged else None
 
     def _dump(self):
-        with open(self.datafile, 'w') as f:
-            json.dump(self.data, f)
+        """Write buffered documents as a new segment."""
+        with self.lock:
+            pending = self.start_flush()
+            if pending is not None:
+                self.write_flush(pending)
+                self.finish_flush(pending)
+            elif self.changed_deletions:
+                self._write_manifest()
 
     dump = _dump
 
-    def _clear_text(self, text):
-        cleared_text = ''.join((c for c in text
-                                if c not in string.punctuation))
-        return cleared_text
+    def close(self):
+        """Close log and unmap index segments.
+
+        Files of segments retired by merges are removed when the index
+        is loaded again.
+        """
+        with self.lock:
+            if self.wal is not None:
+                self.wal.close()
+                self.wal = None
+            for segment in self.segments + self.retired:
+                segment.close()
+            self.segments = []
+            self.retired = []
+            self.views = {}
+            self.snapshot = Snapshot((), self.changes)
+
+    def _publish(self):
+        """Publish views of the current segments to queries.
+
+        Views are taken again of the buffer and of segments with new
+        deletions only.
+        """
+        views = {}
+        segments = []
+        base = 0
+        pending = [p.segment for p in self.flushing]
+        for segment in self.segments + pending + [self.buffer]:
+            view = self.views.get(segment)
+            if view is None or segment is self.buffer:
+                view = segment.view()
+            views[segment] = view
+            segments.append((base, view))
+            base += view.doc_count
+        self.views = views
+        self.snapshot = Snapshot(tuple(segments), self.changes)
 
     def _vectorize(self, text):
         """Convert text string to vector for indexing or querying."""
-        cleared_text = self._clear_text(text)
-        vector = cleared_text.split(' ')
-        return vector
-
-    def index_document(self, link, title, summary):
-        """Add document to index."""
-        text = title + '. ' + summary
-        vector = self._vectorize(text)
-        item = {'vector': vector,
-                'summary': summary,
-                'title': title,
-                'link': link}
-        self.data['items'].append(item)
-
-    def query(self, query_text, match_count=3):
-        """Query index."""
-        vector = self._vectorize(query_text)
-        matches = []
-        for item in self.data['items']:
-            m = 0
-            for i in vector:
-                m += item['vector'].count(i)
-            matches.append({'item': item,
-                            'match': m})
-        matches.sort(key=lambda j: j['match'], reverse=True)
-        return {'items': [m['item'] for m in matches if m['match'] > 0]}
+        return self.analyzer(text)
+
+    def _locate(self, link):
+        """Find segment and local id of live document with link.
+
+        Looks at the current segments, not the snapshot, the caller must
+        hold the lock.
+        """
+        pending = [p.segment for p in self.flushing]
+        for segment in [self.buffer] + pending[::-1] + self.segments[::-1]:
+            doc_id = segment.find(link)
+            if doc_id is not None:
+                return segment, doc_id
+        return None, None
+
+    def find_document(self, link):
+        """Get stored fields of document with link, None if not indexed."""
+        for _, segment in reversed(self.snapshot.segments):
+            doc_id = segment.find(link)
+            if doc_id is not None:
+                return segment.document(doc_id)
+        return None
+
+    def _delete(self, link):
+        """Mark live document with link as deleted."""
+        segment, doc_id = self._locate(link)
+        if segment is None:
+            return False
+        segment.deleted.add(doc_id)
+        self.views.pop(segment, None)
+        self.changes += 1
+        if isinstance(segment, SegmentReader):
+            self.changed_deletions.add(segment)
+        return True
+
+    def _add(self, fields, terms, positions=None):
+        """Add new version of document."""
+        if terms is None:
+            terms = {term: len(p) for term, p in positions.items()}
+        self._delete(fields['link'])
+        self.buffer.add(fields, terms, positions)
+        for vocabulary in self._vocabularies():
+            for term in terms:
+                vocabulary.add(term)
+        self.changes += 1
+
+    def index_document(self, link, title, summary, terms=None, etag=None,
+                       last_modified=None, simhash=None):
+        """Add or update document in index.
+
+        Terms produced by document_terms may be passed when the document
+        was already tokenized. HTTP validators etag and last_modified are
+        stored for conditional re-crawl, simhash fingerprint for
+        near-duplicate detection. Return False and keep the stored
+        version when the content did not change.
+        """
+        with self.lock:
+            indexed = self._index_document(link, title, summary, terms,
+                                           etag, last_modified, simhash)
+            if indexed:
+                self._publish()
+        return indexed
+
+    def index_documents(self, documents):
+        """Add or update documents and publish them at once.
+
+        documents are dicts of index_document arguments. Meant to be
+        called in another thread with batches of documents, queries see
+        none of them until all are added. Return the number of documents
+        added or updated.
+        """
+        with self.lock:
+            count = 0
+            for document in documents:
+                count += self._index_document(**document)
+            if count:
+                self._publish()
+        return count
+
+    def _index_document(self, link, title, summary, terms=None, etag=None,
+                        last_modified=None, simhash=None):
+        """Add or update document without publishing it."""
+        start = time.monotonic()
+        digest = content_hash(title, summary)
+        segment, doc_id = self._locate(link)
+        previous = None if segment is None else segment.document(doc_id)
+        if previous is not None and previous.get('hash') == digest:
+            DOCUMENTS.inc(result='unchanged')
+            return False
+
+        if terms is None:
+            vector = document_terms(title, summary, self.analyzer)
+        else:
+            vector = terms
+        fields = document_fields(link, title, summary, etag, last_modified,
+                                 previous=previous, digest=digest,
+                                 simhash=simhash)
+        positions = term_positions(vector)
+        self.wal.append({'fields': fields, 'positions': positions})
+        self._add(fields, None, positions)
+        DOCUMENTS.inc(result='added' if previous is None else 'updated')
+        INDEX_SECONDS.observe(time.monotonic() - start)
+        return True
+
+    def delete_document(self, link):
+        """Delete document with link, return False if it is not indexed."""
+        with self.lock:
+            if self._locate(link)[0] is None:
+                return False
+            self.wal.append({'delete': link})
+            DOCUMENTS.inc(result='deleted')
+            self._delete(link)
+            self._publish()
+            return True
+
+    def iter_documents(self):
+        """Iterate stored fields of all live documents of the snapshot."""
+        for _, segment in self.snapshot.segments:
+            for doc_id in range(segment.doc_count):
+                if doc_id not in segment.deleted:
+                    yield segment.document(doc_id)
+
+    def suggest(self, prefix, limit=10):
+        """List up to limit (term, document count) completions of prefix.
+
+        Terms in more documents go first, deleted documents still count.
+        Without suggestions enabled the list is empty.
+        """
+        if self.dictionary is None:
+            return []
+        return self.dictionary.complete(prefix, limit)
+
+    def collection_stats(self, query_text):
+        """Document count, total length and query term frequencies.
+
+        Stats of several indexes summed together and passed to query()
+        of each of them make scores comparable across the indexes.
+        With fuzzy matching, expansions map query terms missing from the
+        index to similar index terms and their edit distance, frequencies
+        of these terms are included.
+        """
+        return self._collection_stats(self.snapshot.segments, query_text)
+
+    def _collection_stats(self, segments, query_text):
+        """Get collection statistics of query terms in segments."""
+        terms, phrases = parse_query(query_text, self.analyzer)
+        query_terms = terms + [term for phrase in phrases for term in phrase]
+        df = {term: sum(s.doc_freq(term) for _, s in segments)
+              for term in set(query_terms)}
+        expansions = {}
+        if self.fuzzy_index is not None:
+            for term in set(terms):
+                if df[term]:
+                    continue
+                expansions[term] = dict(self.fuzzy_index.similar(term))
+                for similar in expansions[term]:
+                    df[similar] = sum(s.doc_freq(similar)
+                                      for _, s in segments)
+        return {
+            'doc_count': sum(s.doc_count for _, s in segments),
+            'total_length': sum(s.total_length for _, s in segments),
+            'df': df,
+            'expansions': expansions,
+        }
+
+    def query(self, query_text, match_count=3, offset=0,
+              snippet_size=SNIPPET_SIZE, stats=None, scores=False,
+              exact_total=EXACT_TOTAL):
+        """Query index.
+
+        Only postings of the query terms are visited. Documents are ranked
+        by the scorer and the best offset + match_count of them are
+        selected with a bounded heap, so the full match list is never
+        sorted. Stored fields are loaded for the selected documents only,
+        results hold link, title and a snippet of about snippet_size
+        characters with highlighted query terms instead of full text.
+        total is the number of all matching documents.
+
+        Quoted phrases must occur in matching documents, which is checked
+        on positions of phrase terms. The best PROXIMITY_CANDIDATES
+        documents get a boost for query terms close to each other.
+
+        Without phrases, documents which can not make it to the best ones
+        are skipped once exact_total matches are counted, see pruning.
+        total is then only a lower bound and total_exact is false.
+
+        stats as returned by collection_stats() replace the statistics of
+        this index in scoring, results hold their score if scores is true.
+        The query reads a single snapshot, documents indexed meanwhile are
+        not seen.
+        """
+        start = time.monotonic()
+        segments = self.snapshot.segments
+        page = {'items': [], 'total': 0, 'total_exact': True,
+                'offset': offset, 'limit': match_count}
+        if not any(s.doc_count for _, s in segments):
+            return page
+
+        terms, phrases = parse_query(query_text, self.analyzer)
+        query_terms = terms + [term for phrase in phrases for term in phrase]
+        if stats is None:
+            stats = self._collection_stats(segments, query_text)
+        doc_count = stats['doc_count']
+        avg_length = stats['total_length'] / doc_count or 1
+        weighted = []
+        postings = 0
+        matched_terms = list(query_terms)
+        for term, qtf in Counter(query_terms).items():
+            if stats['df'].get(term, 0):
+                matches = [(term, qtf)]
+            else:
+                matches = [(similar, qtf * FUZZY_WEIGHT ** distance)
+                           for similar, distance in self._expand(term, stats)]
+                matched_terms.extend(similar for similar, _ in matches)
+            for match, weight in matches:
+                df = stats['df'].get(match, 0)
+                if df:
+                    weighted.append((len(weighted), match, weight,
+                                     self.scorer.idf(df, doc_count)))
+                    postings += df
+        pairs = [(a, b) for a, b in zip(query_terms, query_terms[1:])
+                 if a != b]
+
+        # Pruning starts only after exact_total matches are counted
+        if self.pruning and not phrases and postings > exact_total:
+            k = offset + match_count
+            if self.proximity and pairs:
+                k = max(k, PROXIMITY_CANDIDATES)
+            scores_by_doc, page['total'], page['total_exact'] = \
+                self._score_top(segments, weighted, avg_length, k,
+                                exact_total)
+        else:
+            scores_by_doc = self._score_all(segments, weighted, avg_length)
+            if phrases:
+                matches = self._phrase_matches(segments, phrases)
+                scores_by_doc = {key: score
+                                 for key, score in scores_by_doc.items()
+                                 if key in matches}
+            page['total'] = len(scores_by_doc)
+
+        if self.proximity and pairs and scores_by_doc:
+            candidates = heapq.nsmallest(
+                max(offset + match_count, PROXIMITY_CANDIDATES),
+                scores_by_doc.items(), key=lambda m: (-m[1], m[0]))
+            scores_by_doc = dict(candidates)
+            self._boost_proximity(segments, scores_by_doc, pairs)
+
+        top = heapq.nsmallest(offset + match_count, scores_by_doc.items(),
+                              key=lambda m: (-m[1], m[0]))
+        for doc_id, score in top[offset:]:
+            result = self._result(segments, doc_id, matched_terms,
+                                  snippet_size)
+            if scores:
+                result['score'] = score
+            page['items'].append(result)
+        QUERY_SECONDS.observe(time.monotonic() - start)
+        return page
+
+    def _expand(self, term, stats):
+        """Best fuzzy matches of term as (term, distance) pairs.
+
+        Closer terms go first, then ones in more documents.
+        """
+        if not self.fuzzy:
+            return []
+        similar = stats.get('expansions', {}).get(term, {})
+        return heapq.nsmallest(
+            self.fuzzy, similar.items(),
+            key=lambda m: (m[1], -stats['df'].get(m[0], 0), m[0]))
+
+    def _score_all(self, segments, weighted, avg_length):
+        """Score every document containing any of weighted terms."""
+        scores = {}
+        for _, term, qtf, idf in weighted:
+            for base, segment in segments:
+                deleted = segment.deleted
+                for doc_id, tf in segment.postings(term):
+                    if doc_id in deleted:
+                        continue
+                    score = qtf * self.scorer.score(
+                        tf, segment.doc_length(doc_id), avg_length, idf)
+                    key = base + doc_id
+                    scores[key] = scores.get(key, 0) + score
+        return scores
+
+    def _score_top(self, segments, weighted, avg_length, k, exact_total):
+        """Score best k documents skipping ones that can not make it.
+
+        Return their scores, the count of matching documents and whether
+        the count is exact.
+        """
+        top = TopK(k, exact_total)
+        for base, segment in segments:
+            cursors = []
+            for order, term, qtf, idf in weighted:
+                found = segment.postings_blocks(term)
+                if found is not None:
+                    cursors.append(Cursor(order, found[0], found[1],
+                                          self._term_scorer(qtf, idf,
+                                                            avg_length)))
+            search_segment(top, base, cursors, segment.deleted,
+                           segment.doc_length)
+        return dict(top.items()), top.count, top.exact
+
+    def _term_scorer(self, qtf, idf, avg_length):
+        """Score of term by tf and document length, as in _score_all."""
+        scorer = self.scorer
+
+        def score(tf, doc_length):
+            return qtf * scorer.score(tf, doc_length, avg_length, idf)
+        return score
+
+    def _phrase_matches(self, segments, phrases):
+        """Global ids of documents containing all phrases."""
+        matches = set()
+        for base, segment in segments:
+            docs = None
+            for phrase in phrases:
+                found = self._phrase_docs(segment, phrase, docs)
+                docs = found if docs is None else docs & found
+            matches.update(base + doc_id for doc_id in docs)
+        return matches
+
+    def _phrase_docs(self, segment, phrase, candidates=None):
+        """Local ids of documents containing phrase.
+
+        Documents stored without positions match when they contain all
+        phrase terms.
+        """
+        unique = sorted(set(phrase), key=segment.doc_freq)
+        positions = {}
+        for term in unique:
+            term_positions = dict(segment.positions(term, candidates))
+            positions[term] = term_positions
+            candidates = set(term_positions)
+            if not candidates:
+                return set()
+
+        found = set()
+        for doc_id in candidates:
+            doc_positions = [positions[term][doc_id] for term in phrase]
+            if not all(doc_positions):
+                found.add(doc_id)
+                continue
+            following = [set(p) for p in doc_positions[1:]]
+            for start in doc_positions[0]:
+                if all(start + i in p for i, p in enumerate(following, 1)):
+                    found.add(doc_id)
+                    break
+        return found
+
+    def _boost_proximity(self, segments, scores, pairs):
+        """Add proximity scores of query term pairs to candidates."""
+        bases = [base for base, _ in segments]
+        by_segment = {}
+        for key in scores:
+            i = bisect.bisect_right(bases, key) - 1
+            by_segment.setdefault(i, []).append(key)
+
+        for i, keys in by_segment.items():
+            base, segment = segments[i]
+            local = {key - base for key in keys}
+            positions = {}
+            for term in set(t for pair in pairs for t in pair):
+                positions[term] = dict(segment.positions(term, local))
+            for key in keys:
+                doc_id = key - base
+                for a, b in pairs:
+                    distance = min_distance(positions[a].get(doc_id, ()),
+                                            positions[b].get(doc_id, ()))
+                    if distance:
+                        scores[key] += self.proximity / distance
+
+    def _result(self, segments, doc_id, query_terms, snippet_size):
+        """Load result fields and snippet of document by global doc id."""
+        i = bisect.bisect_right([base for base, _ in segments], doc_id) - 1
+        base, segment = segments[i]
+        fields = segment.document(doc_id - base)
+        result = {name: fields[name] for name in RESULT_FIELDS}
+        result['snippet'] = make_snippet(fields['summary'], query_terms,
+                                         self.analyzer, snippet_size)
+        return result
 
 
 if __name__ == '__main__':
@@ -87,7 +1023,7 @@ if __name__ == '__main__':
                'territorial claims in Europe.'
     title1 = "Ottoman wars in Europe"
     link1 = 'https://en.wikipedia.org/wiki/Ottoman_wars_in_Europe'
-    i.index_document(summary1, title1, link1)
+    i.index_document(link1, title1, summary1)
 
     summary2 = 'Robyn Love was born in Ayr, Scotland, on 28 August 1990.[1]' \
                ' She was born with arthrogryposis, a rare condition in which' \
@@ -110,7 +1046,7 @@ if __name__ == '__main__':
                ' she started playing basketball.[2]'
     title2 = "Robyn Love"
     link2 = 'https://en.wikipedia.org/wiki/Robyn_Love'
-    i.index_document(summary2, title2, link2)
+    i.index_document(link2, title2, summary2)
 
     summary3 = 'The successor of Sony Alpha 77 model, the Sony Alpha 77 ' \
                'II is similar in design to its antecedent, including the ' \
@@ -132,6 +1068,6 @@ if __name__ == '__main__':
                ' 25600. APS-C sized CMOS sensor.'
     title3 = "Sony Alpha 77 II"
     link3 = 'https://en.wikipedia.org/wiki/Sony_Alpha_77_II'
-    i.index_document(summary3, title3, link3)
+    i.index_document(link3, title3, summary3)
 
     i.dump()
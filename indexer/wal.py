@@ -0,0 +1,54 @@
+"""Write-ahead log of indexed documents.
+
+Every record is a little endian uint32 payload size and CRC32 followed by
+JSON payload. Replay stops at the first truncated or corrupted record, so
+a crash in the middle of a write loses at most that record.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+HEADER = struct.Struct('<II')
+
+
+class WriteAheadLog:
+    """Append only log file."""
+
+    def __init__(self, filename, sync=False):
+        """Open log for appending."""
+        self.filename = filename
+        self.sync = sync
+        self._file = open(filename, 'ab')
+        self.size = self._file.tell()
+
+    def append(self, record):
+        """Append record and flush it to the operating system."""
+        payload = json.dumps(record).encode('utf-8')
+        self._file.write(HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        self.size += HEADER.size + len(payload)
+
+    def close(self):
+        """Close log file."""
+        self._file.close()
+
+
+def replay(filename):
+    """Iterate records stored in log file."""
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    pos = 0
+    while pos + HEADER.size <= len(data):
+        size, crc = HEADER.unpack_from(data, pos)
+        start = pos + HEADER.size
+        payload = data[start:start + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+        yield json.loads(payload.decode('utf-8'))
+        pos = start + size
@@ -0,0 +1,229 @@
+"""Process metrics in Prometheus text format.
+
+Metrics are module level objects updated on hot paths, so updates are
+plain dict operations under a lock of the metric, without allocation of
+label objects. The index writer thread updates them while render() runs
+on the event loop:
+
+    FETCHES = counter('fetches_total', 'Fetched pages.', ['result'])
+    FETCHES.inc(result='ok')
+
+render() formats all registered metrics for a /metrics endpoint.
+"""
+
+import bisect
+import threading
+
+INF = float('inf')
+
+# Seconds, from fast in-memory operations to slow page fetches
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = ['{}="{}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == INF:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Named metric with optional labels."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        """Init metric."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """Iterate (suffix, label values, extra label, value)."""
+        raise NotImplementedError
+
+    def render(self):
+        """Format metric in Prometheus text format."""
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for suffix, values, extra, value in self.samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix, _format_labels(self.labels, values, extra),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonically growing count."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        """Init counter."""
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        """Increase count."""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """Get current count."""
+        return self.values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Iterate samples."""
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield '', key, '', value
+
+
+class Gauge(Metric):
+    """Value that goes up and down, or is read from a function."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=()):
+        """Init gauge."""
+        super().__init__(name, documentation, labels)
+        self.values = {}
+        self.functions = {}
+
+    def set(self, value, **labels):
+        """Set value."""
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def set_function(self, function, **labels):
+        """Read value from function when metrics are rendered."""
+        key = self._key(labels)
+        with self.lock:
+            self.functions[key] = function
+
+    def get(self, **labels):
+        """Get current value."""
+        key = self._key(labels)
+        if key in self.functions:
+            return self.functions[key]()
+        return self.values.get(key, 0)
+
+    def samples(self):
+        """Iterate samples."""
+        with self.lock:
+            values = dict(self.values)
+            functions = list(self.functions.items())
+        # Functions may take locks of their own, they are called unlocked
+        for key, function in functions:
+            values[key] = function()
+        for key, value in sorted(values.items()):
+            yield '', key, '', value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=DEFAULT_BUCKETS):
+        """Init histogram."""
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, value, **labels):
+        """Record value."""
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+                self.sums[key] = 0
+            counts[bucket] += 1
+            self.sums[key] += value
+
+    def count(self, **labels):
+        """Count observed values."""
+        return sum(self.counts.get(self._key(labels), ()))
+
+    def samples(self):
+        """Iterate samples."""
+        with self.lock:
+            items = sorted((key, list(counts), self.sums[key])
+                           for key, counts in self.counts.items())
+        for key, counts, total_sum in items:
+            total = 0
+            for bound, count in zip(self.buckets + (INF,), counts):
+                total += count
+                yield '_bucket', key, 'le="{}"'.format(
+                    _format_value(bound)), total
+            yield '_sum', key, '', total_sum
+            yield '_count', key, '', total
+
+
+class Registry:
+    """Set of metrics rendered together."""
+
+    def __init__(self):
+        """Init empty registry."""
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """Add metric, return already registered one with the same name."""
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """Format all metrics."""
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        return ''.join(metric.render() + '\n' for _, metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=(), registry=REGISTRY):
+    """Get or create counter."""
+    return registry.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=(), registry=REGISTRY):
+    """Get or create gauge."""
+    return registry.register(Gauge(name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS,
+              registry=REGISTRY):
+    """Get or create histogram."""
+    return registry.register(Histogram(name, documentation, labels,
+                                       buckets))
+
+
+def render(registry=REGISTRY):
+    """Format metrics of registry in Prometheus text format."""
+    return registry.render()
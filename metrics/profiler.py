@@ -0,0 +1,66 @@
+"""Sampling profiler of the event loop thread.
+
+A background thread looks at the stack of the profiled thread every
+interval seconds and counts the stacks it sees. The profiled code runs
+unchanged, so the overhead is one stack walk per interval.
+"""
+
+import sys
+import threading
+
+
+class SamplingProfiler:
+    """Count stacks of one thread sampled at a fixed interval."""
+
+    def __init__(self, interval=0.01, thread_id=None, max_depth=64):
+        """Init profiler of thread, the current thread by default."""
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None \
+            else thread_id
+        self.max_depth = max_depth
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop sampling."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Record the current stack of the profiled thread."""
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append('{}:{}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+        if names:
+            stack = ';'.join(reversed(names))
+            self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        """Format stacks in folded format, input of flame graph tools."""
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in
+                       sorted(dict(self.stacks).items(),
+                              key=lambda s: -s[1]))
+
+    def reset(self):
+        """Forget collected samples."""
+        self.stacks = {}
+        self.samples = 0
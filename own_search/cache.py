@@ -0,0 +1,57 @@
+"""Cache of query results."""
+
+import time
+from collections import OrderedDict
+
+
+def normalize_query(query_text):
+    """Cache key form of query text: case folded, single spaced."""
+    return ' '.join(query_text.casefold().split())
+
+
+class QueryCache:
+    """LRU cache of query results with time to live.
+
+    Every entry remembers the index generation it was computed for, an
+    entry of an older generation is a miss, so results never lag behind
+    indexed documents. At most max_entries results are kept.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300):
+        """Init empty cache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        """Get cached value or None."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry_generation, expires, value = entry
+            if entry_generation == generation and \
+                    time.monotonic() < expires:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, generation, value):
+        """Store value, evict least recently used entries."""
+        self.entries[key] = (generation, time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """Hit and miss counts."""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,79 @@
+"""Index crawled pages in batches off the event loop."""
+
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class Ingester:
+    """Crawler consumer indexing pages in batches in a writer thread.
+
+    Pages are queued and passed to index_documents of the index in
+    batches of up to batch_size, collected for at most delay seconds
+    after the first one. Batches are indexed one after another in
+    executor, the single writer thread of the index, while queries on the
+    loop keep reading the previous snapshot. Once max_pending pages wait,
+    the consumer waits too, so crawling slows down to the indexing pace.
+    """
+
+    def __init__(self, text_index, executor, loop, batch_size=100,
+                 delay=0.5, max_pending=1000):
+        """Init ingester and start indexing queued pages."""
+        self.text_index = text_index
+        self.executor = executor
+        self.loop = loop
+        self.batch_size = batch_size
+        self.delay = delay
+        self.queue = asyncio.Queue(max_pending, loop=loop)
+        self._task = loop.create_task(self._run())
+
+    @asyncio.coroutine
+    def __call__(self, link, title, summary, **kwargs):
+        """Queue page with index_document arguments for indexing."""
+        kwargs.update(link=link, title=title, summary=summary)
+        yield from self.queue.put(kwargs)
+
+    @asyncio.coroutine
+    def _batch(self):
+        """Wait for queued pages, return a batch of them."""
+        batch = [(yield from self.queue.get())]
+        deadline = self.loop.time() + self.delay
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append((yield from asyncio.wait_for(
+                    self.queue.get(), timeout, loop=self.loop)))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @asyncio.coroutine
+    def _run(self):
+        """Index batches of queued pages."""
+        while True:
+            batch = yield from self._batch()
+            try:
+                yield from self.loop.run_in_executor(
+                    self.executor, self.text_index.index_documents, batch)
+            except Exception:
+                log.exception('Failed to index %d pages', len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    @asyncio.coroutine
+    def join(self):
+        """Wait until all queued pages are indexed."""
+        yield from self.queue.join()
+
+    @asyncio.coroutine
+    def close(self):
+        """Index queued pages and stop."""
+        yield from self.join()
+        self._task.cancel()
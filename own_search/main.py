@@ -1,8 +1,12 @@
 """Own Search application file."""
 
 import asyncio
+import functools
 import logging
+import multiprocessing
 import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from aiohttp import web
 import aiohttp_jinja2
@@ -10,12 +14,24 @@ import jinja2
 import yaml
 
 from indexer import TextIndex
+from indexer.analysis import make_analyzer
+from indexer.dedup import DuplicateFilter
+from indexer.sharding import ShardedIndex
+from indexer.text_index import document_terms, measure_size
+from own_search.cache import QueryCache
+from own_search.ingest import Ingester
 from own_search.routes import setup_routes
+from own_search.shard import ShardClient, run_shard
+from own_search.views import metrics_middleware
+from metrics.profiler import SamplingProfiler
+from crawler.frontier import DiskFrontier
 from crawler.web_crawler import WebCrawler
 
 
 PROJ_ROOT = pathlib.Path(__file__).parent
 
+log = logging.getLogger(__name__)
+
 
 def load_config(fname):
     """Load yaml config file."""
@@ -24,6 +40,164 @@ def load_config(fname):
     return data
 
 
+@asyncio.coroutine
+def merge_index(text_index, loop, executor=None):
+    """Merge segments of index while a merge is due."""
+    while True:
+        pending = yield from loop.run_in_executor(executor,
+                                                  text_index.start_merge)
+        if pending is None:
+            return
+        yield from loop.run_in_executor(None, text_index.write_merge,
+                                        pending)
+        yield from loop.run_in_executor(executor, text_index.finish_merge,
+                                        pending)
+        log.info('Merged %d segments of %s into %s', len(pending.segments),
+                 text_index.path, pending.name)
+
+
+@asyncio.coroutine
+def flush_index(indexes, lock, loop, interval=60,
+                max_log_size=16 * 2 ** 20, executor=None):
+    """Periodically compact write-ahead logs into index segments.
+
+    indexes are the TextIndex instances to flush, the shards of a sharded
+    index. Segment files are written in the default executor, so the
+    event loop keeps serving requests while a flush is in progress, then
+    segments are merged the same way. Flushes and merges are started and
+    finished in executor, the writer thread of the indexes. The lock is
+    held while flushing, shutdown takes it before cancelling the task.
+    """
+    last_flush = time.monotonic()
+    while True:
+        yield from asyncio.sleep(min(interval, 1), loop=loop)
+        due = time.monotonic() - last_flush >= interval
+        if not due and sum(i.log_size for i in indexes) < max_log_size:
+            continue
+
+        last_flush = time.monotonic()
+        with (yield from lock):
+            for text_index in indexes:
+                pending = yield from loop.run_in_executor(
+                    executor, text_index.start_flush)
+                if pending is None:
+                    continue
+                yield from loop.run_in_executor(
+                    None, text_index.write_flush, pending)
+                yield from loop.run_in_executor(
+                    executor, text_index.finish_flush, pending)
+                log.info('Flushed %d documents to %s',
+                         pending.segment.doc_count,
+                         text_index.path + '/' + pending.name)
+                yield from merge_index(text_index, loop, executor)
+
+
+@asyncio.coroutine
+def close_index(app):
+    """Index queued pages, flush and close index on shutdown."""
+    if 'ingester' in app:
+        yield from app['ingester'].close()
+    with (yield from app['flush_lock']):
+        app['flush_task'].cancel()
+    text_index = app['text_index']
+    executor = app['index_executor']
+    yield from app.loop.run_in_executor(executor, text_index.dump)
+    yield from app.loop.run_in_executor(executor, text_index.close)
+    executor.shutdown()
+
+
+@asyncio.coroutine
+def watch_crawl(crawler, ingester, text_index, lock, loop, executor):
+    """Flush index once all queued pages are crawled and indexed."""
+    yield from crawler.join()
+    yield from ingester.join()
+    log.info('Crawl finished, %d pages queued', crawler.queued_pages)
+    with (yield from lock):
+        yield from loop.run_in_executor(executor, text_index.dump)
+
+
+@asyncio.coroutine
+def close_crawler(app):
+    """Finish pages in flight and close crawler on shutdown."""
+    app['crawl_task'].cancel()
+    yield from app['crawler'].shutdown(app['shutdown_timeout'])
+
+
+def start_shards(conf, index_conf, loop):
+    """Start shard processes, return them and client querying them."""
+    host = conf['host']
+    port = conf.get('shard_port', conf['port'] + 1)
+    path = index_conf.get('path', 'text_index')
+    processes = []
+    urls = []
+    for shard in range(index_conf['shards']):
+        process = multiprocessing.Process(
+            target=run_shard, name='shard-{}'.format(shard), daemon=True,
+            args=(host, port + shard, path, shard),
+            kwargs={'analyzer': index_conf.get('analyzer'),
+                    'proximity': index_conf.get('proximity', 1.0),
+                    'pruning': index_conf.get('pruning', True),
+                    'fuzzy': index_conf.get('fuzzy', 0),
+                    'refresh_interval': index_conf.get('refresh_interval',
+                                                       1)})
+        process.start()
+        processes.append(process)
+        urls.append('http://{}:{}'.format(host, port + shard))
+    return processes, ShardClient(urls, loop)
+
+
+@asyncio.coroutine
+def stop_shards(app):
+    """Stop shard processes on shutdown."""
+    app['shard_client'].close()
+    for process in app['shard_processes']:
+        process.terminate()
+    for process in app['shard_processes']:
+        process.join()
+
+
+@asyncio.coroutine
+def stop_profiler(app):
+    """Stop sampling thread on shutdown."""
+    app['profiler'].stop()
+
+
+def start_crawl(app, conf, loop, text_index, tokenizer):
+    """Crawl and index pages in the server process.
+
+    Pages are indexed in batches by the index writer thread.
+    """
+    crawler_conf = dict(conf.get('crawler', {}))
+    frontier_conf = crawler_conf.pop('frontier', None)
+    if frontier_conf is not None:
+        crawler_conf['frontier'] = DiskFrontier(loop=loop, **frontier_conf)
+    crawler = WebCrawler(loop=loop, tokenizer=tokenizer,
+                         validators=text_index.find_document, **crawler_conf)
+    app['crawler'] = crawler
+    # Crawled pages are indexed before the index is closed
+    app.on_shutdown.append(close_crawler)
+    if conf.get('recrawl'):
+        crawler.recrawl(text_index.iter_documents())
+    crawler.add_urls([conf['start_url']])
+    crawler.create_workers()
+    index_conf = conf.get('index', {})
+    ingester = Ingester(text_index, app['index_executor'], loop,
+                        batch_size=index_conf.get('batch_size', 100),
+                        delay=index_conf.get('batch_delay', 0.5))
+    app['ingester'] = ingester
+    consumer = ingester
+    dedup_conf = conf.get('dedup')
+    if dedup_conf is not None:
+        consumer = DuplicateFilter(consumer, tokenizer=tokenizer,
+                                   **dedup_conf)
+        consumer.load(text_index.iter_documents())
+        app['dedup'] = consumer
+    crawler.register_consumer(consumer)
+    app['crawl_task'] = loop.create_task(
+        watch_crawl(crawler, ingester, text_index, app['flush_lock'], loop,
+                    app['index_executor']))
+
+
 @asyncio.coroutine
 def init(loop):
     """Init application."""
@@ -31,17 +205,63 @@ def init(loop):
     conf = load_config(str(pathlib.Path('.') / 'config' / 'own_search.yaml'))
 
     # setup application and extensions
-    app = web.Application(loop=loop)
+    app = web.Application(loop=loop, middlewares=[metrics_middleware])
     aiohttp_jinja2.setup(
         app, loader=jinja2.PackageLoader('own_search', 'templates'))
 
-    text_index = TextIndex()
+    index_conf = conf.get('index', {})
+    analyzer = make_analyzer(**index_conf.get('analyzer', {}))
+    tokenizer = functools.partial(document_terms, analyzer=analyzer)
+    shards = index_conf.get('shards', 1)
+    suggest_conf = conf.get('suggest')
+    if suggest_conf is not None:
+        app['suggest_limit'] = suggest_conf.get('max_results', 10)
+    if shards > 1:
+        # Shard processes answer queries, fuzzy matching is done there
+        text_index = ShardedIndex(
+            index_conf.get('path', 'text_index'), shards, analyzer=analyzer,
+            proximity=index_conf.get('proximity', 1.0),
+            pruning=index_conf.get('pruning', True),
+            suggestions=suggest_conf is not None,
+            merge_factor=index_conf.get('merge_factor', 10))
+        indexes = text_index.shards
+        app['shard_processes'], app['shard_client'] = start_shards(
+            conf, index_conf, loop)
+        app.on_shutdown.append(stop_shards)
+    else:
+        text_index = TextIndex(index_conf.get('path'), analyzer=analyzer,
+                               proximity=index_conf.get('proximity', 1.0),
+                               pruning=index_conf.get('pruning', True),
+                               suggestions=suggest_conf is not None,
+                               fuzzy=index_conf.get('fuzzy', 0),
+                               merge_factor=index_conf.get('merge_factor',
+                                                           10))
+        indexes = [text_index]
+    measure_size(indexes)
     app['text_index'] = text_index
+    # Documents are added, flushed and merged in this thread only
+    app['index_executor'] = ThreadPoolExecutor(1)
+    app['flush_lock'] = asyncio.Lock(loop=loop)
+    app['flush_task'] = loop.create_task(flush_index(
+        indexes, app['flush_lock'], loop,
+        interval=index_conf.get('flush_interval', 60),
+        max_log_size=index_conf.get('flush_log_size', 16 * 2 ** 20),
+        executor=app['index_executor']))
+    cache_conf = conf.get('query_cache')
+    if cache_conf is not None:
+        app['query_cache'] = QueryCache(**cache_conf)
 
-    crawler = WebCrawler(loop=loop)
-    yield from crawler.url_queue.put(conf['start_url'])
-    crawler.create_workers()
-    crawler.register_consumer(text_index.index_document)
+    app['shutdown_timeout'] = conf.get('shutdown_timeout', 10)
+    if conf.get('crawl', True):
+        start_crawl(app, conf, loop, text_index, tokenizer)
+    app.on_shutdown.append(close_index)
+
+    profiler_conf = conf.get('profiler')
+    if profiler_conf is not None:
+        profiler = SamplingProfiler(**profiler_conf)
+        profiler.start()
+        app['profiler'] = profiler
+        app.on_shutdown.append(stop_profiler)
 
     # setup views and routes
     setup_routes(app, PROJ_ROOT)
@@ -1,7 +1,12 @@
 """Own Search routes."""
 
+from .views import document
 from .views import index
+from .views import metrics_view
+from .views import profile
 from .views import query
+from .views import stats
+from .views import suggest
 
 
 def setup_routes(app, project_root):
@@ -11,3 +16,8 @@ def setup_routes(app, project_root):
                           name='static')
     app.router.add_get('/', index)
     app.router.add_post('/q', query)
+    app.router.add_get('/doc', document)
+    app.router.add_get('/suggest', suggest)
+    app.router.add_get('/stats', stats)
+    app.router.add_get('/metrics', metrics_view)
+    app.router.add_get('/profile', profile)
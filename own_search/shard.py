@@ -0,0 +1,148 @@
+"""Shard search processes and the client scattering queries to them.
+
+Every shard process serves one shard directory of a ShardedIndex opened
+read only. The search server process writes the index, shard processes
+reload it once segments are flushed, so crawled pages become searchable
+after the next index flush.
+"""
+
+import asyncio
+import json
+import logging
+
+import aiohttp
+from aiohttp import web
+import async_timeout
+
+from indexer.analysis import make_analyzer
+from indexer.sharding import merge_pages, merge_stats, shard_path
+from indexer.text_index import TextIndex
+
+log = logging.getLogger(__name__)
+
+
+@asyncio.coroutine
+def shard_stats(request):
+    """Serve collection statistics of query terms and index generation."""
+    data = yield from request.json()
+    text_index = request.app['text_index']
+    return web.json_response({
+        'generation': text_index.generation,
+        'stats': text_index.collection_stats(data['query'])})
+
+
+@asyncio.coroutine
+def shard_query(request):
+    """Serve scored results of shard for query with global statistics."""
+    data = yield from request.json()
+    return web.json_response(request.app['text_index'].query(
+        data['query'], match_count=data['match_count'],
+        stats=data['stats'], scores=True))
+
+
+@asyncio.coroutine
+def refresh_index(text_index, loop, interval):
+    """Periodically pick up segments flushed by the index writer."""
+    while True:
+        yield from asyncio.sleep(interval, loop=loop)
+        if text_index.refresh():
+            log.info('Reloaded %d segments of %s', len(text_index.segments),
+                     text_index.path)
+
+
+@asyncio.coroutine
+def stop_refresh(app):
+    """Stop reloading and close index on shutdown."""
+    app['refresh_task'].cancel()
+    app['text_index'].close()
+
+
+def make_shard_app(loop, path, shard, analyzer=None, proximity=1.0,
+                   pruning=True, fuzzy=0, refresh_interval=1):
+    """Make application serving shard of sharded index at path."""
+    app = web.Application(loop=loop)
+    text_index = TextIndex(shard_path(path, shard),
+                           analyzer=make_analyzer(**(analyzer or {})),
+                           proximity=proximity, pruning=pruning,
+                           fuzzy=fuzzy, read_only=True)
+    app['text_index'] = text_index
+    app['refresh_task'] = loop.create_task(
+        refresh_index(text_index, loop, refresh_interval))
+    app.on_shutdown.append(stop_refresh)
+    app.router.add_post('/shard/stats', shard_stats)
+    app.router.add_post('/shard/q', shard_query)
+    return app
+
+
+def run_shard(host, port, path, shard, **kwargs):
+    """Serve one shard, target of a shard process."""
+    logging.basicConfig(level=logging.INFO)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    app = make_shard_app(loop, path, shard, **kwargs)
+    web.run_app(app, host=host, port=port, print=None)
+
+
+class ShardClient:
+    """Scatter queries to shard processes and gather their results.
+
+    Every query makes two parallel rounds of requests, one for the
+    statistics of the query terms and one for results scored with the
+    statistics of all shards. The first round also returns the index
+    generation of every shard, cached results of the same generations
+    are returned without the second round.
+    """
+
+    def __init__(self, urls, loop, timeout=10):
+        """Init client of shards with base urls."""
+        self.urls = urls
+        self.loop = loop
+        self.timeout = timeout
+        self.session = aiohttp.ClientSession(loop=loop)
+
+    @asyncio.coroutine
+    def _post(self, url, data):
+        with async_timeout.timeout(self.timeout, loop=self.loop):
+            resp = yield from self.session.post(
+                url, data=json.dumps(data),
+                headers={'Content-Type': 'application/json'})
+            try:
+                resp.raise_for_status()
+                return (yield from resp.json())
+            finally:
+                resp.release()
+
+    @asyncio.coroutine
+    def _scatter(self, path, data):
+        return (yield from asyncio.gather(
+            *[self._post(url + path, data) for url in self.urls],
+            loop=self.loop))
+
+    @asyncio.coroutine
+    def query(self, query_text, match_count=3, offset=0, cache=None,
+              cache_key=None):
+        """Query all shards, page is the same as TextIndex.query one.
+
+        Results are looked up in and stored to cache under cache_key.
+        """
+        replies = yield from self._scatter('/shard/stats',
+                                           {'query': query_text})
+        generation = tuple(r['generation'] for r in replies)
+        if cache is not None:
+            page = cache.get(cache_key, generation)
+            if page is not None:
+                return page
+
+        stats = merge_stats(r['stats'] for r in replies)
+        pages = yield from self._scatter('/shard/q', {
+            'query': query_text,
+            'match_count': offset + match_count,
+            'stats': stats})
+        page = merge_pages(pages, match_count, offset)
+        if cache is not None:
+            cache.put(cache_key, generation, page)
+        return page
+
+    def close(self):
+        """Close HTTP session."""
+        self.session.close()
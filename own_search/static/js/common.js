@@ -1,73 +1,210 @@
 $(document).ready(function() {
 
-var aj = null;
+var aj = null,
+    suggestAj = null,
+    suggestTimer = null,
+    // Milliseconds without typing before suggestions are requested
+    suggestDelay = 150,
+    limit = 10,
+    query = '',
+    bl = {
+        s:   '<div class="res-item">',
+        h2s: '<h2 class="title">',
+        h2e: '</h2>',
+        l:   '<div class="link">',
+        t:   '<div class="summary">',
+        as:  '<a target="_blank" href="',
+        ah:  '">',
+        ae:  '</a>',
+        e:   '</div>',
+        ms:  '<a href="#" class="more" data-link="',
+        me:  '">Full text</a>',
+        ps:  '<div class="pager">',
+        no:  'No result.',
+        img: '<img src="/static/image/ajax-loader.gif" />'
+    };
+
+function escapeHtml(text) {
+    return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+}
+
+function highlight(snippet) {
+    // Offsets count code points, String.slice would count UTF-16 units
+    var chars = Array.from(snippet.text),
+        html = '',
+        pos = 0;
+    for (var i = 0; i < snippet.highlights.length; i++) {
+        var start = snippet.highlights[i][0],
+            end = snippet.highlights[i][1];
+        html += escapeHtml(chars.slice(pos, start).join(''));
+        html += '<b>' + escapeHtml(chars.slice(start, end).join('')) +
+            '</b>';
+        pos = end;
+    }
+    return html + escapeHtml(chars.slice(pos).join(''));
+}
+
+function pager(msg) {
+    var html = bl.ps + 'Results ' + (msg.offset + 1) + '-' +
+        (msg.offset + msg.items.length) + ' of ' +
+        (msg.total_exact ? '' : 'at least ') + msg.total;
+    if (msg.offset > 0) {
+        html += ' <a href="#" class="page" data-offset="' +
+            Math.max(0, msg.offset - msg.limit) + '">Previous</a>';
+    }
+    // Inexact total only counts documents up to the shown ones
+    if (msg.offset + msg.items.length < msg.total ||
+            (!msg.total_exact && msg.items.length == msg.limit)) {
+        html += ' <a href="#" class="page" data-offset="' +
+            (msg.offset + msg.limit) + '">Next</a>';
+    }
+    return html + bl.e;
+}
+
+function search(offset) {
+
+    if (aj) aj.abort();
+
+    aj = $.ajax({
+        url: "/q",
+        type: "post",
+        data: {
+            query: query,
+            limit: limit,
+            offset: offset
+        },
+        cache: false,
+        beforeSend: function() {
+             $('.result').html(bl.img);
+        },
+        success: function(msg) {
+
+            aj = null;
+            var res = msg.items,
+                html = '';
+
+            if (res.length > 0) {
+                for (var key in res) {
+                    var link = escapeHtml(res[key].link);
+                    html += bl.s;
+                        html += bl.h2s + escapeHtml(res[key].title) + bl.h2e;
+                        html += bl.l + bl.as + link + bl.ah + link + bl.ae + bl.e;
+                        html += bl.t + highlight(res[key].snippet) + bl.e;
+                        html += bl.ms + link + bl.me;
+                    html += bl.e;
+                }
+                html += pager(msg);
+            } else {
+                html += bl.no;
+            }
+
+            $('.result').fadeOut(150, function() {
+                $(this).html(html).fadeIn(150);
+            });
+        }
+    });
+}
 
 $('.req-wrap span').on('click', function() {
     $('#req_form').submit();
 });
 
 
-$('#req_form').submit(function(e) {
+function hideSuggestions() {
+    $('.suggestions').remove();
+}
 
-    if (aj) aj.abort();
+function showSuggestions(msg) {
+    hideSuggestions();
+    // Drop late answers to text changed meanwhile
+    if (msg.query != $('#req').val() || msg.suggestions.length == 0) return;
+    var html = '<ul class="suggestions">';
+    for (var i = 0; i < msg.suggestions.length; i++) {
+        html += '<li>' + escapeHtml(msg.suggestions[i].text) + '</li>';
+    }
+    $('.req-wrap').append(html + '</ul>');
+}
+
+function suggest() {
+    suggestTimer = null;
+    if (suggestAj) suggestAj.abort();
+    var text = $('#req').val();
+    if (text.length == 0 || text.slice(-1) == ' ') {
+        hideSuggestions();
+        return;
+    }
+    suggestAj = $.get('/suggest', {q: text}, function(msg) {
+        suggestAj = null;
+        showSuggestions(msg);
+    });
+}
+
+function cancelSuggestions() {
+    if (suggestTimer) clearTimeout(suggestTimer);
+    if (suggestAj) suggestAj.abort();
+    suggestTimer = suggestAj = null;
+    hideSuggestions();
+}
+
+$('#req').on('input', function() {
+    if (suggestTimer) clearTimeout(suggestTimer);
+    suggestTimer = setTimeout(suggest, suggestDelay);
+});
+
+$('#req').on('keydown', function(e) {
+    var items = $('.suggestions li'),
+        active = items.index(items.filter('.active'));
+    if (e.which == 27) {
+        cancelSuggestions();
+    } else if ((e.which == 38 || e.which == 40) && items.length) {
+        e.preventDefault();
+        active += e.which == 40 ? 1 : -1;
+        active = (active + items.length) % items.length;
+        items.removeClass('active').eq(active).addClass('active');
+        $(this).val(items.eq(active).text());
+    }
+});
+
+$('#req').on('blur', function() {
+    // Let a click on a suggestion land first
+    setTimeout(cancelSuggestions, 200);
+});
 
+$('.req-wrap').on('mousedown', '.suggestions li', function(e) {
     e.preventDefault();
-    var r = $('#req').val();
-    if (r.length == 0) {
+    $('#req').val($(this).text());
+    $('#req_form').submit();
+});
+
+
+$('#req_form').submit(function(e) {
+
+    e.preventDefault();
+    cancelSuggestions();
+    query = $('#req').val();
+    if (query.length == 0) {
         alert('Please type your request.');
         return;
-    } else {
-        var html = '',
-        bl = {
-            s:   '<div class="res-item">',
-            h2s: '<h2 class="title">',
-            h2e: '</h2>',
-            l:   '<div class="link">',
-            t:   '<div class="summary">',
-            as:  '<a target="_blank" href="',
-            ah:  '">',
-            ae:  '</a>',
-            e:   '</div>',
-            no:  'No result.',
-            img: '<img src="/static/image/ajax-loader.gif" />'
-        };
-
-
-        aj = $.ajax({
-            url: "/q",
-            type: "post",
-            data: {
-                query: r
-            },
-            cache: false,
-            beforeSend: function() {
-                 $('.result').html(bl.img);
-            },
-            success: function(msg) {
-                
-                aj = null;
-                res = msg.items;
-
-                if (res.length > 0) {
-                    for (var key in res) {
-                        html += bl.s;
-                            html += bl.h2s + res[key].title + bl.h2e;
-                            html += bl.l + bl.as + res[key].link + bl.ah + res[key].link + bl.ae + bl.e;
-                            html += bl.t + res[key].summary + bl.e;
-                        html += bl.e;
-                    }
-                } else {
-                    html += bl.no;
-                }
+    }
+    search(0);
+});
 
-                $('.result').fadeOut(150, function() {
-                    $(this).html(html).fadeIn(150);
-                });
-            }
-        });
 
-    }
+$('.result').on('click', '.page', function(e) {
+    e.preventDefault();
+    search(parseInt($(this).data('offset'), 10));
+});
+
 
+// Full page text is loaded only when asked for
+$('.result').on('click', '.more', function(e) {
+    e.preventDefault();
+    var more = $(this);
+    $.get('/doc', {link: more.data('link')}, function(doc) {
+        more.siblings('.summary').text(doc.summary);
+        more.remove();
+    });
 });
 
-});
\ No newline at end of file
+});
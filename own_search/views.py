@@ -1,9 +1,43 @@
 """Own Search web views."""
 
 import asyncio
-from aiohttp.web import json_response
+import time
+
+import aiohttp
+from aiohttp.web import (json_response, HTTPBadRequest, HTTPException,
+                         HTTPNotFound, HTTPServiceUnavailable, Response)
 import aiohttp_jinja2
 
+from indexer.suggest import complete_query
+from indexer.text_index import DOCUMENT_FIELDS
+import metrics
+
+from .cache import normalize_query
+
+REQUESTS = metrics.counter('http_requests_total',
+                           'Handled requests by handler and status.',
+                           ['handler', 'status'])
+REQUEST_SECONDS = metrics.histogram('http_request_seconds',
+                                    'Request handling time by handler.',
+                                    ['handler'])
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+
+def _int_param(params, name, default, minimum=0, maximum=None):
+    """Get non negative integer request parameter."""
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise HTTPBadRequest(text='{} must be an integer'.format(name))
+    if value < minimum:
+        raise HTTPBadRequest(
+            text='{} must be at least {}'.format(name, minimum))
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
 
 @aiohttp_jinja2.template('index.html')
 @asyncio.coroutine
@@ -16,5 +50,108 @@ def index(request):
 def query(request):
     """Query handler."""
     post = yield from request.post()
-    search_results = request.app['text_index'].query(post['query'])
+    if 'query' not in post:
+        raise HTTPBadRequest(text='query is required')
+    limit = _int_param(post, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+    offset = _int_param(post, 'offset', 0)
+    text_index = request.app['text_index']
+    cache = request.app.get('query_cache')
+    shard_client = request.app.get('shard_client')
+    if shard_client is not None:
+        key = (normalize_query(post['query']), limit, offset)
+        try:
+            page = yield from shard_client.query(
+                post['query'], match_count=limit, offset=offset, cache=cache,
+                cache_key=key)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise HTTPServiceUnavailable(text='Search shard is not available')
+        return json_response(page)
+
+    if cache is None:
+        return json_response(text_index.query(
+            post['query'], match_count=limit, offset=offset))
+
+    key = (normalize_query(post['query']), limit, offset)
+    generation = text_index.generation
+    search_results = cache.get(key, generation)
+    if search_results is None:
+        search_results = text_index.query(
+            post['query'], match_count=limit, offset=offset)
+        cache.put(key, generation, search_results)
     return json_response(search_results)
+
+
+@asyncio.coroutine
+def suggest(request):
+    """Complete the last word of a partially typed query."""
+    text = request.GET.get('q', '')
+    limit = _int_param(request.GET, 'limit',
+                       request.app.get('suggest_limit', DEFAULT_LIMIT),
+                       1, MAX_LIMIT)
+    text_index = request.app['text_index']
+    suggestions = [{'text': completion, 'count': count}
+                   for completion, count in complete_query(
+                       text, text_index.suggest, text_index.analyzer, limit)]
+    return json_response({'query': text, 'suggestions': suggestions})
+
+
+@asyncio.coroutine
+def document(request):
+    """Full stored text of one search result."""
+    link = request.GET.get('link')
+    if not link:
+        raise HTTPBadRequest(text='link is required')
+    fields = request.app['text_index'].find_document(link)
+    if fields is None:
+        raise HTTPNotFound(text='Document is not indexed')
+    return json_response({name: fields[name] for name in DOCUMENT_FIELDS})
+
+
+@asyncio.coroutine
+def stats(request):
+    """Crawl and index statistics."""
+    result = {}
+    if 'dedup' in request.app:
+        result['dedup'] = request.app['dedup'].stats()
+    if 'query_cache' in request.app:
+        result['query_cache'] = request.app['query_cache'].stats()
+    return json_response(result)
+
+
+@asyncio.coroutine
+def metrics_middleware(app, handler):
+    """Count requests and time handlers."""
+    name = getattr(handler, '__name__', 'other')
+
+    @asyncio.coroutine
+    def middleware(request):
+        start = time.monotonic()
+        status = 500
+        try:
+            response = yield from handler(request)
+            status = response.status
+            return response
+        except HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            REQUESTS.inc(handler=name, status=status)
+            REQUEST_SECONDS.observe(time.monotonic() - start, handler=name)
+    return middleware
+
+
+@asyncio.coroutine
+def metrics_view(request):
+    """Metrics in Prometheus text format."""
+    return Response(body=metrics.render().encode('utf-8'),
+                    headers={'Content-Type': 'text/plain; version=0.0.4; '
+                                             'charset=utf-8'})
+
+
+@asyncio.coroutine
+def profile(request):
+    """Serve sampled stacks in folded format, 404 if profiler is off."""
+    profiler = request.app.get('profiler')
+    if profiler is None:
+        raise HTTPNotFound(text='Profiler is not enabled')
+    return Response(text=profiler.folded())
@@ -0,0 +1,42 @@
+from indexer import TextIndex
+from indexer.analysis import Analyzer, light_stem, make_analyzer, tokenize
+
+
+def test_tokenize_whitespace_and_case():
+    """Any whitespace splits tokens, punctuation is dropped."""
+    assert tokenize('Hello,  World!\n\tNew-line') == \
+        ['hello', 'world', 'new', 'line']
+    assert tokenize('  ') == []
+
+
+def test_tokenize_unicode():
+    """Non-ASCII text is case folded and split on Unicode punctuation."""
+    assert tokenize('Byzantine–Ottoman «Wars» STRASSE Straße') == \
+        ['byzantine', 'ottoman', 'wars', 'strasse', 'strasse']
+
+
+def test_light_stem():
+    assert [light_stem(w) for w in
+            ('wars', 'stories', 'classes', 'running', 'indexed', 'bus',
+             'is')] == \
+        ['war', 'story', 'class', 'runn', 'index', 'bus', 'is']
+
+
+def test_analyzer_stopwords():
+    analyzer = make_analyzer('english', stem=True)
+    assert analyzer('The wars in Europe') == ['war', 'europe']
+    assert Analyzer(['x'])('x y') == ['y']
+
+
+def test_index_and_query_share_analyzer(tmpdir):
+    """Query terms are analyzed like indexed ones."""
+    index = TextIndex(str(tmpdir / 'text_index'),
+                      analyzer=make_analyzer('english', stem=True))
+    index.index_document('http://example.com/1', 'Ottoman War',
+                         'A war in Europe')
+    try:
+        items = index.query('the WARS')['items']
+        assert [item['link'] for item in items] == ['http://example.com/1']
+        assert index.query('the')['items'] == []
+    finally:
+        index.close()
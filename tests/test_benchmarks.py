@@ -0,0 +1,46 @@
+import urllib.request
+
+from benchmarks.report import compare, percentile
+from benchmarks.site import (SiteServer, generate_documents, generate_site,
+                             page_path)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3], 95) == 3
+
+
+def test_compare_threshold():
+    """Slower throughput or latency beyond threshold is a regression."""
+    baseline = {'params': {'pages': 10},
+                'index': {'docs_per_sec': 100, 'docs_count': 10},
+                'query': {'http': {'p50_ms': 10.0}}}
+    results = {'params': {'pages': 20},
+               'index': {'docs_per_sec': 95, 'docs_count': 20},
+               'query': {'http': {'p50_ms': 12.0}}}
+    assert compare(results, baseline, 0.1) == [
+        ('query.http.p50_ms', 10.0, 12.0)]
+    assert compare(results, baseline, 0.3) == []
+
+
+def test_generate_documents():
+    """Generation is reproducible and duplicates repeat earlier pages."""
+    documents = generate_documents(50, page_size=400, duplicate_rate=0.5)
+    assert documents == generate_documents(50, page_size=400,
+                                           duplicate_rate=0.5)
+    assert len(set(documents)) < 50
+    assert len(generate_documents(50, duplicate_rate=0)) == 50
+
+
+def test_site_server(tmpdir):
+    """Generated site is served over HTTP."""
+    generate_site(str(tmpdir), 5, fanout=2)
+    server = SiteServer(str(tmpdir), port=8092)
+    server.start()
+    try:
+        page = urllib.request.urlopen(server.url).read().decode('utf-8')
+    finally:
+        server.shutdown()
+    assert page_path(1) in page
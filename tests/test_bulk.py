@@ -0,0 +1,144 @@
+import os
+
+import pytest
+
+from indexer import TextIndex
+from indexer.bulk import build_index
+from indexer.segment import (MemorySegment, SegmentReader, concat_segments,
+                             write_segment)
+from indexer.sharding import ShardedIndex
+from indexer.stream import StreamReader, StreamWriter, read_stream
+
+DOCUMENTS = [
+    ('Ottoman wars', 'The Ottoman wars in Europe were a series of wars'),
+    ('Robyn Love', 'Robyn Love was born in Scotland'),
+    ('Sony Alpha', 'The Sony Alpha camera is sold in Europe'),
+    ('Balkan wars', 'Two wars in the Balkans, one of many Europe wars'),
+    ('Camera review', 'A camera review: the Alpha camera and its lens'),
+    ('Scotland', 'Scotland is a country in Europe'),
+    ('Alpha Centauri', 'Alpha Centauri is the closest star system'),
+    ('Wars of Scotland', 'Scotland fought wars of independence'),
+]
+QUERIES = ['wars', 'europe wars', 'alpha camera', 'scotland', '"alpha camera"']
+
+
+def records():
+    return [{'url': 'http://example.com/{}'.format(i), 'title': title,
+             'text': text, 'crawled': 1000.0 + i}
+            for i, (title, text) in enumerate(DOCUMENTS)]
+
+
+def write_stream(filename, items, chunk_size=3):
+    writer = StreamWriter(filename, chunk_size=chunk_size)
+    for record in items:
+        record = dict(record)
+        writer.write(record.pop('url'), record.pop('title'),
+                     record.pop('text'), **record)
+    writer.close()
+
+
+def test_stream_round_trip(tmpdir):
+    """Records are read back in order across chunks."""
+    filename = str(tmpdir / 'crawl.jsonl.gz')
+    write_stream(filename, records())
+    assert list(read_stream(filename)) == records()
+
+
+def test_stream_truncated_chunk(tmpdir):
+    """A truncated chunk is skipped and overwritten by the next writer."""
+    filename = str(tmpdir / 'crawl.jsonl.gz')
+    write_stream(filename, records()[:6])
+    size = os.path.getsize(filename)
+    write_stream(filename, records()[6:])
+    with open(filename, 'r+b') as f:
+        f.truncate(size + 10)
+    assert list(read_stream(filename)) == records()[:6]
+    write_stream(filename, records()[6:])
+    assert list(read_stream(filename)) == records()
+
+
+def test_concat_segments(tmpdir):
+    """Concatenated segments read as one with renumbered documents."""
+    path = str(tmpdir)
+    readers = []
+    for number, documents in enumerate(
+            [[('a', {'one': 1, 'two': 2})], [('c', {'two': 1}),
+                                             ('b', {'three': 3})]]):
+        segment = MemorySegment()
+        for link, terms in documents:
+            segment.add({'link': link}, terms,
+                        {term: list(range(tf)) for term, tf in terms.items()})
+        name = 'run_{}'.format(number)
+        write_segment(path, name, segment)
+        readers.append(SegmentReader(path, name, segment.doc_count,
+                                     segment.total_length))
+    concat_segments(path, 'all', readers)
+    merged = SegmentReader(path, 'all', 3, 7)
+    assert list(merged.terms()) == ['one', 'three', 'two']
+    assert list(merged.postings('two')) == [(0, 2), (1, 1)]
+    assert list(merged.positions('two', {1})) == [(1, [0])]
+    assert merged.postings_blocks('two')[0] == [(0, [(2, 3)]),
+                                                (1, [(1, 1)])]
+    assert merged.document(2) == {'link': 'b'}
+    assert merged.doc_length(2) == 3
+    assert merged.find('c') == 1
+    for reader in readers + [merged]:
+        reader.close()
+
+
+@pytest.mark.parametrize('batch_size,workers', [(3, 0), (100, 0), (3, 2)])
+def test_build_index(tmpdir, batch_size, workers):
+    """Bulk built index answers queries as an incrementally built one."""
+    expected = TextIndex(str(tmpdir / 'incremental'))
+    for record in records():
+        expected.index_document(record['url'], record['title'],
+                                record['text'])
+    built = str(tmpdir / 'built')
+    assert build_index(records(), built, batch_size=batch_size,
+                       workers=workers) == len(DOCUMENTS)
+    assert not [name for name in os.listdir(built)
+                if name.startswith('run_')]
+    text_index = TextIndex(built)
+    assert len(text_index.segments) == 1
+    for query_text in QUERIES:
+        assert text_index.query(query_text, match_count=10) == \
+            expected.query(query_text, match_count=10)
+    fields = text_index.find_document('http://example.com/1')
+    assert fields['title'] == 'Robyn Love'
+    assert fields['indexed'] == fields['first_seen'] == 1001.0
+    text_index.close()
+    expected.close()
+
+
+def test_build_index_replaces_links(tmpdir):
+    """The last version of a link in the stream is indexed."""
+    items = records()
+    items.append(dict(items[0], title='Ottoman history', text='Updated'))
+    filename = str(tmpdir / 'crawl.jsonl.gz')
+    write_stream(filename, items)
+    build_index(StreamReader(filename), str(tmpdir / 'index'), batch_size=3)
+    text_index = TextIndex(str(tmpdir / 'index'))
+    assert text_index.segments[0].doc_count == len(DOCUMENTS)
+    assert text_index.find_document(
+        'http://example.com/0')['title'] == 'Ottoman history'
+    assert text_index.query('updated')['total'] == 1
+    assert text_index.query('ottoman')['total'] == 1
+    text_index.close()
+
+
+def test_build_sharded_index(tmpdir):
+    """Documents are built into the shards ShardedIndex routes them to."""
+    build_index(records(), str(tmpdir), shards=3, batch_size=2)
+    sharded = ShardedIndex(str(tmpdir), 3)
+    for record in records():
+        assert sharded.shard(record['url']).find_document(
+            record['url'])['title'] == record['title']
+    assert sharded.query('wars', match_count=10)['total'] == 3
+    sharded.close()
+
+
+def test_build_index_not_empty(tmpdir):
+    """Existing indexes are not overwritten."""
+    TextIndex(str(tmpdir)).close()
+    with pytest.raises(ValueError):
+        build_index(records(), str(tmpdir))
@@ -0,0 +1,30 @@
+from own_search.cache import QueryCache, normalize_query
+
+
+def test_normalize_query():
+    assert normalize_query('  Ottoman\tWARS ') == 'ottoman wars'
+
+
+def test_query_cache_generation():
+    """Entries of another index generation are misses."""
+    cache = QueryCache()
+    cache.put('wars', 1, {'items': []})
+    assert cache.get('wars', 1) == {'items': []}
+    assert cache.get('wars', 2) is None
+    assert cache.get('wars', 1) is None
+    assert cache.stats() == {'entries': 0, 'hits': 1, 'misses': 2,
+                             'hit_ratio': 1 / 3}
+
+
+def test_query_cache_lru_and_ttl():
+    """Least recently used entries are evicted, expired ones missed."""
+    cache = QueryCache(max_entries=2)
+    cache.put('a', 1, 'A')
+    cache.put('b', 1, 'B')
+    cache.get('a', 1)
+    cache.put('c', 1, 'C')
+    assert list(cache.entries) == ['a', 'c']
+
+    cache = QueryCache(ttl=0)
+    cache.put('a', 1, 'A')
+    assert cache.get('a', 1) is None
@@ -1,12 +1,17 @@
 import asyncio
 import json
 import http.server
+import signal
 import socketserver
 from threading import Thread
 
 import pytest
 
+from crawler.__main__ import make_consumer, on_signals
 from crawler.web_crawler import DataLinksHTMLParser, WebCrawler, InvalidURL
+from crawler.web_crawler import NotModified, parse_page, recrawl_priority
+from indexer.stream import StreamWriter, read_stream
+from indexer.text_index import document_terms
 
 
 class StaticServer(Thread):
@@ -40,6 +45,56 @@ def sserver(request):
     return ss
 
 
+class ConditionalHandler(http.server.BaseHTTPRequestHandler):
+    """Serve example page with validators, 304 when they match."""
+    ETAG = '"example"'
+    LAST_MODIFIED = 'Sat, 01 Jan 2000 00:00:00 GMT'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.ETAG or \
+                self.headers.get('If-Modified-Since') == self.LAST_MODIFIED:
+            self.send_response(304)
+            self.end_headers()
+            return
+        with open('tests/example.html', 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self.ETAG)
+        self.send_header('Last-Modified', self.LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ConditionalServer(Thread):
+    """Conditional handler on a free port, bound before the thread runs."""
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.httpd = socketserver.TCPServer(('127.0.0.1', 0),
+                                            ConditionalHandler)
+        self.port = self.httpd.server_address[1]
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture(scope="module")
+def cserver(request):
+    cs = ConditionalServer()
+    request.addfinalizer(cs.shutdown)
+    cs.start()
+    return cs
+
+
 @pytest.yield_fixture
 def loop():
     """Setup loop."""
@@ -78,6 +133,14 @@ def test_HTML_parser():
     assert set(external_links) == parser.external_links
 
 
+def test_HTML_parser_max_text():
+    """Text beyond the limit is dropped, links are still collected."""
+    parser = DataLinksHTMLParser('http://itsvit.com/', max_text=10)
+    parser.feed('<p>Hello world</p><p>More text</p><a href="/next">x</a>')
+    assert parser.data == ['Hello worl']
+    assert parser.internal_links == {'http://itsvit.com/next'}
+
+
 def test_parse_url(loop, sserver):
     """Test end to end crawling."""
     exp_internal = {
@@ -149,6 +212,7 @@ def test_parse_url(loop, sserver):
         assert ignore_new_line(data) == ignore_new_line(exp_data)
         assert internal == exp_internal
         assert external == exp_external
+        wc.close()
 
     loop.run_until_complete(do_test())
 
@@ -158,10 +222,240 @@ def test_parse_url_css(loop, sserver):
 
     @asyncio.coroutine
     def do_test():
+        wc = WebCrawler(loop=loop)
         with pytest.raises(InvalidURL):
-            wc = WebCrawler(loop=loop)
             title, data, internal, external = yield from wc._parse_url(
                     'http://127.0.0.1:{}/tests/owl.carousel.css'.format(
                             StaticServer.PORT))
+        wc.close()
+
+    loop.run_until_complete(do_test())
+
+
+def test_session_reused(loop, sserver):
+    """All pages are fetched through one pooled session."""
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop, connections_per_host=2)
+        session = wc.session
+        url = 'http://127.0.0.1:{}/tests/example.html'.format(
+            StaticServer.PORT)
+        yield from wc._parse_url(url)
+        yield from wc._parse_url(url)
+        assert wc.session is session
+        assert not session.closed
+        wc.close()
+        assert session.closed
+
+    loop.run_until_complete(do_test())
+
+
+def test_parse_url_body_limit(loop, sserver):
+    """Oversized pages are truncated or rejected."""
+    url = 'http://127.0.0.1:{}/tests/example.html'.format(StaticServer.PORT)
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop, chunk_size=1024, max_body_size=4096)
+        title, data, internal, external = yield from wc._parse_url(url)
+        assert title == 'IT Svit | Our Portfolio'
+        assert data.startswith('About us')
+        with open('tests/example.data', 'r') as f:
+            assert len(data) < len(' '.join(json.load(f)))
+        wc.close()
+
+        wc = WebCrawler(loop=loop, max_body_size=4096, truncate_body=False)
+        with pytest.raises(InvalidURL):
+            yield from wc._parse_url(url)
+        wc.close()
+
+    loop.run_until_complete(do_test())
+
+
+def test_parse_page():
+    """Whole page parsing used by parser processes."""
+    with open('tests/example.html', 'rb') as f:
+        body = f.read()
+    title, data, internal, external, terms = parse_page(
+        body, 'http://itsvit.com/portfolio/', 'utf-8',
+        tokenizer=document_terms)
+    assert title == 'IT Svit | Our Portfolio'
+    assert 'http://itsvit.com/blog/' in internal
+    assert terms == document_terms(title, data)
+
+
+def test_fetch_in_parser_pool(loop, sserver):
+    """Pages parsed in worker processes match event loop parsing."""
+    url = 'http://127.0.0.1:{}/tests/example.html'.format(StaticServer.PORT)
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop)
+        expected = yield from wc._fetch(url)
+        wc.close()
+
+        wc = WebCrawler(loop=loop, parse_workers=2,
+                        tokenizer=document_terms)
+        title, data, internal, external, extra = yield from wc._fetch(url)
+        wc.close()
+        assert (title, data, internal, external) == expected[:4]
+        assert extra['terms'] == document_terms(title, data)
+
+    loop.run_until_complete(do_test())
+
+
+def test_crawl_through_scheduler(loop, sserver):
+    """Worker takes URLs from host scheduler and reports the page."""
+    origin = 'http://127.0.0.1:{}'.format(StaticServer.PORT)
+    url = origin + '/tests/example.html'
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop, workers=1)
+        # No robots.txt on the static server
+        robots = yield from wc._fetch_robots(origin)
+        assert robots is None
+
+        wc.add_urls([url])
+        wc.create_workers()
+        page_url, title, text, extra = yield from wc.text_queue.get()
+        assert page_url == url
+        assert title == 'IT Svit | Our Portfolio'
+        host = wc.scheduler.hosts[origin]
+        assert host.robots_ready and host.robots is None
+        wc.close()
+
+    loop.run_until_complete(do_test())
+
+
+def test_robots_unavailable(loop):
+    """Hosts whose robots.txt times out or fails are crawled without it."""
+
+    @asyncio.coroutine
+    def timeout(*args, **kwargs):
+        raise asyncio.TimeoutError()
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop)
+        # Nothing listens on port 1
+        assert (yield from wc._fetch_robots('http://127.0.0.1:1')) is None
+        wc.session.get = timeout
+        origin = 'http://127.0.0.1:{}'.format(StaticServer.PORT)
+        assert (yield from wc._fetch_robots(origin)) is None
+        wc.scheduler.put(origin + '/tests/example.html')
+        host = wc.scheduler.hosts[origin]
+        yield from asyncio.sleep(0, loop=loop)
+        assert host.robots_ready and host.robots is None
+        wc.close()
+
+    loop.run_until_complete(do_test())
+
+
+def test_conditional_fetch(loop, cserver):
+    """Unchanged page is not downloaded again."""
+    url = 'http://127.0.0.1:{}/example.html'.format(cserver.port)
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop)
+        *_, extra = yield from wc._fetch(url)
+        wc.close()
+        assert extra['etag'] == ConditionalHandler.ETAG
+        assert extra['last_modified'] == ConditionalHandler.LAST_MODIFIED
+
+        for validator in ('etag', 'last_modified'):
+            indexed = {'link': url, validator: extra[validator]}
+            wc = WebCrawler(loop=loop, validators={url: indexed}.get)
+            with pytest.raises(NotModified):
+                yield from wc._fetch(url)
+            wc.close()
+
+    loop.run_until_complete(do_test())
+
+
+def test_recrawl_order(loop):
+    """Frequently changing pages are re-crawled first."""
+    now = 10 * 86400
+    stable = {'link': 'stable', 'first_seen': 0, 'changes': 0}
+    changing = {'link': 'changing', 'first_seen': 0, 'changes': 5}
+    assert recrawl_priority(changing, now) > recrawl_priority(stable, now)
+
+    wc = WebCrawler(loop=loop)
+    wc.recrawl([stable, changing])
+    got = [loop.run_until_complete(wc.frontier.get()) for _ in range(2)]
+    wc.close()
+    assert got == ['changing', 'stable']
+
+
+def test_crawl_completion(loop, sserver):
+    """Join returns when the only allowed page is crawled and consumed."""
+    url = 'http://127.0.0.1:{}/tests/example.html'.format(StaticServer.PORT)
+    consumed = []
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop, workers=2, ignore_external=False,
+                        max_pages=1, max_pending_pages=1)
+        wc.register_consumer(lambda link, *args, **kwargs:
+                             consumed.append(link))
+        wc.add_urls([url, url + '?other'])
+        wc.create_workers()
+        yield from asyncio.wait_for(wc.join(), 10, loop=loop)
+        yield from wc.shutdown()
+
+    loop.run_until_complete(do_test())
+    assert consumed == [url]
+
+
+def test_max_depth(loop):
+    """Links of pages at max depth are not followed."""
+    wc = WebCrawler(loop=loop, max_depth=1)
+    wc.add_urls(['http://example.com/'])
+    wc.add_urls(['http://example.com/a'], depth=1)
+    first = loop.run_until_complete(wc.frontier.get())
+    second = loop.run_until_complete(wc.frontier.get())
+    assert wc.frontier.depth(first) == 0
+    assert wc.frontier.depth(second) == 1
+    wc.close()
+
+
+def test_crawl_to_stream(loop, sserver, tmpdir):
+    """Headless crawl writes crawled pages to a document stream."""
+    url = 'http://127.0.0.1:{}/tests/example.html'.format(StaticServer.PORT)
+    filename = str(tmpdir / 'crawl.jsonl.gz')
+    writer = StreamWriter(filename)
+
+    @asyncio.coroutine
+    def do_test():
+        wc = WebCrawler(loop=loop, workers=2, max_pages=1)
+        wc.register_consumer(make_consumer(writer))
+        wc.add_urls([url])
+        wc.create_workers()
+        yield from asyncio.wait_for(wc.join(), 10, loop=loop)
+        yield from wc.shutdown()
 
     loop.run_until_complete(do_test())
+    writer.close()
+    records = list(read_stream(filename))
+    assert [record['url'] for record in records] == [url]
+    assert records[0]['text']
+
+
+def test_signals_without_loop_handlers(loop, monkeypatch):
+    """Loops without signal handlers get callback from signal.signal."""
+    def not_implemented(signum, callback):
+        raise NotImplementedError
+
+    installed = {}
+    monkeypatch.setattr(loop, 'add_signal_handler', not_implemented)
+    monkeypatch.setattr(signal, 'signal',
+                        lambda signum, handler: installed.update(
+                            {signum: handler}))
+    called = []
+    on_signals(loop, lambda: called.append(True))
+    assert set(installed) == {signal.SIGINT, signal.SIGTERM}
+    installed[signal.SIGTERM](signal.SIGTERM, None)
+    loop.run_until_complete(asyncio.sleep(0, loop=loop))
+    assert called == [True]
@@ -0,0 +1,91 @@
+from indexer import TextIndex
+from indexer.dedup import (DuplicateFilter, SimHashIndex, hamming_distance,
+                           simhash)
+from indexer.text_index import document_terms
+
+TEXT = ('Our portfolio of cloud infrastructure projects: migration of web '
+        'services to containers, continuous delivery pipelines, monitoring '
+        'and logging for high load applications, automated scaling and '
+        'disaster recovery for customers in retail, media and finance. '
+        'We design secure networks, review code, train engineering teams, '
+        'build data platforms and analytics dashboards, tune databases, and '
+        'support production systems around the clock with clear service '
+        'level agreements and transparent reporting for every project')
+
+
+def test_simhash_similarity():
+    """Small edits move few bits, different texts move many."""
+    base = simhash(TEXT.split())
+    edited = simhash((TEXT + ' Print').split())
+    other = simhash('Contact us by phone or email for a quote'.split())
+    assert hamming_distance(base, edited) <= 3
+    assert hamming_distance(base, other) > 3
+
+
+def test_simhash_index():
+    """Fingerprints within distance are found through band tables."""
+    index = SimHashIndex(max_distance=3)
+    index.add('a', 0)
+    index.add('b', (1 << 64) - 1)
+    assert index.find(0b1011) == 'a'
+    assert index.find(0b11111) is None
+    assert index.find(0, exclude='a') is None
+    index.remove('a')
+    assert index.find(0) is None
+    assert len(index) == 1
+
+
+def test_duplicate_filter():
+    """Copies under other links are dropped, re-crawls pass through."""
+    indexed = []
+
+    def consumer(link, title, summary, terms=None, simhash=None):
+        indexed.append(link)
+
+    dedup = DuplicateFilter(consumer)
+    dedup('http://example.com/', 'Portfolio', TEXT)
+    dedup('http://example.com/?print=1', 'Portfolio', TEXT)
+    dedup('http://example.com/', 'Portfolio', TEXT + ' again')
+    dedup('http://example.com/contact', 'Contact', 'Phone and email')
+    assert indexed == ['http://example.com/', 'http://example.com/',
+                       'http://example.com/contact']
+    assert dedup.duplicates == {
+        'http://example.com/?print=1': 'http://example.com/'}
+    assert dedup.stats() == {'unique': 2, 'duplicates': 1,
+                             'dedup_ratio': 1 / 3}
+
+
+def test_duplicates_bounded():
+    """Only the last duplicate links are kept, all are counted."""
+    dedup = DuplicateFilter(lambda *args, **kwargs: True, max_duplicates=2)
+    dedup('http://example.com/', 'Portfolio', TEXT)
+    for i in range(5):
+        dedup('http://example.com/?page={}'.format(i), 'Portfolio', TEXT)
+    assert list(dedup.duplicates) == ['http://example.com/?page=3',
+                                      'http://example.com/?page=4']
+    assert dedup.stats()['duplicates'] == 5
+
+
+def test_load_stored_fingerprints(tmpdir):
+    """Fingerprints stored with indexed pages are loaded as they are."""
+    text_index = TextIndex(str(tmpdir))
+    DuplicateFilter(text_index.index_document)(
+        'http://example.com/', 'Portfolio', TEXT)
+    text_index.index_document('http://example.com/contact', 'Contact',
+                              'Phone and email')
+    text_index.dump()
+    tokenized = []
+
+    def tokenizer(title, summary):
+        tokenized.append(title)
+        return document_terms(title, summary)
+
+    dedup = DuplicateFilter(None, tokenizer=tokenizer)
+    dedup.load(text_index.iter_documents())
+    # Documents indexed without a fingerprint are tokenized
+    assert tokenized == ['Contact']
+    assert len(dedup.index) == 2
+    assert dedup('http://example.com/?print=1', 'Portfolio', TEXT) is False
+    assert dedup.duplicates == {
+        'http://example.com/?print=1': 'http://example.com/'}
+    text_index.close()
@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from crawler.frontier import BloomFilter, DiskFrontier, MemoryFrontier
+
+
+@pytest.yield_fixture
+def loop():
+    """Setup loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+
+    # Clean-up
+    loop.close()
+
+
+def test_bloom_filter():
+    """No false negatives, false positives close to the error rate."""
+    bloom = BloomFilter(10000, error_rate=0.01)
+    for i in range(10000):
+        bloom.add('http://example.com/{}'.format(i))
+    assert all('http://example.com/{}'.format(i) in bloom
+               for i in range(10000))
+    assert not bloom.add('http://example.com/1')
+
+    false_positives = sum('http://other.com/{}'.format(i) in bloom
+                          for i in range(10000))
+    assert false_positives < 300
+
+
+def test_bloom_filter_serialization():
+    """Filter survives round trip."""
+    bloom = BloomFilter(1000)
+    bloom.add('http://example.com/')
+    restored = BloomFilter.from_bytes(bloom.to_bytes(), 1000, 0.001)
+    assert 'http://example.com/' in restored
+    assert restored.count == 1
+
+
+def test_memory_frontier(loop):
+    """URLs are deduplicated and returned in FIFO order."""
+    frontier = MemoryFrontier(loop=loop)
+    assert frontier.add(['a', 'b', 'a']) == ['a', 'b']
+    assert frontier.add(['b', 'c']) == ['c']
+    got = [loop.run_until_complete(frontier.get()) for _ in range(3)]
+    assert got == ['a', 'b', 'c']
+
+
+def test_disk_frontier_spill(loop, tmpdir):
+    """URLs beyond memory size are spilled and read back in order."""
+    frontier = DiskFrontier(str(tmpdir / 'frontier.sqlite'), capacity=1000,
+                            memory_size=2, loop=loop)
+    urls = ['http://example.com/{}'.format(i) for i in range(5)]
+    frontier.add(urls)
+    assert len(frontier.memory) == 2
+    assert frontier.qsize() == 5
+
+    got = [loop.run_until_complete(frontier.get()) for _ in range(5)]
+    assert got == urls
+    frontier.close()
+
+
+def test_disk_frontier_resume(loop, tmpdir):
+    """Restarted frontier continues from the last checkpoint."""
+    path = str(tmpdir / 'frontier.sqlite')
+    frontier = DiskFrontier(path, capacity=1000, memory_size=2, loop=loop)
+    frontier.add(['a', 'b', 'c', 'd'])
+    done = loop.run_until_complete(frontier.get())
+    frontier.task_done(done)
+    in_progress = loop.run_until_complete(frontier.get())
+    frontier.checkpoint()
+    frontier.add(['e'])
+    # Crash: the last add is not committed
+    frontier.db.close()
+
+    frontier = DiskFrontier(path, capacity=1000, memory_size=2, loop=loop)
+    assert frontier.add(['a', 'b', 'e']) == ['e']
+    got = [loop.run_until_complete(frontier.get()) for _ in range(4)]
+    assert got == [in_progress, 'c', 'd', 'e']
+    frontier.close()
+
+
+def test_disk_frontier_depths(loop, tmpdir):
+    """Depths of spilled and checkpointed URLs are kept."""
+    path = str(tmpdir / 'frontier.sqlite')
+    frontier = DiskFrontier(path, capacity=1000, memory_size=1, loop=loop)
+    frontier.add(['a'])
+    frontier.add(['b', 'c'], depth=2)
+    in_progress = loop.run_until_complete(frontier.get())
+    frontier.checkpoint()
+    frontier.db.close()
+
+    frontier = DiskFrontier(path, capacity=1000, memory_size=1, loop=loop)
+    depths = {}
+    for _ in range(3):
+        url = loop.run_until_complete(frontier.get())
+        depths[url] = frontier.depth(url)
+        frontier.task_done(url)
+    assert in_progress == 'a'
+    assert depths == {'a': 0, 'b': 2, 'c': 2}
+    frontier.close()
+
+
+def test_memory_frontier_limit_and_join(loop):
+    """Full frontier drops URLs, join waits for processed URLs."""
+    frontier = MemoryFrontier(loop=loop, max_size=2)
+    assert frontier.add(['a', 'b', 'c']) == ['a', 'b']
+    for _ in range(2):
+        frontier.task_done(loop.run_until_complete(frontier.get()))
+    loop.run_until_complete(asyncio.wait_for(frontier.join(), 1, loop=loop))
+    assert frontier.add(['c']) == ['c']
+
+
+def test_memory_frontier_counts_dropped(loop, caplog):
+    """URLs dropped by a full frontier are counted and logged once."""
+    frontier = MemoryFrontier(loop=loop, max_size=2)
+    assert frontier.add(['a', 'b', 'c', 'd']) == ['a', 'b']
+    frontier.requeue(['a'])
+    assert frontier.dropped == 3
+    assert frontier.qsize() == 2
+    warnings = [r for r in caplog.records if r.levelname == 'WARNING']
+    assert len(warnings) == 1
+    assert 'full' in warnings[0].getMessage()
+
+    frontier.task_done(loop.run_until_complete(frontier.get()))
+    assert frontier.add(['c', 'd']) == ['c']
+    assert frontier.dropped == 4
+    warnings = [r for r in caplog.records if r.levelname == 'WARNING']
+    assert len(warnings) == 2
+
+
+def test_disk_frontier_join(loop, tmpdir):
+    """Join returns once every URL got from the frontier is done."""
+    frontier = DiskFrontier(str(tmpdir / 'frontier.sqlite'), capacity=1000,
+                            memory_size=1, loop=loop)
+    frontier.add(['a', 'b'])
+    join = loop.create_task(frontier.join())
+    urls = [loop.run_until_complete(frontier.get()) for _ in range(2)]
+    frontier.task_done(urls[0])
+    loop.run_until_complete(asyncio.sleep(0, loop=loop))
+    assert not join.done()
+    frontier.task_done(urls[1])
+    loop.run_until_complete(asyncio.wait_for(join, 1, loop=loop))
+    frontier.close()
@@ -0,0 +1,123 @@
+import random
+
+from indexer import TextIndex, fuzzy
+from indexer.fuzzy import FuzzyIndex, edit_distance, max_edits, trigrams
+from indexer.sharding import ShardedIndex
+
+DOCUMENTS = [
+    ('Scotland', 'Scotland is a country in Europe'),
+    ('Scottish wars', 'Scotland fought wars of independence'),
+    ('Sony Alpha', 'The Sony Alpha camera is sold in Europe'),
+    ('Camera review', 'A camera review: the Alpha camera and its lens'),
+    ('Cameras', 'Old cameras and a camel'),
+]
+
+
+def test_edit_distance():
+    """Levenshtein distance is cut off above limit."""
+    assert edit_distance('camera', 'camera', 2) == 0
+    assert edit_distance('camera', 'camra', 2) == 1
+    assert edit_distance('camera', 'cmaera', 2) == 2
+    assert edit_distance('camera', 'came', 2) == 2
+    assert edit_distance('camera', 'camel', 1) == 2
+    assert edit_distance('camera', 'europe', 2) == 3
+
+
+def test_similar_matches_brute_force(monkeypatch):
+    """Trigram filter drops no term within the distance."""
+    monkeypatch.setattr(fuzzy, 'MAX_CANDIDATES', 2000)
+    rng = random.Random(0)
+    fuzzy_index = FuzzyIndex()
+    terms = {''.join(rng.choice('abcd') for _ in range(rng.randint(1, 8)))
+             for _ in range(2000)}
+    fuzzy_index.update((term, 1) for term in terms)
+    assert len(fuzzy_index) == len(terms)
+    for query in ('abcab', 'dddd', 'abcdabcd', 'cab', 'ab'):
+        limit = max_edits(query)
+        expected = sorted(
+            (term, edit_distance(query, term, limit)) for term in terms
+            if term != query and edit_distance(query, term, limit) <= limit)
+        assert sorted(fuzzy_index.similar(query)) == expected
+        # Terms sharing no trigram are never candidates
+        assert sorted(fuzzy_index.similar(query, 3)) == sorted(
+            (term, edit_distance(query, term, 3)) for term in terms
+            if term != query and edit_distance(query, term, 3) <= 3 and
+            trigrams(query) & trigrams(term))
+
+
+def test_similar_repeated_letters(monkeypatch):
+    """Few distinct trigrams do not make every term a candidate."""
+    monkeypatch.setattr(fuzzy, 'MAX_CANDIDATES', 5)
+    fuzzy_index = FuzzyIndex()
+    fuzzy_index.update(('aaaaa' + c * i, 1)
+                       for c in 'bcdefghij' for i in range(1, 3))
+    fuzzy_index.add('xyz')
+    compared = []
+    distance = fuzzy.edit_distance
+
+    def counting(first, second, limit):
+        compared.append(second)
+        return distance(first, second, limit)
+
+    monkeypatch.setattr(fuzzy, 'edit_distance', counting)
+    found = fuzzy_index.similar('aaaaaa')
+    assert len(compared) == 5
+    assert 'xyz' not in compared
+    assert found and all(d <= 2 for _, d in found)
+
+
+def make_index(path, **kwargs):
+    text_index = TextIndex(path, **kwargs)
+    for i, (title, summary) in enumerate(DOCUMENTS):
+        text_index.index_document('http://example.com/{}'.format(i),
+                                  title, summary)
+    return text_index
+
+
+def links(page):
+    return [item['link'] for item in page['items']]
+
+
+def test_fuzzy_query(tmpdir):
+    """Misspelled terms match similar index terms."""
+    text_index = make_index(str(tmpdir), fuzzy=10)
+    page = text_index.query('scotlnd', match_count=10)
+    assert sorted(links(page)) == ['http://example.com/0',
+                                   'http://example.com/1']
+    assert page['items'][0]['snippet']['highlights']
+    # Same results after segments are flushed and loaded again
+    text_index.dump()
+    text_index.load()
+    assert text_index.query('scotlnd', match_count=10) == page
+    text_index.close()
+
+    plain = make_index(str(tmpdir / 'plain'))
+    assert plain.query('scotlnd')['items'] == []
+    plain.close()
+
+
+def test_fuzzy_below_exact(tmpdir):
+    """Fuzzy matches score lower than exact ones, expansions are capped."""
+    text_index = make_index(str(tmpdir), fuzzy=1)
+    exact = text_index.query('camera', match_count=10, scores=True)
+    fuzzy = text_index.query('camerx', match_count=10, scores=True)
+    assert links(fuzzy) == links(exact)
+    for a, b in zip(exact['items'], fuzzy['items']):
+        assert b['score'] < a['score']
+    # The only expansion is camera, cameras is in fewer documents
+    assert 'http://example.com/4' not in links(fuzzy)
+    text_index.close()
+
+
+def test_sharded_fuzzy(tmpdir):
+    """Expansions of all shards are merged."""
+    single = make_index(str(tmpdir / 'single'), fuzzy=10)
+    sharded = ShardedIndex(str(tmpdir / 'sharded'), 3, fuzzy=10)
+    for i, (title, summary) in enumerate(DOCUMENTS):
+        sharded.index_document('http://example.com/{}'.format(i),
+                               title, summary)
+    for query_text in ('scotlnd', 'camra wars', 'cameraz'):
+        assert sharded.query(query_text, match_count=10) == \
+            single.query(query_text, match_count=10)
+    single.close()
+    sharded.close()
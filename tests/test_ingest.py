@@ -0,0 +1,35 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from indexer import TextIndex
+from own_search.ingest import Ingester
+
+
+def test_ingester_batches(loop, tmpdir):
+    """Queued pages are indexed in batches by the writer thread."""
+    text_index = TextIndex(str(tmpdir))
+    executor = ThreadPoolExecutor(1)
+    batches = []
+    index_documents = text_index.index_documents
+
+    def record(documents):
+        batches.append(len(documents))
+        return index_documents(documents)
+
+    text_index.index_documents = record
+
+    @asyncio.coroutine
+    def do_test():
+        ingester = Ingester(text_index, executor, loop, batch_size=4,
+                            delay=0.05, max_pending=2)
+        for i in range(10):
+            yield from ingester('http://example.com/{}'.format(i), 'Page',
+                                'Page number {}'.format(i))
+        yield from ingester.close()
+
+    loop.run_until_complete(do_test())
+    executor.shutdown()
+    assert sum(batches) == 10
+    assert max(batches) <= 4
+    assert text_index.query('page')['total'] == 10
+    text_index.close()
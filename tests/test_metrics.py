@@ -0,0 +1,82 @@
+import threading
+
+from metrics import Registry, counter, gauge, histogram
+from metrics.profiler import SamplingProfiler
+
+
+def test_render_prometheus_text():
+    """Metrics are rendered in Prometheus text exposition format."""
+    registry = Registry()
+    errors = counter('errors_total', 'Errors.', ['reason'],
+                     registry=registry)
+    errors.inc(reason='timeout')
+    errors.inc(2, reason='status')
+    size = gauge('queue_size', 'Queue size.', registry=registry)
+    size.set_function(lambda: 7)
+    latency = histogram('latency_seconds', 'Latency.', buckets=(0.1, 1),
+                        registry=registry)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    assert registry.render().splitlines() == [
+        '# HELP errors_total Errors.',
+        '# TYPE errors_total counter',
+        'errors_total{reason="status"} 2',
+        'errors_total{reason="timeout"} 1',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_sum 5.55',
+        'latency_seconds_count 3',
+        '# HELP queue_size Queue size.',
+        '# TYPE queue_size gauge',
+        'queue_size 7',
+    ]
+
+
+def test_register_returns_existing():
+    registry = Registry()
+    first = counter('pages_total', 'Pages.', registry=registry)
+    first.inc()
+    assert counter('pages_total', 'Pages.', registry=registry) is first
+    assert first.get() == 1
+
+
+def test_label_escaping():
+    registry = Registry()
+    counter('x_total', 'X.', ['path'], registry=registry).inc(path='a"b\n')
+    assert 'x_total{path="a\\"b\\n"} 1' in registry.render()
+
+
+def test_update_while_rendering():
+    """Metrics updated from other threads render and count every update."""
+    registry = Registry()
+    pages = counter('pages_total', 'Pages.', ['kind'], registry=registry)
+    latency = histogram('latency_seconds', 'Latency.', ['kind'],
+                        registry=registry)
+
+    def update():
+        for i in range(2000):
+            pages.inc(kind=str(i % 50))
+            latency.observe(0.01, kind=str(i % 50))
+
+    threads = [threading.Thread(target=update) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        registry.render()
+    for thread in threads:
+        thread.join()
+    assert sum(pages.get(kind=str(i)) for i in range(50)) == 8000
+    assert sum(latency.count(kind=str(i)) for i in range(50)) == 8000
+
+
+def test_sampling_profiler():
+    """Stacks of the profiled thread are counted."""
+    profiler = SamplingProfiler(thread_id=threading.get_ident())
+    profiler.sample()
+    assert profiler.samples == 1
+    assert 'test_metrics.py:test_sampling_profiler;' in profiler.folded()
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+from crawler.frontier import MemoryFrontier
+from crawler.politeness import HostScheduler
+
+
+@pytest.yield_fixture
+def loop():
+    """Setup loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+
+    # Clean-up
+    loop.close()
+
+
+def fill(loop, scheduler, urls):
+    """Move URLs through frontier to scheduler host queues."""
+    scheduler.frontier.add(urls)
+    for _ in urls:
+        scheduler.put(loop.run_until_complete(scheduler.frontier.get()))
+
+
+def take(loop, scheduler, count):
+    """Get count URLs from scheduler."""
+    return [loop.run_until_complete(scheduler.get()) for _ in range(count)]
+
+
+def test_rotate_hosts(loop):
+    """Workers alternate between hosts instead of draining one."""
+    scheduler = HostScheduler(MemoryFrontier(loop=loop), loop=loop,
+                              initial_concurrency=10)
+    fill(loop, scheduler, ['http://a.com/1', 'http://a.com/2',
+                           'http://a.com/3', 'http://b.com/1',
+                           'http://b.com/2'])
+    assert take(loop, scheduler, 4) == [
+        'http://a.com/1', 'http://b.com/1', 'http://a.com/2',
+        'http://b.com/2']
+
+
+def test_host_concurrency_limit(loop):
+    """Host limit grows on success and shrinks on errors."""
+    scheduler = HostScheduler(MemoryFrontier(loop=loop), loop=loop,
+                              initial_concurrency=1)
+    fill(loop, scheduler, ['http://a.com/{}'.format(i) for i in range(4)])
+    first = take(loop, scheduler, 1)[0]
+    assert scheduler._take(0) is None
+
+    scheduler.task_done(first, latency=0.1, ok=True)
+    host = scheduler.hosts['http://a.com']
+    assert host.concurrency == 2
+    urls = take(loop, scheduler, 2)
+    assert scheduler._take(0) is None
+
+    scheduler.task_done(urls[0], latency=0.1, ok=False)
+    assert host.concurrency == 1
+
+
+def test_robots_rules(loop):
+    """Disallowed URLs are skipped, crawl delay spaces fetches."""
+    @asyncio.coroutine
+    def fetch_robots(origin):
+        return 'User-agent: *\nDisallow: /private/\nCrawl-delay: 0.2\n'
+
+    scheduler = HostScheduler(MemoryFrontier(loop=loop), loop=loop,
+                              fetch_robots=fetch_robots,
+                              initial_concurrency=10)
+    fill(loop, scheduler, ['http://a.com/private/1', 'http://a.com/1',
+                           'http://a.com/2'])
+
+    start = loop.time()
+    assert take(loop, scheduler, 2) == ['http://a.com/1', 'http://a.com/2']
+    assert loop.time() - start >= 0.2
@@ -0,0 +1,83 @@
+import asyncio
+import pathlib
+
+import pytest
+from aiohttp import web
+
+from indexer.sharding import ShardedIndex
+from own_search.routes import setup_routes
+from own_search.shard import ShardClient, make_shard_app
+
+PROJ_ROOT = pathlib.Path(__file__).parent.parent / 'own_search'
+
+DOCUMENTS = [
+    ('Ottoman wars', 'The Ottoman wars in Europe were a series of wars'),
+    ('Robyn Love', 'Robyn Love was born in Scotland'),
+    ('Sony Alpha', 'The Sony Alpha camera is sold in Europe'),
+    ('Balkan wars', 'Two wars in the Balkans, one of many Europe wars'),
+    ('Camera review', 'A camera review: the Alpha camera and its lens'),
+    ('Scotland', 'Scotland is a country in Europe'),
+    ('Wars of Scotland', 'Scotland fought wars of independence'),
+]
+
+
+@pytest.fixture
+def sharded(tmpdir):
+    """Sharded index with flushed documents."""
+    index = ShardedIndex(str(tmpdir), 2)
+    for i, (title, summary) in enumerate(DOCUMENTS):
+        index.index_document('http://example.com/{}'.format(i), title,
+                             summary)
+    index.dump()
+    yield index
+    index.close()
+
+
+@asyncio.coroutine
+def start_shards(test_client, sharded):
+    """Serve every shard of sharded index, return their base URLs."""
+    urls = []
+    for shard in range(len(sharded.shards)):
+        client = yield from test_client(make_shard_app, sharded.path, shard)
+        urls.append(str(client.make_url('')))
+    return urls
+
+
+def make_search_app(loop, text_index, shard_client):
+    app = web.Application(loop=loop)
+    app['text_index'] = text_index
+    app['shard_client'] = shard_client
+    setup_routes(app, PROJ_ROOT)
+    return app
+
+
+@asyncio.coroutine
+def test_shard_client_matches_sharded_index(test_client, loop, sharded):
+    """Queries scattered to shard processes merge like in one process."""
+    urls = yield from start_shards(test_client, sharded)
+    shard_client = ShardClient(urls, loop)
+    for query in ('wars', 'alpha camera', '"ottoman wars"', 'missing'):
+        for offset in (0, 2):
+            page = yield from shard_client.query(query, match_count=2,
+                                                 offset=offset)
+            assert page == sharded.query(query, match_count=2,
+                                         offset=offset)
+
+    client = yield from test_client(make_search_app, sharded, shard_client)
+    resp = yield from client.post('/q', data={'query': 'europe wars'})
+    assert resp.status == 200
+    page = yield from resp.json()
+    assert len(page['items']) == 5
+    assert page == sharded.query('europe wars', match_count=10)
+    shard_client.close()
+
+
+@asyncio.coroutine
+def test_shard_down(test_client, loop, sharded):
+    """Search answers 503 when a shard does not respond."""
+    urls = yield from start_shards(test_client, sharded)
+    shard_client = ShardClient([urls[0], 'http://127.0.0.1:1'], loop)
+    client = yield from test_client(make_search_app, sharded, shard_client)
+    resp = yield from client.post('/q', data={'query': 'wars'})
+    assert resp.status == 503
+    shard_client.close()
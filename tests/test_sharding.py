@@ -0,0 +1,88 @@
+import pytest
+
+from indexer import TextIndex
+from indexer.sharding import ShardedIndex, shard_of
+
+DOCUMENTS = [
+    ('Ottoman wars', 'The Ottoman wars in Europe were a series of wars'),
+    ('Robyn Love', 'Robyn Love was born in Scotland'),
+    ('Sony Alpha', 'The Sony Alpha camera is sold in Europe'),
+    ('Balkan wars', 'Two wars in the Balkans, one of many Europe wars'),
+    ('Camera review', 'A camera review: the Alpha camera and its lens'),
+    ('Scotland', 'Scotland is a country in Europe'),
+    ('Alpha Centauri', 'Alpha Centauri is the closest star system'),
+    ('Wars of Scotland', 'Scotland fought wars of independence'),
+]
+
+
+@pytest.fixture
+def indexes(tmpdir):
+    """Single and sharded index with the same documents."""
+    single = TextIndex(str(tmpdir / 'single'))
+    sharded = ShardedIndex(str(tmpdir / 'sharded'), 3)
+    for i, (title, summary) in enumerate(DOCUMENTS):
+        link = 'http://example.com/{}'.format(i)
+        single.index_document(link, title, summary)
+        sharded.index_document(link, title, summary)
+    yield single, sharded
+    single.close()
+    sharded.close()
+
+
+def test_shard_routing(indexes):
+    """Documents are stored in the shard chosen by link."""
+    _, sharded = indexes
+    for i, (title, _) in enumerate(DOCUMENTS):
+        link = 'http://example.com/{}'.format(i)
+        shard = sharded.shards[shard_of(link, 3)]
+        assert shard.find_document(link)['title'] == title
+        assert sharded.find_document(link)['title'] == title
+    assert sum(1 for _ in sharded.iter_documents()) == len(DOCUMENTS)
+    assert sum(1 for s in sharded.shards if s.buffer.doc_count) > 1
+
+
+@pytest.mark.parametrize('query', [
+    'Europe wars', 'camera', 'Alpha', 'Scotland wars', '"Europe wars"'])
+def test_sharded_query_matches_single(indexes, query):
+    """Shards scored with global statistics rank like one index."""
+    single, sharded = indexes
+    sharded.dump()
+    expected = single.query(query, match_count=10, scores=True)
+    result = sharded.query(query, match_count=10)
+    assert result['total'] == expected['total']
+    expected_links = sorted(
+        expected['items'], key=lambda i: (-round(i['score'], 9), i['link']))
+    assert [i['link'] for i in result['items']] == \
+        [i['link'] for i in expected_links]
+    assert all('score' not in item for item in result['items'])
+
+
+def test_sharded_pagination(indexes):
+    """Pages of merged results follow each other."""
+    _, sharded = indexes
+    first = sharded.query('Europe', match_count=2)
+    second = sharded.query('Europe', match_count=2, offset=2)
+    everything = sharded.query('Europe', match_count=4)
+    assert first['total'] == second['total'] == 4
+    assert first['items'] + second['items'] == everything['items']
+
+
+def test_sharded_delete(indexes):
+    """Deletion is routed to the shard of the document."""
+    _, sharded = indexes
+    assert sharded.delete_document('http://example.com/1')
+    assert sharded.find_document('http://example.com/1') is None
+    assert sharded.query('Robyn')['total'] == 0
+
+
+def test_sharded_index_documents(tmpdir):
+    """A batch of documents is split among shards."""
+    sharded = ShardedIndex(str(tmpdir), 3)
+    assert sharded.index_documents([
+        {'link': 'http://example.com/{}'.format(i), 'title': title,
+         'summary': summary}
+        for i, (title, summary) in enumerate(DOCUMENTS)]) == len(DOCUMENTS)
+    for i, (title, _) in enumerate(DOCUMENTS):
+        link = 'http://example.com/{}'.format(i)
+        assert sharded.shard(link).find_document(link)['title'] == title
+    sharded.close()
@@ -0,0 +1,45 @@
+from indexer.analysis import DEFAULT_ANALYZER, make_analyzer
+from indexer.snippets import make_snippet
+
+TEXT = ('Lorem ipsum dolor sit amet. ' * 20 +
+        'The Ottoman wars in Europe were a series of wars. ' +
+        'Filler text here. ' * 20)
+
+
+def highlighted(snippet):
+    return [snippet['text'][start:end]
+            for start, end in snippet['highlights']]
+
+
+def test_snippet_window():
+    """Snippet is cut around the densest group of query terms."""
+    snippet = make_snippet(TEXT, ['europe', 'wars'], DEFAULT_ANALYZER, 80)
+    assert len(snippet['text']) <= 84
+    assert snippet['text'].startswith('… ')
+    assert snippet['text'].endswith(' …')
+    assert highlighted(snippet) == ['wars', 'Europe', 'wars']
+
+
+def test_snippet_analyzed_terms():
+    """Words are matched after analysis, like in the index."""
+    snippet = make_snippet('Stories of old wars', ['story', 'war'],
+                           make_analyzer(stem=True))
+    assert highlighted(snippet) == ['Stories', 'wars']
+
+
+def test_snippet_without_match():
+    """Text start is used when no query term is found."""
+    snippet = make_snippet(TEXT, ['missing'], DEFAULT_ANALYZER, 40)
+    assert snippet['text'].startswith('Lorem ipsum')
+    assert snippet['highlights'] == []
+
+
+def test_snippet_match_longer_than_size():
+    """Matched word longer than the snippet does not break the window."""
+    long_word = 'x' * 250
+    snippet = make_snippet('hello ' + long_word + ' world', [long_word],
+                           DEFAULT_ANALYZER)
+    assert len(snippet['text']) <= 204
+    snippet = make_snippet('wars ' + long_word + ' wars', ['wars', long_word],
+                           DEFAULT_ANALYZER, 20)
+    assert highlighted(snippet)[0] == 'wars'
@@ -0,0 +1,117 @@
+import random
+
+from indexer import TextIndex
+from indexer.analysis import make_analyzer
+from indexer.sharding import ShardedIndex
+from indexer.suggest import TermDictionary, complete_query
+
+DOCUMENTS = [
+    ('Scotland', 'Scotland is a country in Europe'),
+    ('Scottish wars', 'Scotland fought wars of independence'),
+    ('Scotch', 'Scotch whisky is made in Scotland'),
+    ('Sony Alpha', 'The Sony Alpha camera is sold in Europe'),
+]
+
+
+def brute_force(counts, prefix, limit):
+    """Best completions by scanning all terms."""
+    matches = sorted((-count, term) for term, count in counts.items()
+                     if term.startswith(prefix))
+    return [(term, -count) for count, term in matches[:limit]]
+
+
+def test_complete_by_count():
+    """Completions are ranked by count, then term."""
+    dictionary = TermDictionary()
+    dictionary.update([('scotland', 3), ('scotch', 1), ('scottish', 1),
+                       ('sony', 2)])
+    assert dictionary.complete('sco') == [
+        ('scotland', 3), ('scotch', 1), ('scottish', 1)]
+    assert dictionary.complete('s', limit=2) == [('scotland', 3),
+                                                 ('sony', 2)]
+    assert dictionary.complete('scotl') == [('scotland', 3)]
+    assert dictionary.complete('x') == []
+    assert dictionary.complete('') == []
+
+
+def test_incremental_matches_brute_force():
+    """Cached and scanned completions stay exact as terms are added."""
+    rng = random.Random(0)
+    dictionary = TermDictionary(cache_depth=2, cache_size=5)
+    counts = {}
+    for _ in range(3000):
+        term = ''.join(rng.choice('abc') for _ in range(rng.randint(1, 5)))
+        dictionary.add(term)
+        counts[term] = counts.get(term, 0) + 1
+    assert len(dictionary) == len(counts)
+    for prefix in ('a', 'b', 'ab', 'ca', 'abc', 'bca', 'cc'):
+        for limit in (3, 5, 8):
+            assert dictionary.complete(prefix, limit) == \
+                brute_force(counts, prefix, limit)
+
+
+def test_max_scan():
+    """Long prefixes scan a bounded number of terms."""
+    dictionary = TermDictionary(cache_depth=1, max_scan=2)
+    dictionary.update([('abc', 1), ('abd', 1), ('abe', 5)])
+    assert dictionary.complete('ab') == [('abc', 1), ('abd', 1)]
+
+
+def test_index_suggest(tmpdir):
+    """Index terms are suggested before and after flush and reload."""
+    text_index = TextIndex(str(tmpdir), suggestions=True)
+    for i, (title, summary) in enumerate(DOCUMENTS):
+        text_index.index_document('http://example.com/{}'.format(i),
+                                  title, summary)
+    expected = [('scotland', 3), ('scotch', 1), ('scottish', 1)]
+    assert text_index.suggest('sco') == expected
+    text_index.dump()
+    text_index.load()
+    assert text_index.suggest('sco') == expected
+    text_index.index_document('http://example.com/x', 'Scotch', 'Scotch')
+    assert text_index.suggest('sco', 2) == [('scotland', 3), ('scotch', 2)]
+    text_index.close()
+
+    assert TextIndex(str(tmpdir / 'plain')).suggest('sco') == []
+
+
+def test_sharded_suggest(tmpdir):
+    """Counts of all shards are summed."""
+    sharded = ShardedIndex(str(tmpdir), 3, suggestions=True)
+    for i, (title, summary) in enumerate(DOCUMENTS):
+        sharded.index_document('http://example.com/{}'.format(i),
+                               title, summary)
+    assert sharded.suggest('sco') == [('scotland', 3), ('scotch', 1),
+                                      ('scottish', 1)]
+    sharded.close()
+
+
+def test_complete_punctuated_query(tmpdir):
+    """Only the last word is replaced, punctuation before it is kept."""
+    text_index = TextIndex(str(tmpdir), suggestions=True)
+    text_index.index_document('http://example.com/1', 'Foo bar',
+                              'foo-bar barrel')
+    assert complete_query('foo-ba', text_index.suggest,
+                          text_index.analyzer) == [('foo-bar', 1),
+                                                   ('foo-barrel', 1)]
+    assert complete_query('Black Bar', text_index.suggest,
+                          text_index.analyzer, 1) == [('Black bar', 1)]
+    assert complete_query('foo-', text_index.suggest,
+                          text_index.analyzer) == []
+    assert complete_query('', text_index.suggest, text_index.analyzer) == []
+    text_index.close()
+
+
+def test_complete_stemmed_query(tmpdir):
+    """Typed words are analyzed like index terms."""
+    analyzer = make_analyzer('english', stem=True)
+    text_index = TextIndex(str(tmpdir), analyzer=analyzer,
+                           suggestions=True)
+    text_index.index_document('http://example.com/1', 'Cameras',
+                              'Cameras and theories')
+    assert complete_query('old cameras', text_index.suggest,
+                          analyzer) == [('old camera', 1)]
+    # Stopwords complete to longer words
+    assert complete_query('the', text_index.suggest,
+                          analyzer) == [('theory', 1)]
+    text_index.close()
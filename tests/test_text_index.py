@@ -0,0 +1,686 @@
+import json
+import os
+import random
+import threading
+
+import pytest
+
+from indexer import TextIndex
+from indexer.analysis import make_analyzer
+from indexer.convert import convert
+from indexer.segment import (DocumentStore, MemorySegment, SegmentReader,
+                             decode_postings, encode_postings)
+from indexer.text_index import INDEX_SIZE, document_terms, measure_size
+
+
+@pytest.fixture
+def text_index(tmpdir):
+    """Empty index stored in a temporary directory."""
+    index = TextIndex(str(tmpdir / 'text_index'))
+    yield index
+    index.close()
+
+
+def fill(index):
+    index.index_document('http://example.com/1', 'Ottoman wars',
+                         'The Ottoman wars in Europe were a series of wars')
+    index.index_document('http://example.com/2', 'Robyn Love',
+                         'Robyn Love was born in Scotland')
+    index.index_document('http://example.com/3', 'Sony Alpha',
+                         'The Sony Alpha camera is sold in Europe')
+
+
+def test_query_ranking(text_index):
+    """Documents with more query term occurrences go first."""
+    fill(text_index)
+    result = text_index.query('Europe wars')
+    links = [item['link'] for item in result['items']]
+    assert links == ['http://example.com/1', 'http://example.com/3']
+
+
+def test_query_result_shape(text_index):
+    """Query results hold link, title and highlighted snippet."""
+    fill(text_index)
+    result = text_index.query('Scotland')
+    assert result['total'] == 1
+    assert result['items'] == [{
+        'link': 'http://example.com/2',
+        'title': 'Robyn Love',
+        'snippet': {'text': 'Robyn Love was born in Scotland',
+                    'highlights': [[23, 31]]}}]
+
+
+def test_query_pagination(text_index):
+    """Total counts all matches, items only the requested page."""
+    fill(text_index)
+    result = text_index.query('Europe wars', match_count=1, offset=1)
+    assert result['total'] == 2
+    assert result['offset'] == 1 and result['limit'] == 1
+    assert [item['link'] for item in result['items']] == \
+        ['http://example.com/3']
+
+
+def test_query_no_match(text_index):
+    """Unknown terms give empty result."""
+    fill(text_index)
+    assert text_index.query('missing') == {
+        'items': [], 'total': 0, 'total_exact': True, 'offset': 0,
+        'limit': 3}
+
+
+def test_dump_and_load(text_index):
+    """Dumped segments give the same results after reopening."""
+    fill(text_index)
+    expected = text_index.query('Europe wars')
+    text_index.dump()
+    assert text_index.buffer.doc_count == 0
+    assert text_index.query('Europe wars') == expected
+
+    loaded = TextIndex(text_index.path)
+    assert len(loaded.segments) == 1
+    assert loaded.query('Europe wars') == expected
+    loaded.close()
+
+
+def test_query_across_segments(text_index):
+    """Documents from disk segments and memory buffer are ranked together."""
+    fill(text_index)
+    text_index.dump()
+    text_index.index_document('http://example.com/4', 'Wars',
+                              'wars wars wars')
+    links = [item['link'] for item in
+             text_index.query('wars', match_count=10)['items']]
+    assert links == ['http://example.com/4', 'http://example.com/1']
+
+
+def test_postings_encoding():
+    """Delta coded postings survive round trip."""
+    postings = [(0, 1), (5, 300), (100000, 2)]
+    buf = encode_postings(postings)
+    assert list(decode_postings(buf, 0, len(buf))) == postings
+
+
+def test_convert_json(tmpdir):
+    """Legacy JSON index is converted to segments."""
+    datafile = str(tmpdir / 'text_index.json')
+    with open(datafile, 'w') as f:
+        json.dump({'items': [{'vector': ['Sony', 'Alpha', 'camera'],
+                              'summary': 'camera',
+                              'title': 'Sony Alpha',
+                              'link': 'http://example.com/3'}]}, f)
+    path = str(tmpdir / 'text_index')
+    assert convert(datafile, path) == 1
+
+    index = TextIndex(path)
+    assert index.query('camera')['items'] == [
+        {'snippet': {'text': 'camera', 'highlights': [[0, 6]]},
+         'title': 'Sony Alpha', 'link': 'http://example.com/3'}]
+    index.close()
+
+
+def test_convert_analyzer(tmpdir):
+    """Legacy documents are analyzed with the given analyzer."""
+    datafile = str(tmpdir / 'text_index.json')
+    with open(datafile, 'w') as f:
+        json.dump({'items': [{'summary': 'The cameras',
+                              'title': 'Sony Alpha',
+                              'link': 'http://example.com/3'}]}, f)
+    path = str(tmpdir / 'text_index')
+    analyzer = make_analyzer(stopwords='english', stem=True)
+    convert(datafile, path, analyzer)
+
+    index = TextIndex(path, analyzer=analyzer)
+    assert index.query('camera')['total'] == 1
+    index.close()
+    index = TextIndex(path)
+    assert index.query('cameras')['total'] == 0
+    assert index.query('the')['total'] == 0
+    index.close()
+
+
+def test_convert_duplicate_links(tmpdir):
+    """Only the last of legacy documents with the same link is kept."""
+    datafile = str(tmpdir / 'text_index.json')
+    items = [{'summary': 'Old camera', 'title': 'Sony Alpha',
+              'link': 'http://example.com/3'},
+             {'summary': 'New camera', 'title': 'Sony Alpha',
+              'link': 'http://example.com/3'}]
+    with open(datafile, 'w') as f:
+        json.dump({'items': items}, f)
+    path = str(tmpdir / 'text_index')
+    convert(datafile, path)
+
+    index = TextIndex(path)
+    assert index.query('camera')['total'] == 1
+    assert index.find_document('http://example.com/3')['summary'] == \
+        'New camera'
+    assert index.query('old')['total'] == 0
+    index.close()
+
+
+def test_query_match_count(text_index):
+    """Only match_count best documents starting from offset are returned."""
+    fill(text_index)
+    links = [item['link'] for item in
+             text_index.query('in', match_count=10)['items']]
+    assert len(links) == 3
+    first = text_index.query('in', match_count=2)['items']
+    assert [item['link'] for item in first] == links[:2]
+    rest = text_index.query('in', match_count=2, offset=2)['items']
+    assert [item['link'] for item in rest] == links[2:]
+
+
+def test_query_length_normalization(text_index):
+    """Shorter document wins when term frequencies are equal."""
+    text_index.index_document('http://example.com/long', 'Long',
+                              'camera ' + 'filler ' * 50)
+    text_index.index_document('http://example.com/short', 'Short',
+                              'camera')
+    result = text_index.query('camera')
+    assert result['items'][0]['link'] == 'http://example.com/short'
+
+
+def test_query_rare_term_weight(text_index):
+    """Rare terms contribute more than common ones."""
+    fill(text_index)
+    text_index.index_document('http://example.com/4', 'Travel',
+                              'Europe Europe Europe')
+    result = text_index.query('Scotland Europe')
+    assert result['items'][0]['link'] == 'http://example.com/2'
+
+
+def test_wal_replay(text_index):
+    """Documents not dumped before a crash are restored from the log."""
+    fill(text_index)
+    expected = text_index.query('Europe wars')
+    text_index.close()
+
+    restored = TextIndex(text_index.path)
+    assert restored.buffer.doc_count == 3
+    assert restored.query('Europe wars') == expected
+    restored.close()
+
+
+def test_wal_truncated_record(text_index):
+    """Partially written log record is ignored on replay."""
+    fill(text_index)
+    text_index.close()
+    wal_file = text_index._wal_file(text_index.wal_generation)
+    with open(wal_file, 'ab') as f:
+        f.write(b'\x10\x00')
+
+    restored = TextIndex(text_index.path)
+    assert restored.buffer.doc_count == 3
+    restored.close()
+
+
+def test_flush_drops_wal(text_index):
+    """Flushed documents are not replayed again."""
+    fill(text_index)
+    pending = text_index.start_flush()
+    text_index.index_document('http://example.com/4', 'Wars', 'wars')
+    assert len(text_index.query('wars', match_count=10)['items']) == 2
+    text_index.write_flush(pending)
+    text_index.finish_flush(pending)
+    text_index.close()
+
+    restored = TextIndex(text_index.path)
+    assert len(restored.segments) == 1
+    assert restored.buffer.doc_count == 1
+    assert len(restored.query('wars', match_count=10)['items']) == 2
+    restored.close()
+
+
+def test_index_pretokenized(text_index):
+    """Terms tokenized elsewhere give the same index."""
+    text_index.index_document('http://example.com/1', 'Ottoman wars',
+                              'wars in Europe',
+                              terms=document_terms('Ottoman wars',
+                                                   'wars in Europe'))
+    assert text_index.query('Europe')['items'][0]['link'] == \
+        'http://example.com/1'
+
+
+def test_update_document(text_index):
+    """Indexing the same link replaces the previous version."""
+    fill(text_index)
+    text_index.dump()
+    assert text_index.index_document('http://example.com/2', 'Robyn Love',
+                                     'Robyn Love moved to Glasgow')
+    assert text_index.query('Scotland')['items'] == []
+    assert text_index.query('Glasgow')['items'][0]['link'] == \
+        'http://example.com/2'
+    assert text_index.find_document('http://example.com/2')['changes'] == 1
+    assert len(list(text_index.iter_documents())) == 3
+
+
+def test_unchanged_document(text_index):
+    """Same content is not indexed again."""
+    fill(text_index)
+    assert not text_index.index_document('http://example.com/2',
+                                         'Robyn Love',
+                                         'Robyn Love was born in Scotland')
+    assert text_index.buffer.doc_count == 3
+
+
+def test_delete_document(text_index):
+    """Deleted documents disappear and stay deleted after restart."""
+    fill(text_index)
+    text_index.dump()
+    assert text_index.delete_document('http://example.com/1')
+    assert not text_index.delete_document('http://example.com/1')
+    assert text_index.find_document('http://example.com/1') is None
+    links = [item['link'] for item in
+             text_index.query('Europe', match_count=10)['items']]
+    assert links == ['http://example.com/3']
+
+    # Deletion is replayed from the log
+    text_index.close()
+    restored = TextIndex(text_index.path)
+    assert restored.find_document('http://example.com/1') is None
+
+    # and stored next to the segment after flush
+    restored.index_document('http://example.com/4', 'Wars', 'wars')
+    restored.dump()
+    restored.close()
+    restored = TextIndex(restored.path)
+    assert restored.find_document('http://example.com/1') is None
+    assert restored.find_document('http://example.com/3')['title'] == \
+        'Sony Alpha'
+    restored.close()
+
+
+def test_generation_changes(text_index):
+    """Adding and deleting documents bumps generation, no-ops do not."""
+    generation = text_index.generation
+    fill(text_index)
+    assert text_index.generation > generation
+    generation = text_index.generation
+    text_index.index_document('http://example.com/2', 'Robyn Love',
+                              'Robyn Love was born in Scotland')
+    assert text_index.generation == generation
+    text_index.delete_document('http://example.com/2')
+    assert text_index.generation > generation
+
+
+def fill_phrases(index):
+    index.index_document('http://example.com/near', 'Coast',
+                         'Visit the black sea coast in summer and winter')
+    index.index_document('http://example.com/far', 'Coast',
+                         'Sea water is black at night')
+
+
+@pytest.mark.parametrize('dump', [False, True])
+def test_phrase_query(text_index, dump):
+    """Quoted phrase matches adjacent terms in order only."""
+    fill_phrases(text_index)
+    if dump:
+        text_index.dump()
+    links = [item['link'] for item in
+             text_index.query('"black sea"')['items']]
+    assert links == ['http://example.com/near']
+    assert text_index.query('"sea black"')['items'] == []
+    links = [item['link'] for item in
+             text_index.query('coast "sea"')['items']]
+    assert sorted(links) == ['http://example.com/far',
+                             'http://example.com/near']
+
+
+def test_phrase_query_after_replay(text_index):
+    """Positions are restored from the write-ahead log."""
+    fill_phrases(text_index)
+    text_index.close()
+    restored = TextIndex(text_index.path)
+    links = [item['link'] for item in restored.query('"black sea"')['items']]
+    restored.close()
+    assert links == ['http://example.com/near']
+
+
+def test_proximity_boost(text_index):
+    """Documents with query terms next to each other rank first."""
+    fill_phrases(text_index)
+    links = [item['link'] for item in text_index.query('black sea')['items']]
+    assert links[0] == 'http://example.com/near'
+
+    text_index.proximity = 0
+    links = [item['link'] for item in text_index.query('black sea')['items']]
+    assert links[0] == 'http://example.com/far'
+
+
+def test_segment_without_positions(text_index):
+    """Phrase terms are only required together in old segments."""
+    fill_phrases(text_index)
+    text_index.dump()
+    name = text_index.segments[0].name
+    text_index.close()
+    for ext in ('.pix', '.pos'):
+        os.remove(os.path.join(text_index.path, name + ext))
+
+    restored = TextIndex(text_index.path)
+    links = [item['link'] for item in restored.query('"black sea"')['items']]
+    restored.close()
+    assert sorted(links) == ['http://example.com/far',
+                             'http://example.com/near']
+
+
+def test_read_only_refresh(text_index):
+    """Read only index sees documents once they are flushed."""
+    fill(text_index)
+    reader = TextIndex(text_index.path, read_only=True)
+    assert reader.query('Scotland')['total'] == 0
+    assert not reader.refresh()
+
+    text_index.dump()
+    assert reader.refresh()
+    assert reader.query('Scotland')['total'] == 1
+    assert not reader.refresh()
+    assert reader.wal is None
+    reader.close()
+
+
+def test_refresh_closes_segments_on_error(text_index, monkeypatch):
+    """Segments opened before a file went missing are closed."""
+    fill(text_index)
+    text_index.dump()
+    text_index.index_document('http://example.com/4', 'Black sea',
+                              'The Black sea is a sea in Europe')
+    text_index.dump()
+    text_index.delete_document('http://example.com/4')
+    text_index.dump()
+    deletions = text_index.segments[1].deletions
+    os.remove(os.path.join(text_index.path, deletions))
+
+    closed = []
+    close = SegmentReader.close
+
+    def record(segment):
+        closed.append(segment.name)
+        close(segment)
+
+    monkeypatch.setattr(SegmentReader, 'close', record)
+    reader = TextIndex(text_index.path, read_only=True)
+    assert closed == [text_index.segments[0].name]
+    assert reader.segments == []
+    reader.close()
+
+
+def test_document_store_round_trip():
+    """Stored fields come back as added, odd ones included."""
+    store = DocumentStore()
+    documents = [
+        {'link': 'http://example.com/1', 'title': 'One', 'summary': 'Text',
+         'hash': 'abc', 'etag': None, 'last_modified': None,
+         'indexed': 1.5, 'first_seen': 1.5, 'changes': 2},
+        {'link': 'http://example.com/2', 'title': 'Two', 'summary': ''},
+        {'link': 'http://example.com/3', 'title': 3, 'summary': 'x',
+         'indexed': 10, 'changes': 1.0, 'lang': 'en'},
+    ]
+    for i, fields in enumerate(documents):
+        assert store.append(fields) == i
+    for i, fields in enumerate(documents):
+        stored = store.get(i)
+        assert stored == fields
+        assert [type(v) for v in stored.values()] == \
+            [type(fields[k]) for k in stored]
+
+
+def test_memory_segment_postings():
+    """Postings and positions of memory segment are in doc id order."""
+    segment = MemorySegment()
+    segment.add({'link': 'a'}, {'x': 2, 'y': 1}, {'x': [0, 2], 'y': [1]})
+    segment.add({'link': 'b'}, {'y': 1})
+    segment.add({'link': 'c'}, {'x': 1}, {'x': [5]})
+    assert list(segment.postings('x')) == [(0, 2), (2, 1)]
+    assert list(segment.positions('x')) == [(0, [0, 2]), (2, [5])]
+    assert list(segment.positions('y')) == [(0, [1]), (1, [])]
+    assert segment.doc_freq('y') == 2 and segment.doc_freq('z') == 0
+    assert segment.doc_length(0) == 3 and segment.total_length == 5
+    assert segment.find('b') == 1
+
+
+def fill_random(index, count=700, seed=0):
+    """Index documents of skewed random words, flushing some of them."""
+    rng = random.Random(seed)
+    words = ['w{}'.format(i) for i in range(200)]
+    for i in range(count):
+        text = ' '.join(words[int(len(words) * rng.random() ** 3)]
+                        for _ in range(rng.randint(5, 60)))
+        index.index_document('http://example.com/{}'.format(i), 'Page', text)
+        if i == count // 2:
+            index.dump()
+    for i in range(0, count, 7):
+        index.delete_document('http://example.com/{}'.format(i))
+
+
+@pytest.mark.parametrize('proximity', [0, 1.0])
+def test_pruned_query_matches_exhaustive(text_index, proximity):
+    """Skipping documents does not change results."""
+    fill_random(text_index)
+    text_index.proximity = proximity
+    rng = random.Random(1)
+    skipped = False
+    for _ in range(50):
+        query = ' '.join('w{}'.format(int(200 * rng.random() ** 2))
+                         for _ in range(rng.randint(1, 4)))
+        text_index.pruning = False
+        expected = text_index.query(query, match_count=5, offset=2,
+                                    scores=True)
+        text_index.pruning = True
+        result = text_index.query(query, match_count=5, offset=2,
+                                  scores=True, exact_total=0)
+        assert result['items'] == expected['items']
+        assert result['total'] <= expected['total']
+        skipped = skipped or not result['total_exact']
+    assert skipped
+
+
+def test_pruned_query_exact_total(text_index):
+    """Totals are exact until exact_total matches are counted."""
+    fill_random(text_index)
+    expected = text_index.query('w0 w1', exact_total=10 ** 6)
+    assert expected['total_exact']
+    result = text_index.query('w0 w1', exact_total=0)
+    assert not result['total_exact']
+    assert result['items'] == expected['items']
+
+
+def test_pruning_without_blocks(text_index):
+    """Segments written without postings blocks are searched whole."""
+    fill_random(text_index)
+    text_index.dump()
+    names = [s.name for s in text_index.segments]
+    text_index.close()
+    for name in names:
+        for ext in ('.bix', '.blk'):
+            os.remove(os.path.join(text_index.path, name + ext))
+
+    restored = TextIndex(text_index.path)
+    restored.pruning = False
+    expected = restored.query('w3 w10 w40', match_count=10)
+    restored.pruning = True
+    result = restored.query('w3 w10 w40', match_count=10, exact_total=0)
+    restored.close()
+    assert result['items'] == expected['items']
+
+
+def test_memory_view_isolation():
+    """Memory segment views ignore documents added and deleted later."""
+    segment = MemorySegment()
+    segment.add({'link': 'a'}, {'x': 2}, {'x': [0, 1]})
+    view = segment.view()
+    segment.deleted.add(0)
+    segment.add({'link': 'a'}, {'x': 1, 'y': 1}, {'x': [0], 'y': [1]})
+    assert view.doc_count == 1 and view.total_length == 2
+    assert view.find('a') == 0 and segment.find('a') == 1
+    assert list(view.postings('x')) == [(0, 2)]
+    assert list(view.positions('x')) == [(0, [0, 1])]
+    docs, freqs = view.postings_blocks('x')[1](0)
+    assert list(docs) == [0] and list(freqs) == [2]
+    assert view.doc_freq('y') == 0 and view.postings_blocks('y') is None
+
+
+def test_snapshot_isolation(text_index):
+    """Queries of a snapshot are not affected by later changes."""
+    fill(text_index)
+    text_index.dump()
+    snapshot = text_index.snapshot
+    expected = text_index.query('Europe Scotland', match_count=10)
+    text_index.index_document('http://example.com/4', 'Europe', 'Europe')
+    text_index.index_document('http://example.com/2', 'Robyn Love',
+                              'Robyn Love moved to Glasgow')
+    text_index.delete_document('http://example.com/1')
+    assert text_index.query('Europe Scotland',
+                            match_count=10) != expected
+    current, text_index.snapshot = text_index.snapshot, snapshot
+    assert text_index.query('Europe Scotland', match_count=10) == expected
+    assert text_index.find_document('http://example.com/1') is not None
+    text_index.snapshot = current
+    assert text_index.find_document('http://example.com/1') is None
+
+
+def test_concurrent_batches(text_index):
+    """Batches indexed by another thread are seen whole by queries."""
+    batches = 30
+
+    def ingest():
+        for batch in range(batches):
+            text_index.index_documents([
+                {'link': 'http://example.com/{}/{}'.format(batch, i),
+                 'title': 'Page', 'summary': 'common {}'.format(batch)}
+                for i in range(10)])
+            if batch % 7 == 0:
+                text_index.dump()
+
+    thread = threading.Thread(target=ingest)
+    thread.start()
+    while thread.is_alive():
+        page = text_index.query('common page', match_count=10)
+        assert page['total'] % 10 == 0
+        assert len(page['items']) == min(page['total'], 10)
+    thread.join()
+    assert text_index.query('common')['total'] == batches * 10
+
+
+def test_merge_segments(text_index):
+    """Merged segments drop deleted documents and match the same ones."""
+    text_index.merge_factor = 3
+    fill_random(text_index, count=300)
+    for i in range(1, 300, 60):
+        text_index.index_document('http://example.com/{}'.format(i),
+                                  'Page', 'w1 w2 w3')
+        text_index.dump()
+    queries = ['w0', 'w1 w2', 'w5 w7 w9', '"w1 w2"']
+
+    def matches():
+        return [sorted(item['link'] for item in text_index.query(
+            q, match_count=1000)['items']) for q in queries]
+
+    expected = matches()
+    count = len(text_index.segments)
+    pending = text_index.start_merge()
+    assert len(pending.segments) == 3
+    text_index.write_merge(pending)
+    # Deleted while the merge was written
+    text_index.delete_document('http://example.com/3')
+    text_index.finish_merge(pending)
+    assert len(text_index.segments) == count - 2
+    assert text_index.find_document('http://example.com/3') is None
+    assert matches() == [[link for link in links
+                          if link != 'http://example.com/3']
+                         for links in expected]
+    text_index.merge_factor = 0
+    assert text_index.start_merge() is None
+
+    # Merged files are removed with the next manifest change
+    names = [segment.name for segment in pending.segments]
+    del pending
+    text_index.delete_document('http://example.com/5')
+    text_index.dump()
+    files = os.listdir(text_index.path)
+    for name in names:
+        assert not [f for f in files if f.startswith(name)]
+    text_index.close()
+    restored = TextIndex(text_index.path)
+    assert restored.find_document('http://example.com/3') is None
+    assert restored.find_document('http://example.com/5') is None
+    restored.close()
+
+
+def fill_segments(index):
+    """Index two segments of three documents."""
+    fill(index)
+    index.dump()
+    for i in range(4, 7):
+        index.index_document('http://example.com/{}'.format(i), 'Black sea',
+                             'The Black sea number {}'.format(i))
+    index.dump()
+
+
+def merge_all(text_index):
+    """Merge all segments, return names of the merged ones."""
+    text_index.merge_factor = len(text_index.segments)
+    pending = text_index.start_merge()
+    text_index.write_merge(pending)
+    text_index.finish_merge(pending)
+    return [segment.name for segment in pending.segments]
+
+
+def segment_files(text_index, names):
+    return [f for f in os.listdir(text_index.path)
+            if f.split('.')[0] in names]
+
+
+def test_retired_segments_kept_while_read(text_index):
+    """Merged segments are closed once no query reads them."""
+    fill_segments(text_index)
+    documents = text_index.iter_documents()
+    next(documents)
+    names = merge_all(text_index)
+
+    text_index.delete_document('http://example.com/4')
+    text_index.dump()
+    assert segment_files(text_index, names)
+    # Older snapshot is still readable
+    assert len(list(documents)) == 5
+
+    del documents
+    text_index.delete_document('http://example.com/3')
+    text_index.dump()
+    assert not segment_files(text_index, names)
+    assert text_index.retired == []
+
+
+def test_retired_segments_removed_later(text_index, monkeypatch):
+    """Files which can not be removed yet are removed with a later change."""
+    fill_segments(text_index)
+    names = merge_all(text_index)
+
+    def locked(path, name):
+        raise PermissionError(name)
+
+    monkeypatch.setattr('indexer.text_index.remove_segment', locked)
+    text_index.delete_document('http://example.com/4')
+    text_index.dump()
+    assert segment_files(text_index, names)
+    assert len(text_index.retired) == 2
+
+    monkeypatch.undo()
+    text_index.delete_document('http://example.com/3')
+    text_index.dump()
+    assert not segment_files(text_index, names)
+    assert text_index.retired == []
+
+
+def test_measure_size(tmpdir):
+    """Index size is summed over all indexes."""
+    indexes = [TextIndex(str(tmpdir / str(i))) for i in range(2)]
+    measure_size(indexes)
+    for index in indexes:
+        fill(index)
+    indexes[0].dump()
+    assert INDEX_SIZE.get(item='segments') == 1
+    assert INDEX_SIZE.get(item='buffered') == 3
+    TextIndex(str(tmpdir / 'other')).close()
+    assert INDEX_SIZE.get(item='buffered') == 3
+    for index in indexes:
+        index.close()
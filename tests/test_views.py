@@ -0,0 +1,192 @@
+import asyncio
+import pathlib
+
+import pytest
+from aiohttp import web
+
+from indexer import TextIndex
+from own_search.cache import QueryCache
+from own_search.routes import setup_routes
+from own_search.views import MAX_LIMIT, REQUESTS, metrics_middleware
+
+PROJ_ROOT = pathlib.Path(__file__).parent.parent / 'own_search'
+
+
+@pytest.fixture
+def text_index(tmpdir):
+    """Index of numbered pages about wars."""
+    index = TextIndex(str(tmpdir))
+    for i in range(15):
+        index.index_document('http://example.com/{}'.format(i),
+                             'Page {}'.format(i),
+                             'Wars in Europe ' * (i + 1))
+    yield index
+    index.close()
+
+
+def make_app(loop, text_index, **extra):
+    app = web.Application(loop=loop, middlewares=[metrics_middleware])
+    app['text_index'] = text_index
+    app.update(extra)
+    setup_routes(app, PROJ_ROOT)
+    return app
+
+
+@asyncio.coroutine
+def post_query(client, **data):
+    resp = yield from client.post('/q', data=data)
+    if resp.status != 200:
+        return resp.status, (yield from resp.text())
+    return resp.status, (yield from resp.json())
+
+
+@asyncio.coroutine
+def test_query_pages(test_client, text_index):
+    """Results are paged by limit and offset."""
+    client = yield from test_client(make_app, text_index)
+    status, page = yield from post_query(client, query='wars')
+    assert status == 200
+    assert page['total'] == 15
+    assert page['offset'] == 0
+    assert page['limit'] == 10
+    assert len(page['items']) == 10
+    assert set(page['items'][0]) == {'link', 'title', 'snippet'}
+    assert set(page['items'][0]['snippet']) == {'text', 'highlights'}
+
+    status, second = yield from post_query(client, query='wars', limit='4',
+                                           offset='12')
+    assert status == 200
+    assert (second['offset'], second['limit']) == (12, 4)
+    assert len(second['items']) == 3
+    links = [item['link'] for item in page['items']]
+    assert not set(links) & {item['link'] for item in second['items']}
+
+    status, page = yield from post_query(client, query='wars',
+                                         limit=str(MAX_LIMIT + 1))
+    assert status == 200
+    assert page['limit'] == MAX_LIMIT
+
+
+@asyncio.coroutine
+def test_query_bad_parameters(test_client, text_index):
+    """Invalid query parameters are answered with 400."""
+    client = yield from test_client(make_app, text_index)
+    for data in ({'limit': '1'},
+                 {'query': 'wars', 'limit': 'ten'},
+                 {'query': 'wars', 'limit': '0'},
+                 {'query': 'wars', 'offset': '-1'},
+                 {'query': 'wars', 'offset': '1.5'}):
+        status, text = yield from post_query(client, **data)
+        assert status == 400, data
+        assert text
+
+
+@asyncio.coroutine
+def test_query_cache(test_client, text_index):
+    """Repeated queries hit the cache until the index changes."""
+    cache = QueryCache()
+    client = yield from test_client(make_app, text_index, query_cache=cache)
+    _, first = yield from post_query(client, query='Wars')
+    _, second = yield from post_query(client, query=' wars ')
+    assert second == first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    text_index.index_document('http://example.com/new', 'New',
+                              'Wars ' * 100)
+    _, third = yield from post_query(client, query='wars')
+    assert cache.misses == 2
+    assert third['total'] == 16
+    assert third['items'][0]['link'] == 'http://example.com/new'
+
+    resp = yield from client.get('/stats')
+    assert resp.status == 200
+    assert (yield from resp.json()) == {'query_cache': {
+        'entries': 1, 'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3}}
+
+
+@asyncio.coroutine
+def test_stats_without_cache(test_client, text_index):
+    """Statistics of disabled features are left out."""
+    client = yield from test_client(make_app, text_index)
+    resp = yield from client.get('/stats')
+    assert resp.status == 200
+    assert (yield from resp.json()) == {}
+
+
+@asyncio.coroutine
+def test_document(test_client, text_index):
+    """Full text of a result is served by link."""
+    client = yield from test_client(make_app, text_index)
+    resp = yield from client.get('/doc',
+                                 params={'link': 'http://example.com/1'})
+    assert resp.status == 200
+    assert (yield from resp.json()) == {
+        'link': 'http://example.com/1', 'title': 'Page 1',
+        'summary': 'Wars in Europe Wars in Europe '}
+
+    resp = yield from client.get('/doc',
+                                 params={'link': 'http://example.com/x'})
+    assert resp.status == 404
+    resp = yield from client.get('/doc')
+    assert resp.status == 400
+
+
+@asyncio.coroutine
+def test_metrics(test_client, text_index):
+    """Handled requests are counted in Prometheus text format."""
+    client = yield from test_client(make_app, text_index)
+    before = REQUESTS.get(handler='query', status=400)
+    yield from post_query(client, query='wars', limit='x')
+    assert REQUESTS.get(handler='query', status=400) == before + 1
+
+    resp = yield from client.get('/metrics')
+    assert resp.status == 200
+    assert resp.headers['Content-Type'].startswith('text/plain')
+    text = yield from resp.text()
+    assert '# TYPE http_requests_total counter' in text
+    assert ('http_requests_total{handler="query",status="400"} %d'
+            % (before + 1)) in text
+    assert 'http_request_seconds_count{handler="query"}' in text
+
+    resp = yield from client.get('/profile')
+    assert resp.status == 404
+
+
+@asyncio.coroutine
+def test_suggest(test_client, tmpdir):
+    """Last word is completed with index terms by document count."""
+    text_index = TextIndex(str(tmpdir.mkdir('suggest')), suggestions=True)
+    text_index.index_document('http://example.com/1', 'Page one',
+                              'Wars in Europe')
+    text_index.index_document('http://example.com/2', 'Page two',
+                              'Europe at war, Eurasia')
+    try:
+        client = yield from test_client(make_app, text_index)
+        resp = yield from client.get('/suggest', params={'q': 'wars in eu'})
+        assert resp.status == 200
+        assert (yield from resp.json()) == {
+            'query': 'wars in eu',
+            'suggestions': [{'text': 'wars in europe', 'count': 2},
+                            {'text': 'wars in eurasia', 'count': 1}]}
+
+        resp = yield from client.get('/suggest',
+                                     params={'q': 'wars in eu', 'limit': 1})
+        assert resp.status == 200
+        suggestions = (yield from resp.json())['suggestions']
+        assert [s['text'] for s in suggestions] == ['wars in europe']
+
+        resp = yield from client.get('/suggest', params={'q': 'wars '})
+        assert resp.status == 200
+        assert (yield from resp.json())['suggestions'] == []
+
+        resp = yield from client.get(
+            '/suggest', params={'q': 'eu', 'limit': MAX_LIMIT + 1})
+        assert resp.status == 200
+        assert len((yield from resp.json())['suggestions']) == 2
+
+        for limit in ('x', '0'):
+            resp = yield from client.get('/suggest',
+                                         params={'q': 'eu', 'limit': limit})
+            assert resp.status == 400
+    finally:
+        text_index.close()